@@ -0,0 +1,187 @@
+import os
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
+
+DEFAULT_STORE_ROOT = Path(__file__).parent.parent / config.get('data', 'bar_store', fallback='assets/bar_store')
+
+
+class BarStore:
+    """
+    本地K线列式存储。
+
+    目录结构为 ``{root}/{period}/{stock_code}/{partition}.parquet``：
+    日线及以上周期按年分区（``2024.parquet``），分钟等日内周期按交易日分区（``20240102.parquet``）。
+    写入时只合并并重写受影响的分区，读取时按股票、日期分区和列进行裁剪。
+    数据格式与 ``get_stock_data_as_dataframe`` 的返回值一致：索引名为 ``date``，并带有 ``stock_code`` 列。
+    """
+
+    INDEX_NAME = 'date'
+    CODE_COLUMN = 'stock_code'
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root is not None else DEFAULT_STORE_ROOT
+
+    @staticmethod
+    def partition_width(period: str) -> int:
+        """
+        分区键在日期字符串中的前缀长度：日线及以上按年（4位），日内周期按日（8位）。
+        """
+        return 4 if period.endswith(('d', 'w', 'mon', 'y')) else 8
+
+    def _stock_dir(self, period: str, stock_code: str) -> Path:
+        return self.root / period / stock_code
+
+    def _partition_path(self, period: str, stock_code: str, key: str) -> Path:
+        return self._stock_dir(period, stock_code) / f'{key}.parquet'
+
+    def stocks(self, period: str) -> List[str]:
+        """
+        返回指定周期下已存储的股票代码列表。
+        """
+        period_dir = self.root / period
+        if not period_dir.exists():
+            return []
+        return sorted(p.name for p in period_dir.iterdir() if p.is_dir())
+
+    def partitions(self, period: str, stock_code: str) -> List[str]:
+        """
+        返回指定股票已存储的分区键（升序）。
+        """
+        stock_dir = self._stock_dir(period, stock_code)
+        if not stock_dir.exists():
+            return []
+        return sorted(p.stem for p in stock_dir.glob('*.parquet'))
+
+    def append(self, df: pd.DataFrame, period: str = '1d') -> int:
+        """
+        将新K线追加写入存储，规则见 ``append_stock``。
+
+        :param df: 长表格式的数据，索引为日期字符串，包含 ``stock_code`` 列
+        :param period: 时间周期，默认 '1d'
+        :return: 被重写的分区数量
+        """
+        if df.empty:
+            return 0
+        written = sum(
+            self.append_stock(stock_code, part.drop(columns=self.CODE_COLUMN), period)
+            for stock_code, part in df.groupby(self.CODE_COLUMN, sort=False)
+        )
+        logger.info(f"K线存储 [{period}] 已更新 {written} 个分区")
+        return written
+
+    def append_local_data(self, market_data: Dict[str, pd.DataFrame], period: str = '1d') -> int:
+        """
+        直接写入 ``xtdata.get_local_data`` 的返回值（股票代码 -> DataFrame），无需先拼接成长表。
+
+        :return: 被重写的分区数量
+        """
+        written = sum(
+            self.append_stock(stock_code, df, period)
+            for stock_code, df in market_data.items() if df is not None and not df.empty
+        )
+        logger.info(f"K线存储 [{period}] 已更新 {written} 个分区")
+        return written
+
+    def append_stock(self, stock_code: str, df: pd.DataFrame, period: str = '1d') -> int:
+        """
+        写入单只股票的K线。早于已存储最新日期的K线会被跳过，最新一根及之后的K线覆盖写入，
+        因此传入完整历史快照时也只会重写最后的分区。
+
+        :return: 被重写的分区数量
+        """
+        df = df.drop(columns=self.CODE_COLUMN, errors='ignore')
+        df.index = df.index.astype(str)
+        df.index.name = self.INDEX_NAME
+        latest = self.latest_date(period, stock_code)
+        if latest is not None:
+            df = df[df.index >= latest]
+        if df.empty:
+            return 0
+
+        written = 0
+        for key, part in df.groupby(df.index.str[:self.partition_width(period)], sort=False):
+            path = self._partition_path(period, stock_code, key)
+            if path.exists():
+                existing = pd.read_parquet(path)
+                part = pd.concat([existing, part])
+                part = part[~part.index.duplicated(keep='last')]
+            self._write_atomic(part.sort_index(), path)
+            written += 1
+        return written
+
+    @staticmethod
+    def _write_atomic(df: pd.DataFrame, path: Path):
+        """
+        先写入临时文件再替换，避免读取方看到写了一半的分区。
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.parquet.tmp')
+        df.to_parquet(tmp_path, index=True)
+        os.replace(tmp_path, path)
+
+    def read(
+            self,
+            period: str = '1d',
+            stock_list: Optional[Iterable[str]] = None,
+            start_time: Optional[str] = None,
+            end_time: Optional[str] = None,
+            columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """
+        按条件读取K线，只打开与股票和日期范围相交的分区，且只读取所需的列。
+
+        :param period: 时间周期，默认 '1d'
+        :param stock_list: 股票代码列表，默认读取全部已存储的股票
+        :param start_time: 起始时间，格式为 'YYYYMMDD' 或 'YYYYMMDDHHMMSS'（包含）
+        :param end_time: 结束时间，格式同上（包含）
+        :param columns: 需要读取的列，默认读取全部列
+        :return: 长表格式的 pandas DataFrame
+        """
+        stock_list = self.stocks(period) if stock_list is None else list(stock_list)
+        width = self.partition_width(period)
+        start_key = start_time[:width] if start_time else None
+        end_key = end_time[:width] if end_time else None
+
+        frames = []
+        for stock_code in stock_list:
+            keys = [
+                key for key in self.partitions(period, stock_code)
+                if (start_key is None or key >= start_key) and (end_key is None or key <= end_key)
+            ]
+            for key in keys:
+                part = pd.read_parquet(self._partition_path(period, stock_code, key), columns=columns)
+                part[self.CODE_COLUMN] = stock_code
+                frames.append(part)
+
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, axis=0)
+        if start_time:
+            df = df[df.index.str[:len(start_time)] >= start_time]
+        if end_time:
+            df = df[df.index.str[:len(end_time)] <= end_time]
+        df.index.name = self.INDEX_NAME
+        return df
+
+    def latest_date(self, period: str, stock_code: str) -> Optional[str]:
+        """
+        返回指定股票已存储的最新K线日期，没有数据时返回 None。
+        """
+        keys = self.partitions(period, stock_code)
+        if not keys:
+            return None
+        last = pd.read_parquet(self._partition_path(period, stock_code, keys[-1]), columns=[])
+        return str(last.index.max()) if len(last.index) else None
+
+    def delete(self, period: str, stock_code: str):
+        """
+        删除指定股票在某周期下的全部分区，用于历史数据被修正后的重建。
+        """
+        for key in self.partitions(period, stock_code):
+            self._partition_path(period, stock_code, key).unlink()
+        logger.info(f"已清除K线存储 [{period}] {stock_code}")
@@ -0,0 +1,129 @@
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+from darts import TimeSeries
+from pathlib2 import Path
+
+SeriesLike = Union[TimeSeries, Sequence[TimeSeries]]
+
+
+def _as_list(series: SeriesLike) -> Tuple[List[TimeSeries], bool]:
+    if isinstance(series, TimeSeries):
+        return [series], True
+    return list(series), False
+
+
+def _stack(series_list: List[TimeSeries]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    将序列按行拼接为一个 ``[rows, components]`` 数组，并返回各序列的起始行。
+    """
+    values = [ts.values(copy=False) for ts in series_list]
+    offsets = np.cumsum([0] + [len(v) for v in values[:-1]])
+    return np.concatenate(values, axis=0), offsets
+
+
+class BatchScaler:
+    """
+    批量的最小-最大归一化，结果与 darts ``Scaler()``（即 sklearn ``MinMaxScaler``，global_fit=False）一致：
+    拟合一组序列时每条序列、每个分量各有一组参数，变换时第 i 条序列使用第 i 组参数；
+    只拟合了一条序列时，所有序列共用这组参数。
+
+    全部序列拼接成一个数组后一次完成拟合和变换，不再逐条序列调用 sklearn。
+    参数保存为 npz 中的普通数组，加载不需要反序列化对象。
+    """
+
+    def __init__(self, feature_range: Tuple[float, float] = (0.0, 1.0), name: str = 'BatchScaler'):
+        self.feature_range = feature_range
+        self.name = name
+        self.data_min_ = None  # [series, components]
+        self.data_max_ = None
+
+    @property
+    def fitted(self) -> bool:
+        return self.data_min_ is not None
+
+    def fit(self, series: SeriesLike) -> 'BatchScaler':
+        """
+        拟合每条序列每个分量的最小值和最大值（忽略 NaN）。
+        """
+        self.data_min_ = None
+        self.data_max_ = None
+        return self.partial_fit(series)
+
+    def partial_fit(self, series: SeriesLike, offset: int = 0) -> 'BatchScaler':
+        """
+        分片拟合：用 series 更新第 offset 条起的各序列的统计量。
+        同一批序列按时间分片时 offset 取 0，按序列分片时 offset 为该分片第一条序列的序号。
+        """
+        series_list, _ = _as_list(series)
+        values, offsets = _stack(series_list)
+        with np.errstate(invalid='ignore'):
+            data_min = np.fmin.reduceat(values, offsets, axis=0).astype(np.float64)
+            data_max = np.fmax.reduceat(values, offsets, axis=0).astype(np.float64)
+
+        end = offset + len(series_list)
+        if self.data_min_ is None:
+            self.data_min_ = np.full((end, values.shape[1]), np.nan)
+            self.data_max_ = np.full((end, values.shape[1]), np.nan)
+        elif end > len(self.data_min_):
+            grow = np.full((end - len(self.data_min_), values.shape[1]), np.nan)
+            self.data_min_ = np.concatenate([self.data_min_, grow])
+            self.data_max_ = np.concatenate([self.data_max_, grow])
+        self.data_min_[offset:end] = np.fmin(self.data_min_[offset:end], data_min)
+        self.data_max_[offset:end] = np.fmax(self.data_max_[offset:end], data_max)
+        return self
+
+    def _params(self, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        与 sklearn 相同的 scale_ 和 min_：取值范围为 0 的分量按 1 处理。
+        """
+        if not self.fitted:
+            raise ValueError(f"{self.name} 尚未拟合")
+        if len(self.data_min_) != 1 and len(self.data_min_) != count:
+            raise ValueError(f"{self.name} 拟合了 {len(self.data_min_)} 条序列，不能用于 {count} 条序列")
+        data_range = self.data_max_ - self.data_min_
+        data_range[data_range == 0.0] = 1.0
+        low, high = self.feature_range
+        scale = (high - low) / data_range
+        return scale, low - self.data_min_ * scale
+
+    def _apply(self, series: SeriesLike, inverse: bool) -> SeriesLike:
+        series_list, single = _as_list(series)
+        values, offsets = _stack(series_list)
+        scale, minimum = self._params(len(series_list))
+        if len(scale) > 1:
+            rows = np.repeat(np.arange(len(series_list)), np.diff(np.r_[offsets, len(values)]))
+            scale, minimum = scale[rows], minimum[rows]
+        scale = scale.astype(values.dtype, copy=False)
+        minimum = minimum.astype(values.dtype, copy=False)
+        result = (values - minimum) / scale if inverse else values * scale + minimum
+        transformed = [ts.with_values(block[:, :, np.newaxis])
+                       for ts, block in zip(series_list, np.split(result, offsets[1:]))]
+        return transformed[0] if single else transformed
+
+    def transform(self, series: SeriesLike) -> SeriesLike:
+        return self._apply(series, inverse=False)
+
+    def inverse_transform(self, series: SeriesLike) -> SeriesLike:
+        return self._apply(series, inverse=True)
+
+    def fit_transform(self, series: SeriesLike) -> SeriesLike:
+        return self.fit(series).transform(series)
+
+    def save(self, path):
+        """
+        保存为 npz。
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez(f, data_min=self.data_min_, data_max=self.data_max_,
+                     feature_range=np.asarray(self.feature_range, dtype=np.float64), name=np.asarray(self.name))
+
+    @classmethod
+    def load(cls, path) -> 'BatchScaler':
+        with np.load(str(path), allow_pickle=False) as data:
+            scaler = cls(tuple(data['feature_range']), str(data['name']))
+            scaler.data_min_ = data['data_min']
+            scaler.data_max_ = data['data_max']
+        return scaler
@@ -1,4 +1,6 @@
 from pathlib2 import Path
+# 自定义
+from data.features import ADD_FEATURES
 
 # config = {
 #     'work_path': Path('.'),
@@ -22,14 +24,11 @@ from pathlib2 import Path
 config = {
     'work_path': Path('.'),
     'data_path': Path("assets/data"),
+    # 训练、验证、测试序列的序列包目录（位于 data_path 下）
+    'bundle_dir': 'series_bundle',
     'data_save_paths': {
-        'train': "combined_train.pkl",
-        'val': "combined_val.pkl",
-        'test': "combined_test.pkl",
-        'past_cov': "combined_past_cov.pkl",
-        'future_cov': "future_cov.pkl",
-        'scaler_train': 'combine_scaler_train.pkl',
-        'scaler_past': 'combine_scaler_past.pkl'
+        'scaler_train': 'combine_scaler_train.npz',
+        'scaler_past': 'combine_scaler_past.npz'
     },
     'data_list_paths': {
         'train': "list_train.pkl",
@@ -37,12 +36,14 @@ config = {
         'test': "list_test.pkl",
         'past_cov': "list_past_cov.pkl",
         'future_cov': "list_future_cov.pkl",
-        'scaler_train': 'list_scaler_train.pkl',
-        'scaler_past': 'list_scaler_past.pkl'
+        'scaler_train': 'list_scaler_train.npz',
+        'scaler_past': 'list_scaler_past.npz'
     },
     'set_length': {
         'val_length': 60,
         'test_length': 60,
         'header_length': 120
-    }
-}
\ No newline at end of file
+    },
+    # 模型使用的过去协变量特征，只计算这里列出的特征及其依赖，可选的特征见 data.features.FEATURES
+    'past_cov_features': ADD_FEATURES,
+}
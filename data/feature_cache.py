@@ -0,0 +1,136 @@
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
+
+DEFAULT_CACHE_ROOT = Path(__file__).parent.parent / config.get('feature_cache', 'root', fallback='assets/feature_cache')
+DEFAULT_MAX_SIZE_MB = config.getint('feature_cache', 'max_size_mb', fallback=2048)
+DEFAULT_EVICT_INTERVAL = config.getfloat('feature_cache', 'evict_interval', fallback=3600)
+# 修改时间即上次淘汰的时间
+EVICT_MARKER = '.last_evict'
+
+
+class FeatureCache:
+    """
+    按内容寻址的特征缓存。
+
+    每只股票的特征只依赖它自己的输入K线，并按 BarStore 的分区（日线按年）切分：
+    每个分区的键是股票代码、特征定义版本、前一个分区的键和本分区输入列内容的哈希，
+    因此一个键代表该分区及之前全部输入K线的内容。值是按特征名排序堆叠成 ``[特征, 行]`` 的 ``npy`` 文件，
+    路径为 ``{root}/{key[:2]}/{key}.npy``。
+    输入K线或特征定义变化后键随之变化，旧文件不再被命中，由按访问时间的 LRU 淘汰在总大小超限时删除。
+    """
+
+    def __init__(self, root=None, max_size_mb: Optional[int] = None, evict_interval: Optional[float] = None):
+        self.root = Path(root) if root is not None else DEFAULT_CACHE_ROOT
+        self.max_bytes = (DEFAULT_MAX_SIZE_MB if max_size_mb is None else max_size_mb) * 1024 * 1024
+        self.evict_interval = DEFAULT_EVICT_INTERVAL if evict_interval is None else evict_interval
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(stock_code: str, inputs: Dict[str, np.ndarray], version: str, previous: str = '') -> str:
+        """
+        计算一个分区的缓存键。
+
+        :param stock_code: 股票代码
+        :param inputs: 该股票在本分区的原始列名 -> 一维数组
+        :param version: 需要的特征的定义版本，即 ``spec_version(names)``
+        :param previous: 前一个分区的键，第一个分区为空字符串
+        :return: 十六进制的哈希字符串
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(stock_code.encode())
+        h.update(version.encode())
+        h.update(previous.encode())
+        for col in sorted(inputs):
+            values = np.ascontiguousarray(inputs[col])
+            h.update(f'{col}:{values.dtype.str}:{values.shape}'.encode())
+            h.update(values.data)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f'{key}.npy'
+
+    def get(self, key: str, names: Sequence[str]) -> Optional[Dict[str, np.ndarray]]:
+        """
+        读取缓存的特征块，未命中时返回 None。命中时更新文件的访问时间，供 LRU 淘汰使用。
+
+        :param names: 计算键时的特征名
+        """
+        path = self._path(key)
+        try:
+            stacked = np.load(str(path), allow_pickle=False)
+        except (OSError, ValueError):
+            stacked = None
+        if stacked is None or len(stacked) != len(names):
+            self.misses += 1
+            return None
+        block = dict(zip(sorted(names), stacked))
+        os.utime(path)
+        self.hits += 1
+        return block
+
+    def put(self, key: str, block: Dict[str, np.ndarray]):
+        """
+        原子写入一个特征块。
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp.npy')
+        np.save(str(tmp_path), np.stack([block[name] for name in sorted(block)]))
+        os.replace(tmp_path, path)
+
+    def evict_if_due(self) -> int:
+        """
+        距上次淘汰超过 evict_interval 秒时淘汰，淘汰需要遍历整个缓存目录，不在每次写入后执行。
+
+        :return: 删除的文件数量
+        """
+        marker = self.root / EVICT_MARKER
+        try:
+            last = marker.stat().st_mtime
+        except OSError:
+            last = 0.0
+        if time.time() - last < self.evict_interval:
+            return 0
+        removed = self.evict()
+        self.root.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        return removed
+
+    def evict(self) -> int:
+        """
+        总大小超过上限时，按最近访问时间从旧到新删除文件。
+
+        :return: 删除的文件数量
+        """
+        if not self.root.exists():
+            return 0
+        entries = []
+        for path in self.root.glob('*/*.npy'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"特征缓存超过 {self.max_bytes // 1024 // 1024} MB，已淘汰 {removed} 个文件")
+        return removed
@@ -0,0 +1,223 @@
+"""
+增量（有状态）特征计算。
+
+每天只新增一根K线，但 rolling、EMA、RSI 等特征每次都在全部历史上重算。
+这里为每只股票保存计算最新一行所需的状态：最近 ``window`` 根K线的输入（滚动窗口、滞后项、RSI 只依赖它们）
+和 EMA 的递推值，新K线到来时只计算新的一行，耗时与历史长度无关。
+发现历史被修正（如除权后前复权价格整体变化）、日期不连续或股票列表变化时，回退为全量重算。
+"""
+from functools import partial
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
+from data.features import (ADD_FEATURES, PAST_COV_FEATURES, bfill, compute, ewm_step, recursive_specs,
+                           required_window)
+
+DEFAULT_STATE_ROOT = Path(__file__).parent.parent / config.get('feature_state', 'root', fallback='assets/runtime')
+DEFAULT_TAIL_LENGTH = config.getint('feature_state', 'tail_length', fallback=120)
+
+
+class IncrementalFeatureCalculator:
+    """
+    按 ``[time, stock]`` 数组增量计算特征。
+
+    状态包括：最近 ``window`` 根K线的输入及其日期、各 EMA 在最后一根K线之前的递推值、最近 ``tail_length`` 行的原始特征。
+    最后一根K线可能是盘中的未完成K线，下次更新时会用新数据重新计算这一行，因此 EMA 保存的是它之前的值。
+
+    :param name: 状态名称，决定状态文件名
+    :param compute: 特征函数，参数为 (列名 -> ``[time, stock]`` 数组, fill=False)，返回未填充的原始特征
+    :param window: 计算最新一行特征所需的K线数量（最长回看周期 + 1）
+    :param ema_specs: 特征名 -> (输入列, span)，这些特征用递推值替换窗口内的计算结果
+    :param compare_columns: 用于检查历史是否被修正的输入列，默认全部输入列
+    :param tail_length: 保留并返回的最近特征行数
+    :param path: 状态文件路径，默认 ``assets/runtime/feature_state_{name}.npz``
+    """
+
+    def __init__(
+            self,
+            name: str,
+            compute: Callable[..., Dict[str, np.ndarray]],
+            window: int,
+            ema_specs: Optional[Dict[str, Tuple[str, int]]] = None,
+            compare_columns: Optional[List[str]] = None,
+            tail_length: Optional[int] = None,
+            path=None
+    ):
+        self.name = name
+        self.compute = compute
+        self.window = window
+        self.ema_specs = ema_specs or {}
+        self.compare_columns = compare_columns
+        self.tail_length = tail_length or DEFAULT_TAIL_LENGTH
+        self.path = Path(path) if path is not None else DEFAULT_STATE_ROOT / f'feature_state_{name}.npz'
+
+        self.codes: Optional[np.ndarray] = None
+        self.dates: Optional[np.ndarray] = None  # 最近 window 根K线的日期
+        self.inputs: Dict[str, np.ndarray] = {}  # 列名 -> [window, stock]
+        self.ema_prev: Dict[str, np.ndarray] = {}  # 特征名 -> [stock]，最后一根K线之前的 EMA
+        self.feature_dates: Optional[np.ndarray] = None  # 最近 tail_length 行特征的日期
+        self.features: Dict[str, np.ndarray] = {}  # 特征名 -> [tail_length, stock]，未填充
+
+    @classmethod
+    def for_features(cls, name: str, names: Sequence[str], **kwargs) -> 'IncrementalFeatureCalculator':
+        """
+        由特征登记表生成计算器：窗口取 names 依赖链上的最长回看，EMA 等递推特征改为逐行递推。
+        递推特征须直接作用在原始列上。
+        """
+        return cls(name, partial(compute, names=list(names)), required_window(names),
+                   ema_specs=recursive_specs(names), **kwargs)
+
+    @classmethod
+    def for_add_features(cls, names: Optional[Sequence[str]] = None, **kwargs) -> 'IncrementalFeatureCalculator':
+        """
+        ``data.utils.add_features`` 中的特征。overnight_return 是次日的收益，最后一根K线的值会在次日改变，不参与修正检查。
+        """
+        return cls.for_features('add_features', ADD_FEATURES if names is None else names,
+                                compare_columns=['open', 'high', 'low', 'close', 'amount'], **kwargs)
+
+    @classmethod
+    def for_past_covariates(cls, **kwargs) -> 'IncrementalFeatureCalculator':
+        """
+        过去协变量中 open/high/low/close/volume 的滞后涨幅。
+        """
+        return cls.for_features('past_covariates', PAST_COV_FEATURES, **kwargs)
+
+    @property
+    def ready(self) -> bool:
+        return self.codes is not None
+
+    def update(
+            self,
+            inputs: Dict[str, np.ndarray],
+            dates: Sequence[str],
+            codes: Sequence[str]
+    ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        用最新的数据更新状态并返回最近 tail_length 行特征。能增量推进时只读取 inputs 的最后几行，否则全量重算。
+
+        :param inputs: 列名 -> ``[time, stock]`` 数组（可以是面板的视图），各股票按日期对齐且无缺失
+        :param dates: 与时间维度对齐的日期字符串
+        :param codes: 与股票维度对齐的股票代码
+        :return: (特征行对应的日期, 特征名 -> ``[rows, stock]`` 数组)，特征已按全量计算的规则向后填充
+        """
+        dates = np.asarray(dates, dtype=str)
+        codes = np.asarray(codes, dtype=str)
+        if not self.ready:
+            self.load()
+        if not self.advance(inputs, dates, codes):
+            self.seed(inputs, dates, codes)
+        self.save()
+        return self.feature_dates, {name: bfill(values) for name, values in self.features.items()}
+
+    def seed(self, inputs: Dict[str, np.ndarray], dates: np.ndarray, codes: np.ndarray):
+        """
+        全量计算并重建状态。
+        """
+        logger.info(f"特征状态 [{self.name}] 全量重算：{len(codes)} 只股票，{len(dates)} 根K线")
+        inputs = {col: np.asarray(values) for col, values in inputs.items()}
+        raw = self.compute(inputs, fill=False)
+        self.codes = codes
+        self.dates = dates[-self.window:]
+        self.inputs = {col: values[-self.window:].copy() for col, values in inputs.items()}
+        self.ema_prev = {
+            name: raw[name][-2].copy() if len(dates) > 1 else np.full(len(codes), np.nan, dtype=raw[name].dtype)
+            for name in self.ema_specs
+        }
+        self.feature_dates = dates[-self.tail_length:]
+        self.features = {name: values[-self.tail_length:].copy() for name, values in raw.items()}
+
+    def advance(self, inputs: Dict[str, np.ndarray], dates: np.ndarray, codes: np.ndarray) -> bool:
+        """
+        在已有状态上推进：重新计算上次的最后一根K线，再依次计算之后的新K线。
+
+        :return: 是否推进成功；返回 False 时需要全量重算
+        """
+        if not self.ready or not np.array_equal(codes, self.codes) or set(inputs) != set(self.inputs):
+            return False
+        last = self.dates[-1]
+        start = int(np.searchsorted(dates, last))
+        if start >= len(dates) or dates[start] != last:
+            logger.info(f"特征状态 [{self.name}] 缺少上次的最后一根K线 {last}，需要全量重算")
+            return False
+        if self.revised(inputs, dates, start):
+            logger.info(f"特征状态 [{self.name}] 检测到历史数据被修正，需要全量重算")
+            return False
+
+        keep = self.feature_dates < last
+        self.feature_dates = self.feature_dates[keep]
+        self.features = {name: values[keep] for name, values in self.features.items()}
+        ema = self.ema_prev
+        rows = []
+        for t in range(start, len(dates)):
+            # 最新一行的滚动窗口、滞后项只依赖最近 window 根K线
+            window = {col: np.asarray(values[max(t + 1 - self.window, 0):t + 1]) for col, values in inputs.items()}
+            row = {name: values[-1] for name, values in self.compute(window, fill=False).items()}
+            self.ema_prev = ema
+            ema = {
+                name: ewm_step(self.ema_prev[name], window[col][-1], span)
+                for name, (col, span) in self.ema_specs.items()
+            }
+            row.update(ema)
+            rows.append(row)
+
+        self.feature_dates = np.concatenate([self.feature_dates, dates[start:]])[-self.tail_length:]
+        self.features = {
+            name: np.concatenate([values, np.stack([row[name] for row in rows])])[-self.tail_length:]
+            for name, values in self.features.items()
+        }
+        self.dates = dates[-self.window:]
+        self.inputs = {col: np.array(values[-self.window:]) for col, values in inputs.items()}
+        logger.debug(f"特征状态 [{self.name}] 增量计算 {len(rows)} 根K线，最新日期 {dates[-1]}")
+        return True
+
+    def revised(self, inputs: Dict[str, np.ndarray], dates: np.ndarray, start: int) -> bool:
+        """
+        比较已保存的、早于最后一根K线的输入与新数据是否一致（最后一根K线可能是盘中数据，允许变化）。
+        """
+        count = min(start, len(self.dates) - 1)
+        if count == 0:
+            return False
+        if not np.array_equal(dates[start - count:start], self.dates[-1 - count:-1]):
+            return True
+        columns = self.compare_columns or list(self.inputs)
+        return any(
+            not np.allclose(inputs[col][start - count:start], self.inputs[col][-1 - count:-1], equal_nan=True)
+            for col in columns
+        )
+
+    def save(self):
+        """
+        原子写入状态文件。
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {'codes': self.codes, 'dates': self.dates, 'feature_dates': self.feature_dates}
+        arrays.update({f'input__{col}': values for col, values in self.inputs.items()})
+        arrays.update({f'ema__{name}': values for name, values in self.ema_prev.items()})
+        arrays.update({f'feature__{name}': values for name, values in self.features.items()})
+        tmp_path = self.path.with_suffix('.tmp.npz')
+        np.savez(str(tmp_path), **arrays)
+        tmp_path.replace(self.path)
+
+    def load(self) -> bool:
+        """
+        读取状态文件，文件不存在或损坏时返回 False。
+        """
+        if not self.path.exists():
+            return False
+        try:
+            with np.load(str(self.path), allow_pickle=False) as data:
+                self.codes = data['codes']
+                self.dates = data['dates']
+                self.feature_dates = data['feature_dates']
+                self.inputs = {k[len('input__'):]: data[k] for k in data.files if k.startswith('input__')}
+                self.ema_prev = {k[len('ema__'):]: data[k] for k in data.files if k.startswith('ema__')}
+                self.features = {k[len('feature__'):]: data[k] for k in data.files if k.startswith('feature__')}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"特征状态文件 {self.path} 无法读取，将全量重算：{e}")
+            self.codes = None
+            return False
+        return True
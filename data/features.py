@@ -0,0 +1,324 @@
+"""
+向量化的特征计算。
+
+所有函数都作用在 ``[time, stock]`` 的二维数组上，一次计算全部股票，
+结果与 pandas 逐只股票 ``shift``/``pct_change``/``rolling``/``ewm(adjust=False)`` 的结果一致。
+各股票的序列从第 0 行开始对齐，长度不足的股票在尾部用 NaN 补齐；
+所有计算都只依赖当前及之前的数据，因此尾部的补齐不会影响有效部分的结果。
+
+特征以 ``FeatureSpec`` 的形式登记在 ``FEATURES`` 中，声明各自的输入、回看窗口和数据类型。
+``compute`` 只计算请求的特征及其依赖，中间结果（如 RSI 的 delta、5日均值）在同一次计算中共享。
+"""
+import hashlib
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+PRICE_COLUMNS = ['open', 'close', 'amount']
+LAGS = [3, 5, 10, 20, 60]
+# 过去协变量的滞后涨幅
+PAST_COV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+PAST_COV_LAGS = [3, 5, 15, 30, 60]
+# 修改已登记特征的计算方式时递增，使特征缓存失效
+FEATURES_VERSION = 1
+
+
+def shift(values: np.ndarray, periods: int) -> np.ndarray:
+    """
+    沿时间向后平移 periods 行，开头补 NaN。
+    """
+    result = np.full_like(values, np.nan)
+    if periods < len(values):
+        result[periods:] = values[:len(values) - periods]
+    return result
+
+
+def pct_change(values: np.ndarray, periods: int = 1) -> np.ndarray:
+    """
+    与 ``Series.pct_change(periods)`` 相同：当前值 / periods 行前的值 - 1。
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values / shift(values, periods) - 1
+
+
+def diff(values: np.ndarray, periods: int = 1) -> np.ndarray:
+    return values - shift(values, periods)
+
+
+def _rolling(values: np.ndarray, window: int, reducer) -> np.ndarray:
+    result = np.full_like(values, np.nan)
+    if window <= len(values):
+        result[window - 1:] = reducer(sliding_window_view(values, window, axis=0), axis=-1)
+    return result
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    与 ``Series.rolling(window).mean()`` 相同，窗口内有 NaN 或不足 window 行时为 NaN。
+    """
+    return _rolling(values, window, np.mean)
+
+
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    return _rolling(values, window, np.max)
+
+
+def rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+    return _rolling(values, window, np.min)
+
+
+def ewm_step(weighted: np.ndarray, current: np.ndarray, span: int) -> np.ndarray:
+    """
+    ``ewm(span=span, adjust=False)`` 的一步递推：由上一行的结果和当前行的值得到当前行的结果。
+    上一行为 NaN 时取当前值，当前值为 NaN 时沿用上一行的结果。
+    """
+    alpha = 2.0 / (span + 1.0)
+    old_wt = 1.0 - alpha
+    updated = (old_wt * weighted + alpha * current) / (old_wt + alpha)
+    updated = np.where(np.isnan(weighted), current, updated)
+    return np.where(np.isnan(current), weighted, updated)
+
+
+def ewm_mean(values: np.ndarray, span: int) -> np.ndarray:
+    """
+    与 ``Series.ewm(span=span, adjust=False).mean()`` 相同，按 pandas 的递推公式逐行计算，
+    每一行同时处理全部股票。
+    """
+    result = np.empty_like(values)
+    weighted = values[0].copy()
+    result[0] = weighted
+    for t in range(1, len(values)):
+        weighted = ewm_step(weighted, values[t], span)
+        result[t] = weighted
+    return result
+
+
+def bfill(values: np.ndarray) -> np.ndarray:
+    """
+    沿时间向后填充 NaN（每只股票各自填充）。
+    """
+    length = len(values)
+    positions = np.where(np.isnan(values), length - 1, np.arange(length)[:, None])
+    positions = np.minimum.accumulate(positions[::-1], axis=0)[::-1]
+    return np.take_along_axis(values, positions, axis=0)
+
+
+def _percent_change(values: np.ndarray) -> np.ndarray:
+    return pct_change(values) * 100
+
+
+def _average_gain(delta: np.ndarray, window: int) -> np.ndarray:
+    return rolling_mean(np.where(delta > 0, delta, 0), window)
+
+
+def _average_loss(delta: np.ndarray, window: int) -> np.ndarray:
+    return rolling_mean(-np.where(delta < 0, delta, 0), window)
+
+
+def _rsi(gain: np.ndarray, loss: np.ndarray) -> np.ndarray:
+    """
+    相对强弱指数，由平均涨幅和平均跌幅计算。
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = gain / loss
+        return 100 - (100 / (1 + rs))
+
+
+def _same(values: np.ndarray) -> np.ndarray:
+    return values
+
+
+@dataclass(frozen=True)
+class FeatureSpec:
+    """
+    一个特征的声明。
+
+    :param name: 特征名
+    :param inputs: 输入的原始列或其他特征的名称，按顺序作为 fn 的位置参数
+    :param fn: 计算函数，参数为各输入的 ``[time, stock]`` 数组和 params
+    :param window: 计算一行需要的输入行数（含当前行）；None 表示递推特征，依赖全部历史
+    :param dtype: 结果的数据类型，None 表示与输入相同
+    :param params: 传给 fn 的关键字参数
+    :param public: 是否作为特征输出；False 表示只作为其他特征的中间结果
+    """
+    name: str
+    inputs: Tuple[str, ...]
+    fn: Callable[..., np.ndarray]
+    window: Optional[int] = 1
+    dtype: Optional[str] = None
+    params: Dict[str, int] = field(default_factory=dict)
+    public: bool = True
+
+
+FEATURES: Dict[str, FeatureSpec] = {}
+
+
+def register(spec: FeatureSpec) -> FeatureSpec:
+    """
+    登记特征，同名特征会被覆盖。
+    """
+    FEATURES[spec.name] = spec
+    return spec
+
+
+# 滞后的窗口期
+for _lag in LAGS:
+    for _col in PRICE_COLUMNS:
+        register(FeatureSpec(f'{_col}_lag_{_lag}', (_col,), shift, window=_lag + 1, params={'periods': _lag}))
+# 涨幅，比值类特征用 float32 保存即可
+for _col in PRICE_COLUMNS:
+    register(FeatureSpec(f'{_col}_pct_change', (_col,), _percent_change, window=2, dtype='float32'))
+# 均值
+for _col in ['open', 'high', 'low', 'close', 'amount']:
+    register(FeatureSpec(f'mean_{_col}', (_col,), rolling_mean, window=5, params={'window': 5}))
+# 移动平均线
+register(FeatureSpec('ma_7', ('mean_close',), _same))
+register(FeatureSpec('ma_14', ('close',), rolling_mean, window=10, params={'window': 10}))
+register(FeatureSpec('ma_21', ('close',), rolling_mean, window=20, params={'window': 20}))
+# 指数平滑移动平均线（EMA）
+register(FeatureSpec('ema_12', ('close',), ewm_mean, window=None, params={'span': 10}))
+register(FeatureSpec('ema_26', ('close',), ewm_mean, window=None, params={'span': 20}))
+register(FeatureSpec('ema_3', ('overnight_return',), ewm_mean, window=None, params={'span': 3}))
+register(FeatureSpec('ema_5', ('overnight_return',), ewm_mean, window=None, params={'span': 5}))
+# 相对强弱指数（RSI）
+register(FeatureSpec('delta', ('close',), diff, window=2, public=False))
+register(FeatureSpec('gain_10', ('delta',), _average_gain, window=10, params={'window': 10}, public=False))
+register(FeatureSpec('loss_10', ('delta',), _average_loss, window=10, params={'window': 10}, public=False))
+register(FeatureSpec('rsi_14', ('gain_10', 'loss_10'), _rsi, dtype='float32'))
+# 移动最大值和最小值
+register(FeatureSpec('rolling_max_high_14', ('high',), rolling_max, window=10, params={'window': 10}))
+register(FeatureSpec('rolling_min_low_14', ('low',), rolling_min, window=10, params={'window': 10}))
+# data.utils.add_features 新增的列，按原来的顺序
+ADD_FEATURES = [name for name, spec in FEATURES.items() if spec.public]
+
+# 过去协变量的滞后涨幅，按先周期后列的顺序
+for _lag in PAST_COV_LAGS:
+    for _col in PAST_COV_COLUMNS:
+        register(FeatureSpec(f'{_col}_pct_{_lag}', (_col,), pct_change, window=_lag + 1, dtype='float32',
+                             params={'periods': _lag}))
+PAST_COV_FEATURES = [f'{col}_pct_{lag}' for lag in PAST_COV_LAGS for col in PAST_COV_COLUMNS]
+
+
+def _spec(name: str) -> FeatureSpec:
+    try:
+        return FEATURES[name]
+    except KeyError:
+        raise ValueError(f"未登记的特征：{name}") from None
+
+
+def dependencies(names: Sequence[str]) -> List[FeatureSpec]:
+    """
+    按依赖顺序（被依赖的在前）返回计算 names 需要的全部特征。
+    """
+    ordered = {}
+
+    def visit(name):
+        if name in ordered:
+            return
+        spec = _spec(name)
+        for dep in spec.inputs:
+            if dep in FEATURES:
+                visit(dep)
+        ordered[name] = spec
+
+    for name in names:
+        visit(name)
+    return list(ordered.values())
+
+
+def spec_version(names: Sequence[str]) -> str:
+    """
+    names 及其依赖的特征定义的哈希，用作特征缓存键的一部分。
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(str(FEATURES_VERSION).encode())
+    for spec in dependencies(sorted(names)):
+        h.update(repr((spec.name, spec.inputs, spec.fn.__name__, spec.window, spec.dtype,
+                       sorted(spec.params.items()), spec.public)).encode())
+    return h.hexdigest()
+
+
+def input_columns(names: Sequence[str]) -> List[str]:
+    """
+    计算 names 需要的原始列。
+    """
+    columns = []
+    for spec in dependencies(names):
+        columns += [dep for dep in spec.inputs if dep not in FEATURES and dep not in columns]
+    return columns
+
+
+def required_window(names: Sequence[str]) -> int:
+    """
+    计算 names 的最新一行需要的原始输入行数，递推特征不计入（其状态需另行保存）。
+    """
+    total = {}
+    for spec in dependencies(names):
+        upstream = max((total.get(dep, 1) for dep in spec.inputs), default=1)
+        total[spec.name] = (spec.window or 1) + upstream - 1
+    return max(total.values(), default=1)
+
+
+def recursive_specs(names: Sequence[str]) -> Dict[str, Tuple[str, int]]:
+    """
+    names 中的递推特征（EMA）：特征名 -> (输入列, span)。
+    """
+    return {
+        spec.name: (spec.inputs[0], spec.params['span'])
+        for spec in dependencies(names) if spec.window is None
+    }
+
+
+def compute(
+        inputs: Dict[str, np.ndarray],
+        names: Sequence[str],
+        valid: Optional[np.ndarray] = None,
+        fill: bool = True
+) -> Dict[str, np.ndarray]:
+    """
+    按依赖顺序计算请求的特征，未请求且不被依赖的特征不会计算。
+
+    :param inputs: 原始列名 -> ``[time, stock]`` 数组
+    :param names: 需要的特征名
+    :param valid: ``[time, stock]`` 的布尔数组，标记每只股票的有效行；尾部补齐的行在向后填充前置为 NaN，
+        避免平移后落在补齐区域的值被填回有效行。默认全部有效
+    :param fill: 是否向后填充 NaN，增量计算时需要未填充的原始值
+    :return: 特征名 -> ``[time, stock]`` 数组，顺序与 names 一致
+    """
+    results = dict(inputs)
+    for spec in dependencies(names):
+        values = spec.fn(*(results[dep] for dep in spec.inputs), **spec.params)
+        results[spec.name] = values if spec.dtype is None else values.astype(spec.dtype, copy=False)
+    features = {name: results[name] for name in names}
+
+    if not fill:
+        return features
+    # 将最早的行用之后的值填回去（na处理）
+    if valid is not None:
+        return {name: bfill(np.where(valid, values, np.nan)) for name, values in features.items()}
+    return {name: bfill(values) for name, values in features.items()}
+
+
+def compute_features(
+        inputs: Dict[str, np.ndarray],
+        valid: Optional[np.ndarray] = None,
+        fill: bool = True,
+        names: Optional[Sequence[str]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    计算 ``data.utils.add_features`` 中的特征，参数见 ``compute``。
+
+    :param names: 需要的特征名，默认为 ADD_FEATURES 全部
+    """
+    return compute(inputs, ADD_FEATURES if names is None else names, valid, fill)
+
+
+def compute_pct_lags(inputs: Dict[str, np.ndarray], fill: bool = True) -> Dict[str, np.ndarray]:
+    """
+    计算过去协变量的滞后涨幅：``PAST_COV_COLUMNS`` 各列在 ``PAST_COV_LAGS`` 各周期上的 pct_change。
+
+    :return: ``{col}_pct_{lag}`` -> ``[time, stock]`` 数组，按先周期后列的顺序排列
+    """
+    return compute(inputs, PAST_COV_FEATURES, fill=fill)
@@ -0,0 +1,146 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+# 自定义
+from config import config
+
+# xtdata 行情中不参与建模的列：time 为毫秒时间戳，转为 float32 会丢失精度
+NON_VALUE_FIELDS = ('time', 'stock_code')
+
+
+def value_dtype() -> np.dtype:
+    """
+    行情和特征数据使用的浮点类型，由 config.ini 的 [data] dtype 指定，默认 float32。
+    """
+    return np.dtype(config.get('data', 'dtype', fallback='float32'))
+
+
+def cast_value_columns(df: pd.DataFrame, dtype=None) -> pd.DataFrame:
+    """
+    将除 time、stock_code 外的数值列转为 dtype，已是该类型的列不复制。
+    """
+    dtype = value_dtype() if dtype is None else np.dtype(dtype)
+    columns = {
+        col: dtype for col in df.columns
+        if col not in NON_VALUE_FIELDS and pd.api.types.is_numeric_dtype(df[col]) and df[col].dtype != dtype
+    }
+    return df.astype(columns, copy=False) if columns else df
+
+
+def ffill_last_axis(values: np.ndarray) -> np.ndarray:
+    """
+    沿最后一个维度（时间）向前填充 NaN，原地修改并返回。
+    """
+    length = values.shape[-1]
+    flat = values.reshape(-1, length)
+    positions = np.where(np.isnan(flat), 0, np.arange(length))
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    values[...] = np.take_along_axis(flat, positions, axis=1).reshape(values.shape)
+    return values
+
+
+def bfill_last_axis(values: np.ndarray) -> np.ndarray:
+    """
+    沿最后一个维度（时间）向后填充 NaN，原地修改并返回。
+    """
+    ffill_last_axis(values[..., ::-1])
+    return values
+
+
+class MarketPanel:
+    """
+    稠密的三维行情面板。
+
+    ``values`` 为预分配的 ``[field, stock, time]`` 数组（默认 float32），
+    ``fields``、``codes``、``index`` 分别是与三个维度对齐的字段名、股票代码和日期字符串数组。
+    ``field``/``wide``/``long`` 返回的都是底层数组的视图，不会复制数据。
+    """
+
+    def __init__(self, values: np.ndarray, fields: Sequence[str], codes: Sequence[str], index: Sequence[str]):
+        self.values = values
+        self.fields = np.asarray(fields, dtype=object)
+        self.codes = np.asarray(codes, dtype=object)
+        self.index = np.asarray(index, dtype=object)
+        self._field_pos = {f: i for i, f in enumerate(self.fields)}
+        if values.shape != (len(self.fields), len(self.codes), len(self.index)):
+            raise ValueError(
+                f"面板维度 {values.shape} 与字段/股票/日期数量 "
+                f"{(len(self.fields), len(self.codes), len(self.index))} 不一致"
+            )
+
+    @classmethod
+    def from_local_data(
+            cls,
+            market_data: Dict[str, pd.DataFrame],
+            fields: Optional[List[str]] = None,
+            dtype=np.float32
+    ) -> 'MarketPanel':
+        """
+        由 ``xtdata.get_local_data`` 的返回值（股票代码 -> 以日期为索引的 DataFrame）直接构建面板。
+
+        :param market_data: get_local_data 的返回值
+        :param fields: 需要的字段，默认为除 time 外的全部数值列
+        :param dtype: 面板的数据类型，默认 float32
+        :return: MarketPanel
+        """
+        frames = {code: df for code, df in market_data.items() if df is not None and not df.empty}
+        # 与 pivot 的列顺序保持一致
+        codes = sorted(frames)
+        if fields is None:
+            fields = [c for c in next(iter(frames.values())).columns if c not in NON_VALUE_FIELDS] if frames else []
+        index = pd.Index([])
+        for df in frames.values():
+            index = index.union(df.index.astype(str))
+        index = index.sort_values()
+
+        values = np.full((len(fields), len(codes), len(index)), np.nan, dtype=dtype)
+        for s, code in enumerate(codes):
+            df = frames[code]
+            positions = index.get_indexer(df.index.astype(str))
+            values[:, s, positions] = df[fields].to_numpy(dtype=dtype).T
+        return cls(values, fields, codes, index.to_numpy(dtype=object))
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        返回单个字段的 ``[stock, time]`` 视图。
+        """
+        return self.values[self._field_pos[name]]
+
+    def fill(self) -> 'MarketPanel':
+        """
+        逐只股票沿时间向前、向后填充缺失值，剩余缺失值置 0。原地修改并返回自身。
+        """
+        ffill_last_axis(self.values)
+        bfill_last_axis(self.values)
+        self.values[np.isnan(self.values)] = 0
+        return self
+
+    def wide(self, field: str) -> pd.DataFrame:
+        """
+        单个字段的宽表视图：行为时间，列为股票代码。
+        """
+        return pd.DataFrame(self.field(field).T, index=pd.Index(self.index, name='date'), columns=self.codes,
+                            copy=False)
+
+    def wide_fields(self, fields: Sequence[str]) -> pd.DataFrame:
+        """
+        多个字段拼接的宽表：行为时间，列名为 ``{field}_{stock_code}``，列顺序为先字段后股票。
+        与 ``pivot(index='time', columns='stock_code', values=fields)`` 的列顺序一致，只复制一次所选字段。
+        """
+        positions = [self._field_pos[f] for f in fields]
+        block = self.values[positions].reshape(len(fields) * len(self.codes), len(self.index))
+        columns = [f"{f}_{code}" for f in fields for code in self.codes]
+        return pd.DataFrame(block.T, index=pd.Index(self.index, name='date'), columns=columns, copy=False)
+
+    def long(self) -> pd.DataFrame:
+        """
+        长表视图：以 (stock_code, date) 为索引，每个字段一列。
+        """
+        index = pd.MultiIndex.from_product([self.codes, self.index], names=['stock_code', 'date'])
+        block = self.values.reshape(len(self.fields), len(self.codes) * len(self.index))
+        return pd.DataFrame(block.T, index=index, columns=self.fields, copy=False)
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import time
+from typing import Optional
+
+import numpy as np
+from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
+from data.panel import MarketPanel
+
+DEFAULT_CACHE_ROOT = Path(__file__).parent.parent / config.get('panel_cache', 'root', fallback='assets/panel_cache')
+MANIFEST_NAME = 'manifest.json'
+VALUES_NAME = 'values.npy'
+
+
+class PanelCache:
+    """
+    清洗后行情面板的内存映射缓存，供多个作业和进程共享。
+
+    目录结构为 ``{root}/{period}/{version}/values.npy`` 加上 ``{root}/{period}/manifest.json``。
+    发布时先完整写入新版本目录，再用 ``os.replace`` 原子替换 manifest，
+    因此读取方要么看到旧版本，要么看到完整的新版本。读取时以只读方式 ``np.load(mmap_mode='r')``，
+    各进程共享操作系统的页缓存，不再各自解析和复制一份数据。
+    """
+
+    def __init__(self, root=None, keep_versions: int = 2):
+        self.root = Path(root) if root is not None else DEFAULT_CACHE_ROOT
+        self.keep_versions = keep_versions
+
+    def _period_dir(self, period: str) -> Path:
+        return self.root / period
+
+    def manifest(self, period: str = '1d') -> Optional[dict]:
+        """
+        读取当前版本的 manifest，没有已发布的版本时返回 None。
+        """
+        path = self._period_dir(period) / MANIFEST_NAME
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def age(self, period: str = '1d') -> Optional[float]:
+        """
+        当前版本距发布时的秒数，没有已发布的版本时返回 None。
+        """
+        manifest = self.manifest(period)
+        return None if manifest is None else time.time() - manifest['created']
+
+    def publish(self, panel: MarketPanel, period: str = '1d') -> str:
+        """
+        发布新版本的面板并原子切换 manifest。
+
+        :param panel: 已清洗的行情面板
+        :param period: 时间周期，默认 '1d'
+        :return: 新版本号
+        """
+        period_dir = self._period_dir(period)
+        version = time.strftime('%Y%m%d%H%M%S') + f'_{os.getpid()}'
+        version_dir = period_dir / version
+        version_dir.mkdir(parents=True, exist_ok=True)
+        np.save(str(version_dir / VALUES_NAME), np.ascontiguousarray(panel.values))
+
+        manifest = {
+            'version': version,
+            'created': time.time(),
+            'shape': list(panel.values.shape),
+            'dtype': str(panel.values.dtype),
+            'fields': panel.fields.tolist(),
+            'codes': panel.codes.tolist(),
+            'index': panel.index.tolist(),
+        }
+        tmp_path = period_dir / f'{MANIFEST_NAME}.{version}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, period_dir / MANIFEST_NAME)
+        logger.info(f"行情面板缓存 [{period}] 已发布版本 {version}，形状 {tuple(panel.values.shape)}")
+
+        self._remove_old_versions(period_dir)
+        return version
+
+    def _remove_old_versions(self, period_dir: Path):
+        """
+        清理旧版本目录。仍被其他进程映射的文件在 Windows 上无法删除，留待下次发布时再清理。
+        """
+        versions = sorted(p for p in period_dir.iterdir() if p.is_dir())
+        for old in versions[:-self.keep_versions]:
+            try:
+                shutil.rmtree(old)
+            except OSError as e:
+                logger.debug(f"暂时无法删除旧版本 {old}：{e}")
+
+    def open(self, period: str = '1d') -> Optional[MarketPanel]:
+        """
+        以只读内存映射的方式打开当前版本的面板，没有已发布的版本时返回 None。
+        """
+        manifest = self.manifest(period)
+        if manifest is None:
+            return None
+        values = np.load(str(self._period_dir(period) / manifest['version'] / VALUES_NAME), mmap_mode='r')
+        return MarketPanel(values, manifest['fields'], manifest['codes'], manifest['index'])
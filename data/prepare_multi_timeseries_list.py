@@ -1,9 +1,9 @@
 import numpy as np
-from darts.dataprocessing.transformers import Scaler
-from pickle import dump, load
 
 # 自定义库
 from .mytimeseries import MyTimeSeries
+from .series_bundle import save_series_bundle, load_series_bundle
+from .batch_scaler import BatchScaler
 from .prepare_combined_timeseries import fetch_and_clean_data, generate_future_covariates
 from .data_config import config
 
@@ -30,20 +30,12 @@ def generate_time_series(clean_df):
 
     targets_ts_list = create_series(['overnight_return'])
 
-    values_columns = [ 'open', 'high', 'low', 'close', 'amount',
-                      'open_lag_3', 'close_lag_3', 'amount_lag_3',
-                      'open_lag_5', 'close_lag_5', 'amount_lag_5', 'open_lag_10',
-                      'close_lag_10', 'amount_lag_10', 'open_lag_20', 'close_lag_20',
-                      'amount_lag_20', 'open_lag_60', 'close_lag_60', 'amount_lag_60',
-                      'open_pct_change', 'close_pct_change', 'amount_pct_change', 'mean_open',
-                      'mean_high', 'mean_low', 'mean_close', 'mean_amount', 'ma_7', 'ma_14',
-                      'ma_21', 'ema_12', 'ema_26', 'ema_3', 'ema_5', 'rsi_14',
-                      'rolling_max_high_14', 'rolling_min_low_14']
+    values_columns = ['open', 'high', 'low', 'close', 'amount'] + list(config['past_cov_features'])
     past_cov_ts_list = create_series(values_columns)
 
-    # 转换数据类型为 float32
-    targets_ts_list = [ts.astype(np.float32) for ts in targets_ts_list]
-    past_cov_ts_list = [ts.astype(np.float32) for ts in past_cov_ts_list]
+    # 转换数据类型为 float32，float32 模式下清洗后的数据已是 float32，不再复制
+    targets_ts_list = [ts if ts.dtype == np.float32 else ts.astype(np.float32) for ts in targets_ts_list]
+    past_cov_ts_list = [ts if ts.dtype == np.float32 else ts.astype(np.float32) for ts in past_cov_ts_list]
 
     return targets_ts_list, past_cov_ts_list
 
@@ -82,18 +74,16 @@ def get_or_transform_scaler(data_list, save_path, operation_mode):
         operation_mode (str): 'training' 进行拟合，'predicting' 加载现有标准化对象。
 
     返回：
-        Scaler: 标准化对象。
+        BatchScaler: 标准化对象。
     """
     if operation_mode not in ['training', 'predicting']:
         raise ValueError("operation_mode 必须是 'training' 或 'predicting'")
 
     if operation_mode == 'training':
-        scaler = Scaler().fit(data_list)
-        with open(save_path, 'wb') as f:
-            dump(scaler, f)
+        scaler = BatchScaler().fit(data_list)
+        scaler.save(save_path)
     else:  # predicting
-        with open(save_path, 'rb') as f:
-            scaler = load(f)
+        scaler = BatchScaler.load(save_path)
 
     return scaler
 
@@ -138,21 +128,25 @@ def process_and_save_series(targets_ts_list, past_cov_ts_list, future_cov_ts, op
 
 def save_time_series_data(train_list, val_list, test_list, past_cov_ts_list, future_cov_ts_list):
     """
-    将时间序列数据保存到文件。
+    将时间序列数据保存为序列包（见 data.series_bundle），重复的 future_cov 只保存一份。
     """
-    data_path = config['data_path']
-    data_save_paths = config['data_save_paths']
+    save_series_bundle(config['data_path'] / config['bundle_dir'], {
+        'train': train_list,
+        'val': val_list,
+        'test': test_list,
+        'past_cov': past_cov_ts_list,
+        'future_cov': future_cov_ts_list,
+    })
 
-    def save(data, path):
-        """将数据保存到指定路径"""
-        with open(path, 'wb') as file:
-            dump(data, file)
 
-    save(train_list, data_path / data_save_paths['train'])
-    save(val_list, data_path / data_save_paths['val'])
-    save(test_list, data_path / data_save_paths['test'])
-    save(past_cov_ts_list, data_path / data_save_paths['past_cov'])
-    save(future_cov_ts_list, data_path / data_save_paths['future_cov'])
+def load_time_series_data():
+    """
+    读取 save_time_series_data 保存的序列包。
+
+    返回：
+        dict: 'train'、'val'、'test'、'past_cov'、'future_cov' -> 惰性加载的 TimeSeries 列表。
+    """
+    return load_series_bundle(config['data_path'] / config['bundle_dir'])
 
 
 def prepare_multi_timeseries_list(mode):
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+from collections.abc import Sequence
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from darts import TimeSeries
+from pathlib2 import Path
+# 自定义
+from loggers import logger
+
+META_NAME = 'meta.json'
+BUNDLE_VERSION = 1
+
+
+def _index_meta(index: pd.Index) -> dict:
+    """
+    时间索引的紧凑描述：整数索引记录起点和步长，有频率的日期索引记录起点和频率，其余记录全部时间。
+    """
+    if isinstance(index, pd.RangeIndex):
+        return {'start': int(index.start), 'step': int(index.step)}
+    if getattr(index, 'freq', None) is not None:
+        return {'start': index[0].isoformat(), 'freq': index.freqstr}
+    return {'times': [t.isoformat() for t in index]}
+
+
+def _index_from_meta(meta: dict, length: int) -> pd.Index:
+    if 'step' in meta:
+        return pd.RangeIndex(meta['start'], meta['start'] + length * meta['step'], meta['step'])
+    if 'freq' in meta:
+        return pd.date_range(meta['start'], periods=length, freq=meta['freq'])
+    return pd.DatetimeIndex(meta['times'])
+
+
+def _static_meta(ts: TimeSeries) -> Optional[dict]:
+    static = ts.static_covariates
+    if static is None:
+        return None
+    return {'columns': static.columns.tolist(), 'values': static.to_numpy().tolist()}
+
+
+def _digest(ts: TimeSeries, index: dict, static: Optional[dict]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(ts.values(copy=False), dtype=np.float32).data)
+    h.update(json.dumps([index, static, ts.components.tolist()], default=str).encode())
+    return h.hexdigest()
+
+
+def save_series_bundle(path, splits: Dict[str, List[TimeSeries]]):
+    """
+    将多组 TimeSeries 列表保存为紧凑的目录格式。
+
+    每组（如 train、val）的序列按行拼接成一个 float32 数组 ``{split}.npy``，
+    ``meta.json`` 记录各序列的起始行、长度、时间索引、分量名和静态协变量。
+    内容相同的序列（如每只股票共用的 future_cov）只保存一份。
+
+    :param path: 保存目录
+    :param splits: 组名 -> TimeSeries 列表，同一组内的序列分量须一致
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    meta = {'version': BUNDLE_VERSION, 'splits': {}}
+    for split, series_list in splits.items():
+        blocks, entries, seen, arrays = [], [], {}, []
+        columns = None
+        offset = 0
+        for ts in series_list:
+            if columns is None:
+                columns = ts.components.tolist()
+            elif ts.components.tolist() != columns:
+                raise ValueError(f"[{split}] 中序列的分量不一致：{columns} 与 {ts.components.tolist()}")
+            index = _index_meta(ts.time_index)
+            static = _static_meta(ts)
+            key = _digest(ts, index, static)
+            if key not in seen:
+                seen[key] = len(blocks)
+                values = ts.values(copy=False).astype(np.float32, copy=False)
+                blocks.append({'offset': offset, 'length': len(values), 'index': index, 'static': static})
+                arrays.append(values)
+                offset += len(values)
+            entries.append(seen[key])
+
+        width = len(columns) if columns else 0
+        stacked = np.concatenate(arrays, axis=0) if arrays else np.empty((0, width), dtype=np.float32)
+        tmp_path = path / f'{split}.tmp.npy'
+        np.save(str(tmp_path), stacked)
+        os.replace(tmp_path, path / f'{split}.npy')
+        meta['splits'][split] = {'columns': columns or [], 'blocks': blocks, 'entries': entries}
+        logger.info(f"序列包 [{split}]：{len(entries)} 条序列，去重后 {len(blocks)} 条，共 {offset} 行")
+
+    tmp_meta = path / f'{META_NAME}.tmp'
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_meta, path / META_NAME)
+
+
+class LazySeriesList(Sequence):
+    """
+    序列包中一组序列的惰性列表：数值以只读内存映射打开，访问某条序列时才构建 TimeSeries 并缓存。
+    重复的条目指向同一个 TimeSeries 对象。
+    """
+
+    def __init__(self, values: np.ndarray, split_meta: dict):
+        self._values = values
+        self._columns = pd.Index(split_meta['columns'])
+        self._blocks = split_meta['blocks']
+        self._entries = split_meta['entries']
+        self._built: Dict[int, TimeSeries] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _build(self, block_id: int) -> TimeSeries:
+        ts = self._built.get(block_id)
+        if ts is None:
+            block = self._blocks[block_id]
+            rows = slice(block['offset'], block['offset'] + block['length'])
+            static = block['static']
+            ts = TimeSeries.from_times_and_values(
+                times=_index_from_meta(block['index'], block['length']),
+                values=self._values[rows],
+                columns=self._columns,
+                static_covariates=(
+                    pd.DataFrame(static['values'], columns=static['columns']) if static is not None else None
+                ),
+            )
+            self._built[block_id] = ts
+        return ts
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            return [self._build(block_id) for block_id in self._entries[item]]
+        return self._build(self._entries[item])
+
+
+def load_series_bundle(path, mmap: bool = True) -> Dict[str, LazySeriesList]:
+    """
+    读取序列包。
+
+    :param path: 保存目录
+    :param mmap: 是否以只读内存映射方式打开数值数组
+    :return: 组名 -> LazySeriesList
+    """
+    path = Path(path)
+    with open(path / META_NAME, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return {
+        split: LazySeriesList(np.load(str(path / f'{split}.npy'), mmap_mode='r' if mmap else None), split_meta)
+        for split, split_meta in meta['splits'].items()
+    }
@@ -1,13 +1,19 @@
 import pandas as pd
 from pathlib import Path
-from joblib import dump, load
 from darts import TimeSeries
-from darts.dataprocessing.transformers import Scaler
 import numpy as np
 from sklearn.preprocessing import OrdinalEncoder, MinMaxScaler
 # 自定义
 from loggers import logger
 from data.xt_data_download import download_history_data
+from data.features import (ADD_FEATURES, FEATURES, compute, dependencies, ewm_step, input_columns, recursive_specs,
+                           required_window, spec_version)
+from data.data_config import config as data_config
+from data.feature_cache import FeatureCache
+from data.bar_store import BarStore
+from data.panel import cast_value_columns, value_dtype
+from data.batch_scaler import BatchScaler
+from config import config
 
 
 def encode_and_scale_dataframe(df):
@@ -130,23 +136,210 @@ def add_features(df):
     return df
 
 
-def clean_data(data):
+def fill_and_sequence_groups(data):
+    """
+    逐只股票前向、后向填充缺失数据，按时间排序并添加时间的整数序列。
+    结果与依次 ``groupby('stock_code').apply`` ``forward_fill_data`` 和 ``add_time_sequence`` 相同，
+    但只做一次分组的向量化操作。
+    @param data: 带 stock_code 列的长表 DataFrame。
+    @return: 以 (stock_code, time_seq) 为索引的 DataFrame。
+    """
+    data = data.sort_values('stock_code', kind='stable')
+    codes = data['stock_code']
+    data = data.drop(columns='stock_code')
+    data = data.groupby(codes, sort=False).ffill()
+    data = data.groupby(codes, sort=False).bfill()
+    data.fillna(0, inplace=True)
+    data['stock_code'] = codes
+    data = data.sort_values(['stock_code', 'time'], kind='stable')
+    codes = data.pop('stock_code')
+    time_seq = data.groupby(codes.to_numpy(), sort=False).cumcount().to_numpy()
+    data['time'] = time_seq
+    data.index = pd.MultiIndex.from_arrays([codes.to_numpy(), time_seq], names=['stock_code', 'time_seq'])
+    return data
+
+
+def _resumable(features):
+    """
+    能否只重算最后一个分区：递推特征要在结果里（用缓存的上一行作为初值）、输入是原始列，且没有窗口特征依赖它们。
+    """
+    recursive = recursive_specs(features)
+    columns = set(input_columns(features))
+    if any(name not in features or col not in columns for name, (col, _) in recursive.items()):
+        return False
+    return not any(spec.window is not None and set(spec.inputs) & set(recursive) for spec in dependencies(features))
+
+
+def _raw_features(columns, features, first, starts, ends, dtype, seeds):
+    """
+    计算若干只股票从 starts 行到 ends 行（不含）的未填充特征。
+
+    starts 之前 first 起的行只作为滚动窗口的预热，不输出；递推特征（EMA）从 starts 行起由 seeds 逐行递推，
+    seeds 为 NaN 时即从该行的值开始，与完整计算相同。
+    @param first, starts, ends: 每只股票在全部行中的预热起点、输出起点和终点
+    @param seeds: 递推特征名 -> 每只股票在 starts 前一行的值；为 None 时全部从股票的第一行计算，不需要递推
+    @return: 特征名 -> 一维数组，依次为各股票 [starts, ends) 的行
+    """
+    lengths = ends - first
+    col = np.repeat(np.arange(len(first)), lengths)
+    local = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(first, lengths) + local
+    shape = (lengths.max(), len(first))
+    inputs = {}
+    for name, values in columns.items():
+        inputs[name] = np.full(shape, np.nan, dtype=dtype)
+        inputs[name][local, col] = values[rows]
+    raw = compute(inputs, features, fill=False)
+
+    warm = starts - first
+    for name, weighted in (seeds or {}).items():
+        column, span = recursive_specs(features)[name]
+        for t in range(shape[0]):
+            active = t >= warm
+            weighted = np.where(active, ewm_step(weighted, inputs[column][t], span), weighted)
+            raw[name][t] = np.where(active, weighted, raw[name][t])
+
+    keep = local >= warm[col]
+    return {name: values[local[keep], col[keep]] for name, values in raw.items()}
+
+
+def _bfill_groups(values, ends):
+    """
+    一维数组按股票分段向后填充 NaN，不跨越股票。
+    @param ends: 每一行所属股票的终点行号（不含）
+    """
+    positions = np.where(np.isnan(values), len(values), np.arange(len(values)))
+    positions = np.minimum.accumulate(positions[::-1])[::-1]
+    filled = positions < ends
+    values = values.copy()
+    values[filled] = values[positions[filled]]
+    return values
+
+
+def add_features_vectorized(data, features=None, cache=None, dtype=np.float64, partitions=None):
+    """
+    一次向量化计算全部股票的特征，结果与 ``groupby('stock_code').apply(add_features)`` 相同。
+
+    使用缓存时每只股票的行按分区切开：之前的分区整体作为一个缓存块，最后一个分区单独作为一个缓存块。
+    追加新K线只改变最后一个分区的键，之前的分区命中缓存，最后一个分区带上滚动窗口需要的预热行重新计算。
+    缓存的是未填充的原始特征，合并后再按股票向后填充。
+    @param data: 以 (stock_code, time_seq) 为索引、按其排序的 DataFrame。
+    @param features: 需要的特征名，默认为 add_features 的全部特征；只计算这些特征及其依赖。
+    @param cache: FeatureCache，命中的分区直接读取缓存，只计算输入有变化的分区。
+    @param dtype: 计算和输出特征的浮点类型，FeatureSpec 声明了 dtype 的特征按声明的类型输出。
+    @param partitions: 与行对齐的分区标签，默认按 date 列取 BarStore 日线分区（年），没有 date 列时每只股票一个分区。
+    @return: 添加特征后的 DataFrame，索引为 (stock_code, 行号)。
+    """
+    features = ADD_FEATURES if features is None else list(features)
+    codes, time_seq = data.index.get_level_values(0), data.index.get_level_values(1)
+    stock_idx, unique_codes = pd.factorize(codes)
+    time_seq = np.asarray(time_seq)
+    columns = {col: data[col].to_numpy(dtype=dtype) for col in input_columns(features)}
+    # 声明了 dtype 的特征按声明的类型输出
+    results = {name: np.empty(len(data), dtype=FEATURES[name].dtype or dtype) for name in features}
+
+    # 行已按股票排序，每只股票是连续的一段
+    bounds = np.r_[0, np.flatnonzero(np.diff(stock_idx)) + 1, len(stock_idx)]
+    ends = bounds[1:]
+    # 每只股票从 starts 行起需要计算，最后一个分区从 opens 行开始
+    starts = bounds[:-1].copy()
+    opens = bounds[:-1].copy()
+    resumable = _resumable(features)
+    seeds = {name: np.full(len(unique_codes), np.nan, dtype=dtype) for name in recursive_specs(features)} \
+        if resumable else {}
+    closed_keys, open_keys = [], []
+    if cache is not None:
+        if partitions is None and 'date' in data.columns:
+            partitions = data['date'].to_numpy(dtype=str).astype(f"U{BarStore.partition_width('1d')}")
+        if partitions is not None:
+            partitions = np.asarray(partitions)
+            changes = np.flatnonzero(partitions[1:] != partitions[:-1]) + 1
+        else:
+            changes = np.array([], dtype=int)
+        version = spec_version(features)
+        for s, code in enumerate(unique_codes):
+            inner = changes[np.searchsorted(changes, bounds[s], 'right'):np.searchsorted(changes, ends[s])]
+            cuts = np.r_[bounds[s], inner, ends[s]]
+            key, closed_key = '', None
+            for j in range(len(cuts) - 1):
+                closed_key = key or None
+                rows = slice(cuts[j], cuts[j + 1])
+                key = cache.key(code, {col: values[rows] for col, values in columns.items()}, version, key)
+            opens[s] = cuts[-2]
+            closed_keys.append(closed_key)
+            open_keys.append(key)
+
+            if closed_key is not None:
+                block = cache.get(closed_key, features)
+                if block is None:
+                    continue
+                rows = slice(bounds[s], opens[s])
+                for name in features:
+                    results[name][rows] = block[name]
+                if resumable:
+                    starts[s] = opens[s]
+                    for name in seeds:
+                        seeds[name][s] = results[name][opens[s] - 1]
+            block = cache.get(key, features)
+            if block is not None:
+                starts[s] = ends[s]
+                rows = slice(opens[s], ends[s])
+                for name in features:
+                    results[name][rows] = block[name]
+
+    todo = np.flatnonzero(starts < ends)
+    if len(todo):
+        first = np.maximum(starts[todo] - (required_window(features) - 1), bounds[:-1][todo])
+        resumed = np.any(starts[todo] > bounds[:-1][todo])
+        raw = _raw_features(columns, features, first, starts[todo], ends[todo], dtype,
+                            {name: values[todo] for name, values in seeds.items()} if resumed else None)
+        lengths = ends[todo] - starts[todo]
+        local = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = np.repeat(starts[todo], lengths) + local
+        for name, values in raw.items():
+            results[name][rows] = values
+
+    if cache is not None:
+        for s in todo:
+            cache.put(open_keys[s], {name: values[opens[s]:ends[s]] for name, values in results.items()})
+            if closed_keys[s] is not None and starts[s] == bounds[s]:
+                cache.put(closed_keys[s], {name: values[bounds[s]:opens[s]] for name, values in results.items()})
+        cache.evict_if_due()
+        partial = np.count_nonzero(starts[todo] > bounds[:-1][todo])
+        logger.info(f"特征缓存命中 {len(unique_codes) - len(todo)} 只股票，"
+                    f"只重新计算最后一个分区 {partial} 只，全部重新计算 {len(todo) - partial} 只")
+
+    row_ends = np.repeat(ends, np.diff(bounds))
+    results = {name: _bfill_groups(values, row_ends) for name, values in results.items()}
+    data = pd.concat([data, pd.DataFrame(results, index=data.index)], axis=1)
+    data.index = pd.MultiIndex.from_arrays([codes, time_seq], names=['stock_code', None])
+    return data
+
+
+def clean_data(data, features=None, use_cache=None, dtype=None):
     """
     清洗数据，包括前向填充、添加时间序列和计算隔夜收益率等操作。
     @param data: 原始数据 DataFrame。
+    @param features: 需要计算的特征名，默认取 data_config 中的 past_cov_features。
+    @param use_cache: 是否使用特征缓存，默认取 config.ini 的 [feature_cache] enabled。
+    @param dtype: 数值列和特征的浮点类型，默认取 config.ini 的 [data] dtype。
     @return: 清洗后的数据 DataFrame。
     """
+    if use_cache is None:
+        use_cache = config.getboolean('feature_cache', 'enabled', fallback=True)
+    dtype = value_dtype() if dtype is None else np.dtype(dtype)
+    data = cast_value_columns(data, dtype)
     data.replace([np.inf, -np.inf], 0, inplace=True)
     data = data.reset_index(drop=False)
-    data = data.groupby('stock_code').apply(forward_fill_data, include_groups=False)
-    data = data.groupby('stock_code').apply(add_time_sequence, include_groups=False)
+    data = fill_and_sequence_groups(data)
     data = calculate_overnight_return(data)
     # 预测第二天的隔夜收益率，而不是当天的
     data['overnight_return'] = data.groupby('stock_code')['overnight_return'].shift(-1)
     # 0/1目标
-    data['overnight_return'] = data['overnight_return'].apply(lambda x: 1 if x > 0.002 else 0)
+    data['overnight_return'] = np.where(data['overnight_return'] > 0.002, 1, 0).astype(dtype)
 
-    data = data.groupby('stock_code').apply(add_features, include_groups=False)
+    data = add_features_vectorized(data, data_config['past_cov_features'] if features is None else features,
+                                   cache=FeatureCache() if use_cache else None, dtype=dtype)
     data.reset_index(inplace=True)
     data.replace([np.inf, -np.inf], 0, inplace=True)
     return data
@@ -224,13 +417,12 @@ def get_future_dates(data, xtdata):
 def load_scaler(path):
     """
     加载数据归一化器。
-    @param path: 归一化器文件路径。
-    @return: 加载的归一化器对象。
+    @param path: 归一化器文件路径（npz）。
+    @return: 加载的 BatchScaler。
     """
     try:
-        with open(path, 'rb') as f:
-            return load(f)
-    except EOFError:
+        return BatchScaler.load(path)
+    except (OSError, ValueError, KeyError):
         logger.error(f"Failed to load scaler: {path} is incomplete or corrupted.")
         return None
 
@@ -238,10 +430,17 @@ def load_scaler(path):
 def save_scaler(scaler, path):
     """
     保存数据归一化器。
-    @param scaler: 归一化器对象。
-    @param path: 保存路径。
+    @param scaler: BatchScaler。
+    @param path: 保存路径（npz）。
+    """
+    scaler.save(path)
+
+
+def as_float32(ts):
+    """
+    将 TimeSeries 转为 float32，已是 float32 时直接返回。
     """
-    dump(scaler, open(path, 'wb'))
+    return ts if ts.dtype == np.float32 else ts.astype(np.float32)
 
 
 def standardize_data(target_ts, past_cov_ts, future_cov_ts, start_index, training_or_predicting, path_scaler_train,
@@ -261,16 +460,17 @@ def standardize_data(target_ts, past_cov_ts, future_cov_ts, start_index, trainin
     past_cov_ts = past_cov_ts[start_index:]
     future_cov_ts = future_cov_ts[start_index:]
 
-    target_ts = target_ts.astype(np.float32)
-    past_cov_ts = past_cov_ts.astype(np.float32)
-    future_cov_ts = future_cov_ts.astype(np.float32)
+    # float32 模式下已是 float32，不再复制
+    target_ts = as_float32(target_ts)
+    past_cov_ts = as_float32(past_cov_ts)
+    future_cov_ts = as_float32(future_cov_ts)
 
     scaler_train, scaler_past = None, None
 
     if training_or_predicting == 'training':
         train, val = target_ts[:-60], target_ts[-80:]
-        scaler_train = Scaler().fit(train)
-        scaler_past = Scaler().fit(past_cov_ts)
+        scaler_train = BatchScaler().fit(train)
+        scaler_past = BatchScaler().fit(past_cov_ts)
         save_scaler(scaler_train, path_scaler_train)
         save_scaler(scaler_past, path_scaler_past)
     elif training_or_predicting == 'predicting':
@@ -312,8 +512,8 @@ def get_training_data(training_or_predicting='training', xtdata=None):
     logger.debug("future_cov_df准备就绪")
 
     # 获取文件路径
-    path_scaler_train = str(Path(__file__).parent.parent / 'assets/runtime/scaler_train.pkl')
-    path_scaler_past = str(Path(__file__).parent.parent / 'assets/runtime/scaler_past.pkl')
+    path_scaler_train = str(Path(__file__).parent.parent / 'assets/runtime/scaler_train.npz')
+    path_scaler_past = str(Path(__file__).parent.parent / 'assets/runtime/scaler_past.npz')
 
     # 4. 数据标准化
     start_index = target_ts.time_index[-1000]
@@ -2,49 +2,68 @@ import os
 import xtquant.xtdata as xtdata
 from datetime import datetime
 import pandas as pd
-from pathlib2 import Path
 # 自定义
 from utils.utils_data import get_targets_list_from_csv  # 获取股票列表
 from loggers import logger
 from utils.utils_data import download_history_data
 from data.utils import rbf_encode_time_features
+from data.bar_store import BarStore
+from data.panel import MarketPanel, cast_value_columns
+from data.panel_cache import PanelCache
 
 
-def get_stock_data_as_dataframe(period='1d', start_time=None, end_time=None):
+def get_local_market_data(period='1d', start_time=None, end_time=None, stock_list=None, download=True):
     """
-    获取股票历史数据并返回 pandas DataFrame。
+    增量下载后读取本地行情。
 
     :param period: 时间周期，默认 '1d'
-    :param start_time: 起始时间，格式为 'YYYYMMDD'
+    :param start_time: 起始时间，格式为 'YYYYMMDD'，默认 '20200101'
     :param end_time: 结束时间，格式为 'YYYYMMDD'，默认当前日期
-    :return: 包含股票数据的 pandas DataFrame
+    :param stock_list: 股票代码列表，默认为从 CSV 文件获取
+    :param download: 是否先增量下载，默认 True
+    :return: 股票代码 -> 以日期为索引的 DataFrame
     """
     if start_time is None:
         start_time = '20200101'
     if end_time is None:
         end_time = datetime.now().strftime('%Y%m%d%H%M%S')
-    stock_list = get_targets_list_from_csv()
-
-    # pd.to_datetime("20230101")
+    if stock_list is None:
+        stock_list = get_targets_list_from_csv()
 
     # 下载数据
-    download_history_data(stock_list=stock_list, period=period, start_time=start_time, end_time=end_time, incrementally=False)
+    if download:
+        download_history_data(stock_list=stock_list, period=period, start_time=start_time, end_time=end_time,
+                              incrementally=True)
+
+    return xtdata.get_local_data(
+        field_list=[],
+        stock_list=stock_list,
+        period=period,
+        start_time=start_time,
+        end_time=end_time,
+        count=-1,
+        # dividend_type='front_ratio',
+        dividend_type='front',
+        fill_data=True
+    )
+
+
+def get_stock_data_as_dataframe(period='1d', start_time=None, end_time=None, dtype=None):
+    """
+    获取股票历史数据并返回 pandas DataFrame。
 
+    :param period: 时间周期，默认 '1d'
+    :param start_time: 起始时间，格式为 'YYYYMMDD'
+    :param end_time: 结束时间，格式为 'YYYYMMDD'，默认当前日期
+    :param dtype: 数值列的类型，默认取 config.ini 的 [data] dtype；逐只股票转换后再拼接，避免出现整表的 float64 副本
+    :return: 包含股票数据的 pandas DataFrame
+    """
     try:
-        market_data = xtdata.get_local_data(
-            field_list=[],
-            stock_list=stock_list,
-            period=period,
-            start_time=start_time,
-            end_time=end_time,
-            count=-1,
-            # dividend_type='front_ratio',
-            dividend_type='front',
-            fill_data=True
-        )
+        market_data = get_local_market_data(period=period, start_time=start_time, end_time=end_time)
 
         df_list = []
         for field, df in market_data.items():
+            df = cast_value_columns(df, dtype)
             df['stock_code'] = field
             df.index.name = 'date'
             df_list.append(df)
@@ -55,6 +74,57 @@ def get_stock_data_as_dataframe(period='1d', start_time=None, end_time=None):
         return pd.DataFrame()  # 返回空的 DataFrame 以防止后续代码崩溃
 
 
+def download_and_save_xt_panel(period='1d', start_time=None, end_time=None, fields=None, download=True):
+    """
+    下载股票数据，追加写入本地K线存储，并直接构建 ``[field, stock, time]`` 的 float32 行情面板，
+    省去拼接长表再 pivot 回宽表的两次复制。
+
+    :param period: 时间周期，默认 '1d'
+    :param start_time: 起始时间，格式为 'YYYYMMDD'
+    :param end_time: 结束时间，格式为 'YYYYMMDD'，默认当前日期
+    :param fields: 面板包含的字段，默认为全部数值字段
+    :param download: 是否先增量下载，默认 True
+    :return: MarketPanel
+    """
+    market_data = get_local_market_data(period=period, start_time=start_time, end_time=end_time, download=download)
+    try:
+        BarStore().append_local_data(market_data, period=period)
+    except Exception as e:
+        logger.error(f"写入K线存储失败，错误信息：{e}")
+    return MarketPanel.from_local_data(market_data, fields=fields)
+
+
+def publish_market_panel(period='1d', download=False):
+    """
+    由本地行情构建清洗后的面板并发布到内存映射缓存，返回只读映射的面板。
+    在每次下载历史数据之后调用。
+
+    :param period: 时间周期，默认 '1d'
+    :param download: 是否先增量下载，默认 False
+    :return: MarketPanel
+    """
+    cache = PanelCache()
+    panel = download_and_save_xt_panel(period=period, download=download).fill()
+    cache.publish(panel, period=period)
+    return cache.open(period=period)
+
+
+def get_market_panel(period='1d', max_age=None):
+    """
+    获取清洗后的行情面板：缓存在 ``max_age`` 秒内发布过则直接只读映射，否则下载、清洗并重新发布。
+
+    :param period: 时间周期，默认 '1d'
+    :param max_age: 可接受的缓存最大时长（秒），None 或 0 表示总是重新构建
+    :return: MarketPanel
+    """
+    cache = PanelCache()
+    age = cache.age(period)
+    if max_age and age is not None and age <= max_age:
+        logger.info(f"使用 {age:.0f} 秒前发布的行情面板缓存")
+        return cache.open(period=period)
+    return publish_market_panel(period=period, download=True)
+
+
 def save_data_to_csv(df, filename):
     """
     将数据保存到CSV文件中。
@@ -70,17 +140,24 @@ def save_data_to_csv(df, filename):
 
 
 def download_and_save_xt_date(period='1d', start_time=None, end_time=None, callback=None):
+    """
+    下载股票数据并追加写入本地K线存储。
+
+    :param period: 时间周期，默认 '1d'
+    :param start_time: 起始时间，格式为 'YYYYMMDD'
+    :param end_time: 结束时间，格式为 'YYYYMMDD'，默认当前日期
+    :return: 包含股票数据的 pandas DataFrame
+    """
     # download_stock_data(period=period, start_time=start_time, end_time=end_time, callback=callback)
     combined_df = get_stock_data_as_dataframe(period=period, start_time=start_time, end_time=end_time)
 
     if not combined_df.empty:
-        logger.info("Combined data:")
-
-        now = datetime.now().strftime('%Y%m%d%H%M%S')
-        filename = Path(__file__).parent.parent / f'assets/data/combined_{period}_data_{now}.csv'
-        save_data_to_csv(combined_df, filename=filename)
+        try:
+            BarStore().append(combined_df, period=period)
+        except Exception as e:
+            logger.error(f"写入K线存储失败，错误信息：{e}")
     else:
-        logger.warning("未获取到任何数据，未保存到 CSV 文件。")
+        logger.warning("未获取到任何数据，未写入K线存储。")
     return combined_df
 
 
@@ -0,0 +1,304 @@
+"""
+低延迟的 CPU 推理。
+
+``TSMixerModel.predict`` 每次调用都会构建推理数据集、创建 PyTorch Lightning Trainer 再逐批预测，
+对交易时只需一次前向计算的场景来说准备工作远多于计算本身。
+这里把训练好的网络导出为 TorchScript，推理时把所有序列的最近一个窗口拼成一个批次张量，
+在 ``torch.inference_mode`` 下一次前向计算得到结果。预测步数不超过 ``output_chunk_length`` 时与 ``model.predict`` 一致。
+
+可选的动态量化版本把全连接层的权重转为 int8，推理时的 CPU 时间和内存更少；
+导出前在留出的数据集上与浮点模型比较误差，超过 [inference] quantized_max_rel_error 时不导出。
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+from darts import TimeSeries
+from darts.models import TSMixerModel
+from darts.utils.timeseries_generation import generate_index
+from pathlib2 import Path
+from torch import nn
+# 自定义
+from config import config
+from loggers import logger
+
+SeriesLike = Union[TimeSeries, Sequence[TimeSeries]]
+
+
+class TSMixerForward(nn.Module):
+    """
+    darts 的 ``_TSMixerModule`` 接收 ``(x_past, x_future, x_static)`` 元组，这里改为两个张量参数，便于导出 TorchScript。
+
+    - x_past: ``[batch, input_chunk_length, 目标分量 + 过去协变量 + 未来协变量]``
+    - x_future: ``[batch, output_chunk_length, 未来协变量]``
+    - 返回: ``[batch, output_chunk_length, 目标分量]``
+    """
+
+    def __init__(self, module: nn.Module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, x_past: torch.Tensor, x_future: torch.Tensor) -> torch.Tensor:
+        return self.module((x_past, x_future, None))[..., 0]
+
+
+def set_num_threads(num_threads: Optional[int] = None):
+    """
+    设置推理使用的线程数，默认取 config.ini 的 [inference] num_threads，0 表示使用 PyTorch 的默认值。
+    """
+    if num_threads is None:
+        num_threads = config.getint('inference', 'num_threads', fallback=0)
+    if num_threads > 0 and torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+
+
+class FastPredictor:
+    """
+    批量推理：每条序列取最后 input_chunk_length 行目标和协变量，拼成一个批次后一次前向计算。
+
+    :param module: TSMixerForward 或其 TorchScript
+    :param input_chunk_length: 输入窗口长度
+    :param output_chunk_length: 输出窗口长度
+    :param dims: (目标分量数, 过去协变量数, 未来协变量数)
+    :param dtype: 网络参数的类型
+    """
+
+    def __init__(self, module: nn.Module, input_chunk_length: int, output_chunk_length: int, dims: Sequence[int],
+                 dtype: torch.dtype = torch.float32):
+        self.module = module.eval()
+        self.input_chunk_length = input_chunk_length
+        self.output_chunk_length = output_chunk_length
+        self.dims = tuple(int(d) for d in dims)
+        self.dtype = dtype
+
+    @staticmethod
+    def _dims(model: TSMixerModel):
+        past_target, past_cov, historic_future_cov = model.train_sample[:3]
+        return tuple(0 if x is None else x.shape[1] for x in (past_target, past_cov, historic_future_cov))
+
+    @classmethod
+    def from_model(cls, model: TSMixerModel, script: bool = True, quantize: bool = False) -> 'FastPredictor':
+        """
+        由训练好的模型构建，script 为 True 时用 ``torch.jit.trace`` 转为 TorchScript。
+
+        :param quantize: 是否把 ``nn.Linear`` 动态量化为 int8（复制一份网络，不修改原模型）
+        """
+        dims = cls._dims(model)
+        dtype = model.model.dtype
+        module = TSMixerForward(model.model).eval()
+        # 与 LightningModule.to_torchscript 相同：复制、导出期间不检查是否连接了 Trainer
+        model.model._jit_is_scripting = True
+        try:
+            if quantize:
+                module = torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+            if script:
+                example = (torch.zeros(1, model.input_chunk_length, sum(dims), dtype=dtype),
+                           torch.zeros(1, model.output_chunk_length, dims[2], dtype=dtype))
+                with torch.inference_mode():
+                    module = torch.jit.freeze(torch.jit.trace(module, example))
+        finally:
+            model.model._jit_is_scripting = False
+        return cls(module, model.input_chunk_length, model.output_chunk_length, dims, dtype)
+
+    def save(self, path):
+        """
+        保存为 TorchScript 文件，窗口长度和维度写入附加文件。
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = f'{self.input_chunk_length},{self.output_chunk_length},' + ','.join(map(str, self.dims))
+        torch.jit.save(self.module, str(path), _extra_files={'meta': meta})
+
+    @classmethod
+    def load(cls, path) -> 'FastPredictor':
+        extra = {'meta': ''}
+        module = torch.jit.load(str(path), map_location='cpu', _extra_files=extra)
+        meta = extra['meta']
+        values = [int(v) for v in (meta.decode() if isinstance(meta, bytes) else meta).split(',')]
+        return cls(module, values[0], values[1], values[2:])
+
+    def forward(self, x_past: torch.Tensor, x_future: torch.Tensor) -> torch.Tensor:
+        """
+        对已拼好的批次张量推理，返回 ``[batch, output_chunk_length, 目标分量]``。
+        """
+        with torch.inference_mode():
+            return self.module(x_past.to(self.dtype), x_future.to(self.dtype))
+
+    def _batch(self, series: List[TimeSeries], past_covariates: List[TimeSeries],
+               future_covariates: List[TimeSeries]):
+        icl, ocl = self.input_chunk_length, self.output_chunk_length
+        past_rows, future_rows = [], []
+        for target, past, future in zip(series, past_covariates, future_covariates):
+            end = target.end_time()
+            p = past.get_index_at_point(end) + 1
+            f = future.get_index_at_point(end) + 1
+            if p < icl or f < icl or f + ocl > len(future):
+                raise ValueError(f"协变量不足以覆盖 {end} 前后的输入、输出窗口")
+            future_values = future.values(copy=False)
+            past_rows.append(np.concatenate([
+                target.values(copy=False)[-icl:],
+                past.values(copy=False)[p - icl:p],
+                future_values[f - icl:f],
+            ], axis=1))
+            future_rows.append(future_values[f:f + ocl])
+        return (torch.as_tensor(np.stack(past_rows), dtype=self.dtype),
+                torch.as_tensor(np.stack(future_rows), dtype=self.dtype))
+
+    def predict(self, n: int, series: SeriesLike, past_covariates: SeriesLike,
+                future_covariates: SeriesLike) -> SeriesLike:
+        """
+        与 ``TSMixerModel.predict(n, series, past_covariates, future_covariates)`` 相同的确定性预测，n 不超过 output_chunk_length。
+        """
+        if n > self.output_chunk_length:
+            raise ValueError(f"n={n} 超过 output_chunk_length={self.output_chunk_length}，请使用 model.predict")
+        single = isinstance(series, TimeSeries)
+        if single:
+            series, past_covariates, future_covariates = [series], [past_covariates], [future_covariates]
+        if len(series[0].components) != self.dims[0]:
+            raise ValueError(f"模型有 {self.dims[0]} 个目标分量，输入序列有 {len(series[0].components)} 个")
+
+        set_num_threads()
+        x_past, x_future = self._batch(list(series), list(past_covariates), list(future_covariates))
+        output = self.forward(x_past, x_future)[:, :n].numpy()
+
+        result = [
+            TimeSeries.from_times_and_values(
+                times=generate_index(start=target.end_time() + target.freq, length=n, freq=target.freq),
+                values=values.astype(target.dtype, copy=False),
+                columns=target.components,
+            )
+            for target, values in zip(series, output)
+        ]
+        return result[0] if single else result
+
+
+def compare_on_dataset(reference: FastPredictor, candidate: FastPredictor, dataset, batch_size: int = 256,
+                       max_samples: Optional[int] = None) -> Dict[str, float]:
+    """
+    在训练格式的数据集（如 MemmapWindowDataset 或 darts 的 MixedCovariatesSequentialDataset）上比较两个预测器。
+
+    :return: 两者输出的最大、平均绝对差，各自相对真实值的 MAE，以及 candidate 的 MAE 相对 reference 增加的比例
+    """
+    count = len(dataset) if max_samples is None else min(len(dataset), max_samples)
+    max_diff, sum_diff, ref_error, cand_error, size = 0.0, 0.0, 0.0, 0.0, 0
+    for begin in range(0, count, batch_size):
+        samples = [dataset[i] for i in range(begin, min(begin + batch_size, count))]
+        x_past = torch.as_tensor(np.stack([
+            np.concatenate([x for x in sample[:3] if x is not None], axis=1) for sample in samples
+        ]))
+        x_future = torch.as_tensor(np.stack([sample[3] for sample in samples]))
+        target = torch.as_tensor(np.stack([sample[-1] for sample in samples]))
+        ref = reference.forward(x_past, x_future).float()
+        cand = candidate.forward(x_past, x_future).float()
+        max_diff = max(max_diff, float((ref - cand).abs().max()))
+        sum_diff += float((ref - cand).abs().sum())
+        ref_error += float((ref - target).abs().sum())
+        cand_error += float((cand - target).abs().sum())
+        size += ref.numel()
+    return {
+        'max_abs_diff': max_diff,
+        'mean_abs_diff': sum_diff / size,
+        'reference_mae': ref_error / size,
+        'candidate_mae': cand_error / size,
+        'rel_error': (cand_error - ref_error) / ref_error if ref_error else 0.0,
+    }
+
+
+def export_quantized(model: TSMixerModel, dataset, path, max_rel_error: Optional[float] = None) -> Dict[str, float]:
+    """
+    导出动态量化的 TorchScript。先在 dataset 上与浮点模型比较，MAE 增加的比例不超过 max_rel_error 时才保存，
+    否则删除旧的量化文件，交易时回退到浮点模型。比较结果写入 ``{path}.json``。
+
+    :param dataset: 留出的数据集，见 compare_on_dataset
+    :param max_rel_error: 默认取 config.ini 的 [inference] quantized_max_rel_error
+    :return: 比较结果，passed 表示是否已导出
+    """
+    if max_rel_error is None:
+        max_rel_error = config.getfloat('inference', 'quantized_max_rel_error', fallback=0.05)
+    path = Path(path)
+    reference = FastPredictor.from_model(model, script=False)
+    quantized = FastPredictor.from_model(model, quantize=True)
+    report = compare_on_dataset(reference, quantized, dataset)
+    report['passed'] = report['rel_error'] <= max_rel_error
+    if report['passed']:
+        quantized.save(path)
+    elif path.exists():
+        os.remove(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f'{path}.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"int8 量化模型 MAE {report['candidate_mae']:.6f}，浮点模型 {report['reference_mae']:.6f}，"
+                f"相对增加 {report['rel_error']:.2%}，{'已导出' if report['passed'] else '超过阈值，未导出'}")
+    return report
+
+
+def held_out_test_dataset(test: TimeSeries, past_covariates: TimeSeries, future_covariates: TimeSeries,
+                          input_chunk_length: int, output_chunk_length: int):
+    """
+    get_training_data 留出的 test 序列组成的数据集，协变量只保留 test 的时间范围。
+    """
+    from darts.utils.data import MixedCovariatesSequentialDataset
+
+    return MixedCovariatesSequentialDataset(
+        target_series=test,
+        past_covariates=past_covariates.slice_intersect(test),
+        future_covariates=future_covariates.slice_intersect(test),
+        input_chunk_length=input_chunk_length,
+        output_chunk_length=output_chunk_length,
+    )
+
+
+def benchmark(model: TSMixerModel, series: SeriesLike, past_covariates: SeriesLike,
+              future_covariates: SeriesLike, n: int = 3, repeats: int = 20) -> dict:
+    """
+    比较 ``model.predict`` 与 FastPredictor（nn.Module、TorchScript 和 int8 量化）的平均耗时（毫秒）和最大差异。
+    """
+    def timed(predict):
+        predict()  # 预热
+        start = time.perf_counter()
+        for _ in range(repeats):
+            output = predict()
+        return (time.perf_counter() - start) / repeats * 1000, output
+
+    def values(output):
+        return np.stack([ts.values() for ts in ([output] if isinstance(output, TimeSeries) else output)])
+
+    results = {}
+    darts_ms, expected = timed(lambda: model.predict(n=n, series=series, past_covariates=past_covariates,
+                                                     future_covariates=future_covariates, verbose=False))
+    results['darts'] = {'ms': darts_ms, 'max_abs_diff': 0.0}
+    for name, script, quantize in [('module', False, False), ('torchscript', True, False), ('int8', True, True)]:
+        predictor = FastPredictor.from_model(model, script=script, quantize=quantize)
+        ms, output = timed(lambda: predictor.predict(n, series, past_covariates, future_covariates))
+        results[name] = {'ms': ms, 'max_abs_diff': float(np.abs(values(output) - values(expected)).max())}
+    for name, result in results.items():
+        logger.info(f"{name:<12} 平均耗时 {result['ms']:8.2f} ms，与 model.predict 的最大差异 {result['max_abs_diff']:.2e}")
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    import pandas as pd
+    from deep_learning.tsmixer import QUANTIZED_PATH, get_training_data, load_model
+
+    model = load_model()
+    if 'quantize' in sys.argv[1:]:
+        # 用上次训练保存的标准化对象，在留出的 test 窗口上检查量化误差并导出
+        _, _, test, past_cov_ts, future_cov_ts, _ = get_training_data(fit_scalers=False)
+        export_quantized(model, held_out_test_dataset(test, past_cov_ts, future_cov_ts, model.input_chunk_length,
+                                                      model.output_chunk_length), QUANTIZED_PATH)
+        sys.exit(0)
+
+    # 用与已保存模型维度相同的随机输入比较耗时
+    n_target, n_past, n_future = FastPredictor._dims(model)
+    length = model.input_chunk_length + 100
+    rng = np.random.default_rng(0)
+
+    def random_series(rows, width):
+        return TimeSeries.from_times_and_values(pd.RangeIndex(rows), rng.random((rows, width), dtype=np.float32))
+
+    benchmark(model, random_series(length, n_target), random_series(length, n_past),
+              random_series(length + model.output_chunk_length, n_future))
@@ -1,11 +1,76 @@
+import time
+from datetime import datetime
+from typing import Optional
+
 import torch
+from pytorch_lightning import Callback
 from pytorch_lightning.callbacks.early_stopping import EarlyStopping
 from darts.utils.callbacks import TFMProgressBar
 from torch.nn.modules.loss import MSELoss, CrossEntropyLoss
 from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
 
 
 work_dir = str(Path(__file__).parent.parent / "loggers/tsmixer_logs")
+
+
+class TimeBudgetCallback(Callback):
+    """
+    按时间预算停止训练，并记录吞吐量。
+
+    每个 epoch（含验证）结束时，如果按最近一个 epoch 的耗时估计，下一个 epoch 会超过截止时间，就让 Trainer 正常停止。
+    此时最优检查点已由 ModelCheckpoint 保存，训练结束后照常加载。
+
+    :param time_budget: 训练最长秒数，None 或 0 表示不限
+    :param deadline: 截止时刻，如 '09:15'，表示当天该时刻；None 或空字符串表示不限
+    :param manual: 是否为手动训练。例行训练开始时已过截止时刻（如作业延迟或失败重试）则拒绝训练，手动训练不受截止时刻限制
+    """
+
+    def __init__(self, time_budget: Optional[float] = None, deadline: Optional[str] = None, manual: bool = False):
+        super().__init__()
+        self.time_budget = time_budget or None
+        self.deadline = deadline or None
+        self.manual = manual
+        self.stop_at: Optional[float] = None
+        self.epoch_start = 0.0
+        self.epoch_samples = 0
+
+    def _deadline_timestamp(self) -> Optional[float]:
+        if not self.deadline or self.manual:
+            return None
+        hour, minute = (int(v) for v in self.deadline.split(':'))
+        deadline = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
+        if deadline <= time.time():
+            # 例行训练已经晚于截止时刻，继续训练会与开盘重叠
+            raise RuntimeError(f"已过训练截止时刻 {self.deadline}，本次不训练")
+        return deadline
+
+    def on_train_start(self, trainer, pl_module):
+        limits = [t for t in (self._deadline_timestamp(),
+                              time.time() + self.time_budget if self.time_budget else None) if t is not None]
+        self.stop_at = min(limits) if limits else None
+        if self.stop_at is not None:
+            logger.info(f"训练截止时间 {datetime.fromtimestamp(self.stop_at):%H:%M:%S}")
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.epoch_start = time.time()
+        self.epoch_samples = 0
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        self.epoch_samples += len(batch[0])
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        now = time.time()
+        seconds = now - self.epoch_start
+        logger.info(f"epoch {trainer.current_epoch}：{seconds:.1f} 秒，{self.epoch_samples} 个样本，"
+                    f"{self.epoch_samples / max(seconds, 1e-9):.0f} 样本/秒")
+        if self.stop_at is not None and now + seconds > self.stop_at:
+            logger.warning(f"下一个 epoch 预计超过训练截止时间，在第 {trainer.current_epoch} 个 epoch 后停止")
+            trainer.should_stop = True
+
+
 class ModelParameters:
     """模型参数"""
 
@@ -14,8 +79,16 @@ class ModelParameters:
             input_chunk_length=15, #13
             output_chunk_length=15,
             batch_size=32,
-            full_training=True
+            full_training=True,
+            time_budget=None,
+            deadline=None,
+            manual=False
     ):
+        """
+        :param time_budget: 训练最长秒数，默认取 config.ini 的 [training] time_budget，0 表示不限
+        :param deadline: 训练截止时刻（HH:MM），默认取 config.ini 的 [training] deadline，空表示不限
+        :param manual: 手动训练，不受截止时刻限制
+        """
 
         self.input_chunk_length = input_chunk_length  # lookback window
         self.output_chunk_length = output_chunk_length  # forecast/lookahead window
@@ -44,7 +117,11 @@ class ModelParameters:
         # It is only applied to the features of the target series and not the covariates.
         self.use_reversible_instance_norm = True
         self.optimizer_kwargs = self.get_optimizer_kwargs()
-        self.pl_trainer_kwargs = self.get_pl_trainer_kwargs(full_training)
+        if time_budget is None:
+            time_budget = config.getfloat('training', 'time_budget', fallback=0)
+        if deadline is None:
+            deadline = config.get('training', 'deadline', fallback='')
+        self.pl_trainer_kwargs = self.get_pl_trainer_kwargs(full_training, time_budget, deadline, manual)
         self.lr_scheduler_cls = torch.optim.lr_scheduler.ExponentialLR
         self.lr_scheduler_kwargs = {"gamma": 0.999}
         self.likelihood = None  # use a `likelihood` for probabilistic forecasts
@@ -53,7 +130,7 @@ class ModelParameters:
         # 是否覆盖同名的模型的checkpoints.
         self.force_reset = True
 
-    def get_pl_trainer_kwargs(self, full_training):
+    def get_pl_trainer_kwargs(self, full_training, time_budget=None, deadline=None, manual=False):
         # early stopping: this setting stops training once the validation
         # loss has not decreased by more than 1e-5 for 10 epochs
         early_stopper = EarlyStopping(
@@ -87,7 +164,7 @@ class ModelParameters:
             "limit_train_batches": limit_train_batches,
             "limit_val_batches": limit_val_batches,
             "accelerator": "auto",
-            "callbacks": [early_stopper, progress_bar],
+            "callbacks": [early_stopper, progress_bar, TimeBudgetCallback(time_budget, deadline, manual)],
         }
 
         return pl_trainer_kwargs
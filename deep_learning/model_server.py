@@ -0,0 +1,158 @@
+"""
+进程内常驻的预测服务。
+
+交易作业每次都从磁盘加载模型和标准化对象、重新查询交易日历，下单前的耗时主要花在这些准备工作上。
+ModelServer 在进程内保留模型、标准化对象、增量特征计算器和未来协变量缓存，``predict`` 只需获取最新行情并推理。
+训练作业保存新模型后，下一次 ``predict``（或后台检查线程）发现模型文件变化，加载新模型后原子替换。
+[inference] backend 为 torchscript 时用 FastPredictor 批量推理，不经过 darts 的 Trainer；
+为 quantized 时使用训练后通过误差检查的 int8 量化模型，没有与当前模型对应的量化文件时回退到 torchscript。
+"""
+import os
+import threading
+from typing import Iterable, Optional, Tuple
+
+import pandas as pd
+from darts.models import TSMixerModel
+# 自定义
+from config import config
+from loggers import logger
+from loggers.my_logger import SingletonMeta
+from data.batch_scaler import BatchScaler
+from data.feature_state import IncrementalFeatureCalculator
+from deep_learning.fast_inference import FastPredictor
+from deep_learning.tsmixer import (MODEL_PATH, QUANTIZED_PATH, SCALER_PAST_PATH, SCALER_TRAIN_PATH, get_training_data,
+                                   load_model)
+
+
+def _file_signature(path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ModelServer(metaclass=SingletonMeta):
+    """
+    常驻的 TSMixer 预测服务（单例）。
+
+    模型文件（``.pth.pkl`` 及其 ``.ckpt``）变化时连同标准化对象一起重新加载：训练作业先保存标准化对象、最后保存模型，
+    以模型文件为准可避免新标准化对象与旧模型搭配。加载失败（如文件正在写入）时继续使用旧模型，下次再试；
+    还没有加载过模型时按错误记录。
+    """
+
+    def __init__(self, model_path=None, quantized_path=None):
+        self.model_path = str(model_path or MODEL_PATH)
+        self.quantized_path = str(quantized_path or QUANTIZED_PATH)
+        self._lock = threading.Lock()
+        # 增量特征计算器和 darts 的预测都不是线程安全的，预测串行执行
+        self._predict_lock = threading.Lock()
+        self._model: Optional[TSMixerModel] = None
+        self._predictor: Optional[FastPredictor] = None
+        self._scalers: Optional[Tuple[BatchScaler, BatchScaler]] = None
+        self._signature = None
+        self._calculator = IncrementalFeatureCalculator.for_past_covariates()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _current_signature(self):
+        return _file_signature(self.model_path), _file_signature(self.model_path + '.ckpt')
+
+    def reload_if_changed(self) -> bool:
+        """
+        模型文件变化时加载新模型并替换。
+
+        :return: 是否替换了模型
+        """
+        signature = self._current_signature()
+        if signature == self._signature or signature[0] is None:
+            return False
+        try:
+            model = load_model(self.model_path)
+            scalers = (BatchScaler.load(SCALER_TRAIN_PATH), BatchScaler.load(SCALER_PAST_PATH))
+            predictor = self._load_predictor(model, signature[0])
+        except Exception as e:
+            if self._model is None:
+                # 还没有可用的模型，多半不是文件正在写入，而是文件本身无法加载
+                logger.error(f"加载模型 {self.model_path} 失败，没有可用的模型：{e}")
+            else:
+                logger.warning(f"加载新模型失败，继续使用当前模型：{e}")
+            return False
+        # 加载期间文件又被改写时丢弃本次结果
+        if self._current_signature() != signature:
+            return False
+        with self._lock:
+            self._model, self._predictor, self._scalers, self._signature = model, predictor, scalers, signature
+        logger.info(f"预测服务已加载模型 {self.model_path}")
+        return True
+
+    def _load_predictor(self, model: TSMixerModel, model_signature) -> Optional[FastPredictor]:
+        backend = config.get('inference', 'backend', fallback='darts')
+        if backend == 'quantized':
+            quantized_signature = _file_signature(self.quantized_path)
+            # 量化文件在模型保存之后导出，早于模型文件说明它属于旧模型
+            if quantized_signature is not None and quantized_signature[0] >= model_signature[0]:
+                logger.info(f"预测服务使用 int8 量化模型 {self.quantized_path}")
+                return FastPredictor.load(self.quantized_path)
+            logger.warning("没有与当前模型对应的 int8 量化模型，使用浮点模型")
+            backend = 'torchscript'
+        if backend == 'torchscript':
+            return FastPredictor.from_model(model)
+        return None
+
+    def warm_up(self):
+        """
+        加载模型、标准化对象和特征状态，供交易前调用。
+        """
+        self.reload_if_changed()
+        if not self._calculator.ready:
+            self._calculator.load()
+
+    def start_watcher(self, interval: Optional[float] = None):
+        """
+        启动后台线程定期检查模型文件，新模型在交易前即完成加载。
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        interval = interval or config.getfloat('model_server', 'watch_interval', fallback=60)
+        self._stop.clear()
+
+        def watch():
+            while not self._stop.wait(interval):
+                self.reload_if_changed()
+
+        self._watcher = threading.Thread(target=watch, name='model_server_watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def predict(self, universe: Optional[Iterable[str]] = None, n: int = 3, panel=None) -> pd.Series:
+        """
+        用最新行情预测下一交易日的隔夜收益率。
+
+        :param universe: 只返回这些股票的预测值，默认返回全部
+        :param n: 预测步数
+        :param panel: 行情面板，默认按 [panel_cache] predicting_max_age 获取
+        :return: 股票代码 -> 预测的隔夜收益率（第一步）
+        """
+        self.reload_if_changed()
+        with self._lock:
+            model, predictor, scalers = self._model, self._predictor, self._scalers
+        if model is None:
+            raise FileNotFoundError(f"没有可用的模型：{self.model_path}")
+
+        # 替换模型只改变引用，已取出的模型和标准化对象在本次预测中保持不变
+        with self._predict_lock:
+            train, val, _, past_cov_ts, future_cov_ts, scaler_train = get_training_data(
+                training_or_predicting='predicting', panel=panel, scalers=scalers, calculator=self._calculator
+            )
+            if predictor is not None and n <= predictor.output_chunk_length:
+                prediction = predictor.predict(n, train, past_cov_ts, future_cov_ts)
+            else:
+                prediction = model.predict(n=n, series=train, past_covariates=past_cov_ts,
+                                           future_covariates=future_cov_ts, verbose=False)
+        result = scaler_train.inverse_transform(prediction).pd_dataframe().iloc[0, :]
+        if universe is not None:
+            result = result[result.index.isin(list(universe))]
+        return result
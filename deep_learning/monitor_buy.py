@@ -5,10 +5,8 @@ import time
 import traceback
 import math
 from datetime import datetime
-from darts.models import TSMixerModel
 from xtquant import xtconstant
-from pathlib2 import Path
-from apscheduler.executors.pool import ProcessPoolExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from tzlocal import get_localzone
 from xtquant import xtdata
@@ -22,11 +20,12 @@ os.chdir(str(path.absolute()))
 if str(path) not in sys.path:
     sys.path.insert(0, str(path))
 
-from deep_learning.tsmixer import get_training_data
-from utils.utils_data import get_max_ask_price
+from deep_learning.model_server import ModelServer
+from utils.utils_data import get_max_ask_prices
 from utils.utils_general import is_trading_day
 from trader.xt_acc import acc
-from trader.xt_trader import xt_trader, setup_xt_trader
+from trader.order_gateway import OrderGateway, OrderRejected, OrderRequest
+from trader.session_manager import TraderSession, get_xt_trader
 from loggers import logger
 
 # 设置最大持仓数
@@ -35,16 +34,18 @@ MAX_POSITIONS = 3
 
 def buy_stock_async(stocks, strategy_name='', order_remark=''):
     """
-    买入股票函数：根据股票代码后缀确定所属市场并设置 order_type 后，异步发出买入指令。
+    买入股票函数：根据股票代码后缀确定所属市场并设置 order_type 后，通过 OrderGateway 一次性异步发出全部买入指令。
     """
 
+    # 复用进程内的交易连接，查询失败时才重新连接
     for i in range(15):
-        xt_trader = setup_xt_trader()
+        xt_trader = get_xt_trader()
         asset = xt_trader.query_stock_asset(acc)
         if asset is not None:
             break
         else:
             logger.warning(f"xt_trader.query_stock_asset返回值为None")
+            TraderSession().invalidate()
             time.sleep(1)
 
     if asset is None:
@@ -76,6 +77,9 @@ def buy_stock_async(stocks, strategy_name='', order_remark=''):
     #     xtdata.subscribe_quote(stock, period="l2quote", count=-1)
     # time.sleep(2)
 
+    # 整篮股票一次性获取行情并计算委托价
+    max_ask_prices = get_max_ask_prices(stocks)
+    requests = []
     for stock_code in stocks:
         if stock_code.endswith('.SH') or stock_code.endswith('.SZ'):
             order_type = xtconstant.FIX_PRICE
@@ -85,7 +89,7 @@ def buy_stock_async(stocks, strategy_name='', order_remark=''):
         logger.info(f"股票【{stock_code}】报价类型为：{order_type}")
 
         # 读取最高要价
-        max_ask_price = get_max_ask_price(stock_code)
+        max_ask_price = max_ask_prices.get(stock_code)
 
         if max_ask_price == 999999:
             logger.warning(f"股票已经涨停：{stock_code}")
@@ -104,11 +108,7 @@ def buy_stock_async(stocks, strategy_name='', order_remark=''):
             logger.info(f"{stock_code} 可买数量不足，现金：{cash}, 当前股价：{max_ask_price}")
             continue
 
-        # response = xt_trader.order_stock_async(acc, stock_code, xtconstant.STOCK_BUY, quantity, order_type,
-        #                                        max_ask_price,
-        #                                        strategy_name, order_remark)
-        response = xt_trader.order_stock(
-            account=acc,
+        requests.append(OrderRequest(
             stock_code=stock_code,
             order_type=xtconstant.STOCK_BUY,
             order_volume=quantity,
@@ -116,11 +116,18 @@ def buy_stock_async(stocks, strategy_name='', order_remark=''):
             price=max_ask_price,
             strategy_name=strategy_name,
             order_remark=order_remark
-        )
-        if response < 0:
-            logger.trader(f'\n【提交下单失败！- 买入 - {strategy_name}】\n 股票【{stock_code}】，\n数量【{quantity}】，\n单价【{max_ask_price}】，\n金额【{quantity*max_ask_price}】，\n返回值【{response}】')
+        ))
+
+    # 整篮委托一次性异步发出，再统一等待回报
+    gateway = OrderGateway()
+    responses = gateway.gather(gateway.submit_many(requests))
+    for request, response in zip(requests, responses):
+        stock_code, quantity, max_ask_price = request.stock_code, request.order_volume, request.price
+        if isinstance(response, Exception):
+            reason = response.error_msg if isinstance(response, OrderRejected) else str(response)
+            logger.trader(f'\n【提交下单失败！- 买入 - {strategy_name}】\n 股票【{stock_code}】，\n数量【{quantity}】，\n单价【{max_ask_price}】，\n金额【{quantity*max_ask_price}】，\n原因【{reason}】')
         else:
-            logger.trader(f'\n【提交下单成功！- 买入 - {strategy_name}】\n 股票【{stock_code}】，\n数量【{quantity}】，\n单价【{max_ask_price}】，\n金额【{quantity*max_ask_price}】，\n返回值【{response}】')
+            logger.trader(f'\n【提交下单成功！- 买入 - {strategy_name}】\n 股票【{stock_code}】，\n数量【{quantity}】，\n单价【{max_ask_price}】，\n金额【{quantity*max_ask_price}】，\n委托编号【{response.order_id}】')
 
 
 def trading_with_fitted_model():
@@ -128,22 +135,13 @@ def trading_with_fitted_model():
     读入训练好的神经网络模型并生成交易列表。
     """
     logger.info("开始执行交易策略。")
-    model_path = Path(__file__).parent.parent / './assets/models/tsmixer_model.pth.pkl'
-    logger.info(model_path)
 
     try:
-        model = TSMixerModel.load(str(model_path))
-        logger.info("模型加载成功。")
-
-        train, val, past_cov_ts, future_cov_ts, scaler_train = get_training_data(training_or_predicting='predicting')
-
-        prediction = model.predict(n=3, series=train, past_covariates=past_cov_ts, future_covariates=future_cov_ts)
-
-        result = scaler_train.inverse_transform(prediction)
-        df = result.pd_dataframe()
+        # 常驻的预测服务保留模型、标准化对象和特征状态，模型文件更新后自动替换
+        result = ModelServer().predict(n=3)
         logger.info("预测结果已生成。")
 
-        result = df.iloc[0, :].sort_values(ascending=False) * 100
+        result = result.sort_values(ascending=False) * 100
         to_buy = result[result > 0.2].index.to_list()
 
         logger.trader(f"》》》》买入列表：{to_buy}")
@@ -172,8 +170,9 @@ def schedule_trading_job():
     配置并启动计划任务调度器。
     """
     local_tz = get_localzone()
+    # 交易作业在本进程的线程中执行，预测服务常驻内存
     executors = {
-        'default': ProcessPoolExecutor(1)
+        'default': ThreadPoolExecutor(1)
     }
 
     job_defaults = {
@@ -188,6 +187,9 @@ def schedule_trading_job():
                       next_run_time=now)
     scheduler.add_job(conditionally_execute_trading, 'cron', day_of_week='mon-fri', hour=14, minute=59)
     scheduler.start()
+    server = ModelServer()
+    server.warm_up()
+    server.start_watcher()
     logger.info("任务调度器已启动。")
 
 
@@ -1,61 +1,88 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
 import pandas as pd
 import numpy as np
+import torch
 from darts import TimeSeries
-from darts.dataprocessing.transformers import Scaler
 from darts.models import TSMixerModel
 from xtquant import xtdata
 from pathlib2 import Path
-from pickle import dump, load
 # 自定义部分
-from data.xt_data_download import download_and_save_xt_date
+from data.xt_data_download import get_market_panel
+from config import config
 from loggers import logger
 from deep_learning.model_config import ModelParameters
 from utils.utils_general import is_trading_day
-from data.utils import rbf_encode_time_features
-
-def get_training_data(training_or_predicting='training'):
-    # 1. 下载数据
-    data = download_and_save_xt_date()
-
-    # 2. 清洗数据
-    def group_clean_data(df):
-        # 前向填充
-        df = (df.ffill().bfill()).reset_index(drop=True)
-        df.fillna(0, inplace=True)
-        # 增加时间的整数序列
-        df = df.reset_index(drop=True)
-        df['time'] = df.index
-        return df
-
-    data = data.reset_index(drop=False)
-    # 向前填充数据。
-    data = data.groupby('stock_code').apply(group_clean_data)
-    # 隔夜收益率
-    data['overnight_return'] = data['close'] / data['preClose'] - 1
-    # 异常值Na、inf等的处理，clip
-    logger.debug("data准备就绪。")
-    # 3. 生成TimeSeries
-    # 3.1 预测目标train
-    target_df = data.pivot(index="time", columns="stock_code", values='overnight_return')
-    # 3.2 过去协变量past_covariates
-    past_cov_df = data.pivot(index="time", columns="stock_code", values=['open', 'high', 'low', 'close', 'volume'])
-    past_cov_df.columns = ["_".join(list(c)) for c in past_cov_df.columns]
-    # 添加滞后项
-    dfs = [past_cov_df]
-    for i in [3, 5, 15, 30, 60]:
-        df = past_cov_df.pct_change(periods=i)
-        df.bfill(axis=0, inplace=True)
-        dfs.append(df)
-    past_cov_df = pd.concat(dfs, axis=1)
-    past_cov_df.bfill(axis=0, inplace=True)
-    past_cov_df.replace(np.inf, 0, inplace=True)
-    logger.debug("past_cov_df准备就绪。")
-    # 3.3 未来协变量future_covariates
+from data.utils import rbf_encode_time_features, as_float32
+from data.features import PAST_COV_COLUMNS, PAST_COV_LAGS, compute_pct_lags
+from data.feature_state import IncrementalFeatureCalculator
+from data.batch_scaler import BatchScaler
+from deep_learning.window_dataset import build_window_datasets
+from deep_learning.fast_inference import FastPredictor, export_quantized, held_out_test_dataset
+
+MODEL_PATH = Path(__file__).parent.parent / 'assets/models/tsmixer_model.pth.pkl'
+STATE_PATH = Path(__file__).parent.parent / 'assets/models/tsmixer_state.json'
+TORCHSCRIPT_PATH = Path(__file__).parent.parent / 'assets/models/tsmixer_model.ts'
+QUANTIZED_PATH = Path(__file__).parent.parent / 'assets/models/tsmixer_model.int8.ts'
+SCALER_TRAIN_PATH = Path(__file__).parent.parent / 'assets/runtime/scaler_train.npz'
+SCALER_PAST_PATH = Path(__file__).parent.parent / 'assets/runtime/scaler_past.npz'
+# 未来协变量缓存：(首日, 末日, 天数) -> DataFrame
+_FUTURE_COV_CACHE = {}
+_TORCH_LOAD_LOCK = threading.Lock()
+
+
+@contextmanager
+def trusted_model_files():
+    """
+    读取本机训练作业保存的模型文件。
+
+    darts 0.30 用 torch.load 的默认参数读取整个模型对象，torch 2.6 起默认 weights_only=True，加载会失败。
+    这些文件是可信的，期间 torch.load 的 weights_only 未指定（或为 None，如 Lightning 读取检查点时）时按 False 处理。
+    """
+    with _TORCH_LOAD_LOCK:
+        original = torch.load
+
+        def load(*args, **kwargs):
+            if kwargs.get('weights_only') is None:
+                kwargs['weights_only'] = False
+            return original(*args, **kwargs)
+
+        torch.load = load
+        try:
+            yield
+        finally:
+            torch.load = original
+
+
+def load_model(path=None) -> TSMixerModel:
+    """
+    加载 model.save 保存的模型，默认为 MODEL_PATH
+    """
+    with trusted_model_files():
+        return TSMixerModel.load(str(path or MODEL_PATH))
+
+
+def future_covariates(dates) -> pd.DataFrame:
+    """
+    由交易日历编码的未来协变量，行与 dates 及其后一年的交易日对齐（整数索引）。
+    交易日历查询和编码结果按日期范围缓存，同一天内重复预测不再查询。
+
+    :param dates: 面板的日期字符串数组
+    """
+    key = (dates[0], dates[-1], len(dates))
+    cached = _FUTURE_COV_CACHE.get(key)
+    if cached is not None:
+        return cached
     # 获取交易日历
-    max_past_date = data['date'].max()
+    max_past_date = dates[-1]
     end_time = str(int(max_past_date) + 10000)
     future_date = xtdata.get_trading_calendar("SH", start_time=max_past_date, end_time=end_time)
-    ts = np.concatenate((data['date'].unique(), future_date[1:]))
+    ts = np.concatenate((dates, future_date[1:]))
     ts = pd.DatetimeIndex(ts)
     # ts = ts.floor("D")
 
@@ -74,82 +101,254 @@ def get_training_data(training_or_predicting='training'):
     #     },
     # )
     future_cov_df = future_cov_df.reset_index(drop=True)
+    _FUTURE_COV_CACHE.clear()
+    _FUTURE_COV_CACHE[key] = future_cov_df
+    return future_cov_df
+
+
+def get_training_data(training_or_predicting='training', fit_scalers=True, panel=None, scalers=None, calculator=None):
+    """
+    :param training_or_predicting: 'training' 或 'predicting'
+    :param fit_scalers: 训练时是否重新拟合标准化对象；增量微调时为 False，沿用上次全量训练保存的标准化对象
+    :param panel: 行情面板，默认按 [panel_cache] 的设置获取
+    :param scalers: 预测时使用的 (目标, 过去协变量) 标准化对象，默认从文件加载
+    :param calculator: 预测时使用的增量特征计算器，默认新建并从状态文件加载
+    :return: (train, val, test, past_cov_ts, future_cov_ts, scaler_train)。test 为训练时留出的最后 [training] test_length 行
+             （另带 15 行输入窗口），不参与训练、验证和选模，只用于检查 int8 量化误差；预测时为 None
+    """
+    # 1. 下载数据，得到 [field, stock, time] 的 float32 面板
+    # 2. 清洗数据：逐只股票沿时间向前、向后填充，剩余缺失值置 0。
+    # 训练时直接只读映射下载作业刚发布的面板缓存；预测时需要当天最新K线，重新下载并发布。
+    if panel is None:
+        max_age = config.getint('panel_cache', f'{training_or_predicting}_max_age', fallback=0)
+        panel = get_market_panel(max_age=max_age)
+    logger.debug("data准备就绪。")
+    # 3. 生成TimeSeries
+    # 预测只需要最近 tail_length 行：滞后涨幅由增量计算器在上次保存的状态上推进，耗时与历史长度无关
+    inputs = {field: panel.field(field).T for field in PAST_COV_COLUMNS}
+    if training_or_predicting == 'predicting':
+        calculator = calculator or IncrementalFeatureCalculator.for_past_covariates()
+        dates, lags = calculator.update(inputs, panel.index, panel.codes)
+        first = len(panel.index) - len(dates)
+    else:
+        lags = compute_pct_lags(inputs)
+        first = 0
+    time_index = pd.RangeIndex(first, len(panel.index), name='time')
+    # 3.1 预测目标train
+    # 隔夜收益率
+    overnight_return = panel.field('close')[:, first:] / panel.field('preClose')[:, first:] - 1
+    target_df = pd.DataFrame(overnight_return.T, index=time_index, columns=panel.codes, copy=False)
+    # 3.2 过去协变量past_covariates
+    past_cov_df = panel.wide_fields(PAST_COV_COLUMNS).iloc[first:]
+    past_cov_df.index = time_index
+    # 添加滞后项，列名与原始列相同
+    dfs = [past_cov_df]
+    for i in PAST_COV_LAGS:
+        block = np.concatenate([lags[f'{field}_pct_{i}'] for field in PAST_COV_COLUMNS], axis=1)
+        dfs.append(pd.DataFrame(block, index=time_index, columns=past_cov_df.columns, copy=False))
+    past_cov_df = pd.concat(dfs, axis=1)
+    past_cov_df.bfill(axis=0, inplace=True)
+    past_cov_df.replace(np.inf, 0, inplace=True)
+    logger.debug("past_cov_df准备就绪。")
+    # 3.3 未来协变量future_covariates
+    future_cov_df = future_covariates(panel.index).iloc[first:]
     logger.debug("future_cov_df准备就绪")
     # 3.4 静态协变量static_covariates
     # 暂无。
     # 4. 数据标准化。
+    # 三者的时间索引起点相同，丢掉第一行
     target_ts = TimeSeries.from_dataframe(target_df)
-    start_index = target_ts.time_index[1]
-    target_ts = target_ts[start_index:]
-    target_ts = target_ts.astype(np.float32)
+    target_ts = target_ts[1:]
+    target_ts = as_float32(target_ts)
     past_cov_ts = TimeSeries.from_dataframe(past_cov_df)
-    past_cov_ts = past_cov_ts[start_index:]
-    past_cov_ts = past_cov_ts.astype(np.float32)
+    past_cov_ts = past_cov_ts[1:]
+    past_cov_ts = as_float32(past_cov_ts)
     future_cov_ts = TimeSeries.from_dataframe(future_cov_df)
-    future_cov_ts = future_cov_ts[start_index:]
-    future_cov_ts = future_cov_ts.astype(np.float32)
-    path_scaler_train = str(Path(__file__).parent.parent / 'assets/runtime/scaler_train.pkl')
-    path_scaler_past = str(Path(__file__).parent.parent / 'assets/runtime/scaler_past.pkl')
+    future_cov_ts = future_cov_ts[1:]
+    future_cov_ts = as_float32(future_cov_ts)
     if training_or_predicting == 'training':
-        train = target_ts[: -65]
-        val = target_ts[-80:]
+        test_length = config.getint('training', 'test_length', fallback=30)
+        head = target_ts[:-test_length]
+        train = head[: -65]
+        val = head[-80:]
         # train, val = target_ts.split_after(0.92)
-        scaler_train = Scaler(name='train').fit(train)
-        scaler_past = Scaler(name='past').fit(past_cov_ts)
-        dump(scaler_train, open(path_scaler_train, 'wb'))
-        dump(scaler_past, open(path_scaler_past, 'wb'))
+        test = target_ts[-(test_length + 15):]
+        if fit_scalers:
+            scaler_train = BatchScaler(name='train').fit(train)
+            scaler_past = BatchScaler(name='past').fit(past_cov_ts[:-test_length])
+            scaler_train.save(SCALER_TRAIN_PATH)
+            scaler_past.save(SCALER_PAST_PATH)
+        else:
+            scaler_train = BatchScaler.load(SCALER_TRAIN_PATH)
+            scaler_past = BatchScaler.load(SCALER_PAST_PATH)
     elif training_or_predicting == 'predicting':
         train = target_ts
         val = target_ts[-120:]
-        with open(path_scaler_train, 'rb') as f:
-            scaler_train = load(f)
-        with open(path_scaler_past, 'rb') as f:
-            scaler_past = load(f)
+        test = None
+        if scalers is not None:
+            scaler_train, scaler_past = scalers
+        else:
+            scaler_train = BatchScaler.load(SCALER_TRAIN_PATH)
+            scaler_past = BatchScaler.load(SCALER_PAST_PATH)
     else:
         raise ValueError("training_or_predicting must be 'training' or 'predicting'")
 
     train = scaler_train.transform(train)
     val = scaler_train.transform(val)
+    if test is not None:
+        test = scaler_train.transform(test)
     past_cov_ts = scaler_past.transform(past_cov_ts)
 
-    return train, val, past_cov_ts, future_cov_ts, scaler_train
+    return train, val, test, past_cov_ts, future_cov_ts, scaler_train
 
 
-def fit_tsmixer_model(test=False):
-    if not (is_trading_day() or test):
-        logger.info("今天不是交易日")
-        return False
-
+def load_training_state() -> dict:
+    """
+    读取上次训练的记录，文件不存在或损坏时返回空字典。
+    """
     try:
-        train, val, past_cov_ts, future_cov_ts, scaler_train = get_training_data()
-    except Exception as e:
-        logger.error("Failed to get training data: {}".format(e))
-        return False
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_training_state(state: dict):
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = STATE_PATH.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def choose_training_mode(state: dict, today: Optional[datetime] = None) -> str:
+    """
+    选择训练方式：没有已保存的模型、未启用微调或距上次全量训练已满 full_retrain_days 天时全量训练，否则增量微调。
+
+    :return: 'full' 或 'finetune'
+    """
+    today = today or datetime.now()
+    if not config.getboolean('training', 'finetune', fallback=False):
+        return 'full'
+    if not MODEL_PATH.exists() or 'last_full_train' not in state:
+        return 'full'
+    days = (today - datetime.strptime(state['last_full_train'], "%Y%m%d")).days
+    if days >= config.getint('training', 'full_retrain_days', fallback=7):
+        logger.info(f"距上次全量训练已 {days} 天，全量重训")
+        return 'full'
+    return 'finetune'
+
+
+def best_val_loss(model: TSMixerModel) -> Optional[float]:
+    """
+    最近一次训练中最优检查点的验证损失。
+    """
+    trainer = getattr(model, 'trainer', None)
+    if trainer is None:
+        return None
+    score = trainer.checkpoint_callback.best_model_score if trainer.checkpoint_callback is not None else None
+    if score is None:
+        score = trainer.callback_metrics.get('val_loss')
+    return float(score) if score is not None else None
+
+
+def train_tsmixer_model(mode: str, manual: bool = False) -> Optional[float]:
+    """
+    训练并保存模型。
+
+    :param mode: 'full' 从头训练；'finetune' 加载上次保存的模型权重，只用最近 finetune_windows 个窗口训练 finetune_epochs 个 epoch
+    :param manual: 手动训练，不受 [training] deadline 截止时刻限制
+    :return: 最优检查点的验证损失
+    """
+    finetune = mode == 'finetune'
+    train, val, test, past_cov_ts, future_cov_ts, scaler_train = get_training_data(fit_scalers=not finetune)
 
     # 5. 准备模型
+    parameters = ModelParameters(manual=manual)
     model = TSMixerModel(
-        **vars(ModelParameters()),
+        **vars(parameters),
         model_name="tsm"
     )
+    if finetune:
+        with trusted_model_files():
+            model.load_weights(str(MODEL_PATH))
 
     # 6. 训练模型
-    model.fit(
-        # 训练集
-        series=train,
-        past_covariates=past_cov_ts,
-        future_covariates=future_cov_ts,
-        # 验证集
-        val_series=val,
-        val_past_covariates=past_cov_ts,
-        val_future_covariates=future_cov_ts,
+    # 训练数据写入内存映射文件，训练时逐个窗口读取，内存中不再保留全部序列
+    train_dataset, val_dataset = build_window_datasets(
+        train, val, past_cov_ts, future_cov_ts,
+        input_chunk_length=parameters.input_chunk_length,
+        output_chunk_length=parameters.output_chunk_length,
+        samples_per_epoch=config.getint('training', 'samples_per_epoch', fallback=0),
+        last_windows=config.getint('training', 'finetune_windows', fallback=0) if finetune else None,
+    )
+    # 留出的 test 窗口很少，保留在内存中，训练结束后检查量化误差
+    test_dataset = held_out_test_dataset(test, past_cov_ts, future_cov_ts,
+                                         parameters.input_chunk_length, parameters.output_chunk_length)
+    del train, val, test, past_cov_ts, future_cov_ts
+    model.fit_from_dataset(
+        train_dataset,
+        val_dataset,
+        epochs=config.getint('training', 'finetune_epochs', fallback=20) if finetune else 0,
+        dataloader_kwargs={'num_workers': config.getint('training', 'num_loader_workers', fallback=0)},
     )
+    val_loss = best_val_loss(model)
 
     # 加载最优模型
-    model = model.load_from_checkpoint(model_name='tsm', work_dir=ModelParameters().work_dir)
+    with trusted_model_files():
+        model = model.load_from_checkpoint(model_name='tsm', work_dir=parameters.work_dir)
 
     # 保存模型
-    model_path = Path(__file__).parent.parent / 'assets/models/tsmixer_model.pth.pkl'
-    model.save(str(model_path))
+    model.save(str(MODEL_PATH))
+    # 导出 TorchScript，供不依赖 darts 的低延迟推理使用
+    try:
+        FastPredictor.from_model(model).save(TORCHSCRIPT_PATH)
+        # int8 量化版本在留出的 test 窗口上检查误差后导出
+        export_quantized(model, test_dataset, QUANTIZED_PATH)
+    except Exception as e:
+        logger.warning(f"导出 TorchScript 或量化模型失败：{e}")
+    logger.info(f"TSMixer 模型{'增量微调' if finetune else '全量训练'}完成，验证损失 {val_loss}")
+    return val_loss
+
+
+def fit_tsmixer_model(test=False, mode=None, manual=False):
+    """
+    每日训练：默认增量微调，每周或微调后验证损失明显变差（漂移）时全量重训。
+
+    :param mode: 'full'、'finetune'，None 时由 choose_training_mode 决定
+    :param manual: 手动训练（test 时也是），不受 [training] deadline 截止时刻限制；例行作业晚于截止时刻时不训练
+    """
+    if not (is_trading_day() or test):
+        logger.info("今天不是交易日")
+        return False
+
+    state = load_training_state()
+    mode = mode or choose_training_mode(state)
+    today = datetime.now().strftime("%Y%m%d")
+    manual = manual or test
+    try:
+        val_loss = train_tsmixer_model(mode, manual)
+    except Exception as e:
+        logger.error("Failed to train model ({}): {}".format(mode, e))
+        return False
+
+    baseline = state.get('baseline_val_loss')
+    drift_ratio = config.getfloat('training', 'drift_ratio', fallback=1.5)
+    if mode == 'finetune' and val_loss is not None and baseline and val_loss > baseline * drift_ratio:
+        # 微调后的模型已保存，全量重训失败时仍可用于预测
+        logger.warning(f"微调后验证损失 {val_loss:.6f} 超过全量训练时 {baseline:.6f} 的 {drift_ratio} 倍，全量重训")
+        mode = 'full'
+        try:
+            val_loss = train_tsmixer_model(mode, manual)
+        except Exception as e:
+            logger.error("Failed to train model ({}): {}".format(mode, e))
+            return False
+
+    if mode == 'full':
+        state.update(last_full_train=today, baseline_val_loss=val_loss)
+    state.update(last_train=today, last_mode=mode, last_val_loss=val_loss)
+    save_training_state(state)
+    return True
 
 
 if __name__ == '__main__':
@@ -158,6 +357,6 @@ if __name__ == '__main__':
     darts.utils
     logger.info("Starting training process...")
     try:
-        fit_tsmixer_model()
+        fit_tsmixer_model(manual=True)
     except Exception as e:
         logger.error("Training failed with exception: {}".format(e))
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+基于内存映射的训练窗口数据集。
+
+``TSMixerModel.fit`` 接收内存中的 TimeSeries，由 darts 自己生成训练窗口，内存占用随股票数 × 历史长度增长。
+这里把标准化后的目标和协变量写成 ``.npy`` 文件，训练时以只读内存映射打开，
+``__getitem__`` 只读取一个 ``input_chunk_length + output_chunk_length`` 的窗口，
+通过 ``model.fit_from_dataset`` 训练。
+"""
+import json
+import os
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import torch
+from darts import TimeSeries
+from darts.utils.data.training_dataset import MixedCovariatesTrainingDataset
+from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
+
+DEFAULT_WINDOW_ROOT = Path(__file__).parent.parent / config.get('training', 'window_root',
+                                                                fallback='assets/runtime/windows')
+META_NAME = 'meta.json'
+
+
+class WindowArray(NamedTuple):
+    """
+    一个按时间排列的 ``[time, component]`` 数组及其第一行的整数时间索引。
+    """
+    values: np.ndarray
+    start: int
+
+
+class WindowStore:
+    """
+    训练数组的目录：每条序列保存为 ``{name}.npy``，``meta.json`` 记录第一行的时间索引和分量名。
+    数组按需以只读内存映射打开；序列化（如传给 DataLoader 的子进程）时只传目录，子进程中重新打开。
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root is not None else DEFAULT_WINDOW_ROOT
+        self._meta: Optional[dict] = None
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def __getstate__(self):
+        return {'root': self.root, '_meta': self._meta, '_arrays': {}}
+
+    def write(self, **series: TimeSeries) -> 'WindowStore':
+        """
+        写入序列，序列须使用整数时间索引。
+
+        :param series: 名称 -> TimeSeries
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        meta = {}
+        for name, ts in series.items():
+            start = ts.start_time()
+            if not isinstance(start, (int, np.integer)):
+                raise ValueError(f"序列 {name} 须使用整数时间索引，实际为 {type(start).__name__}")
+            tmp_path = self.root / f'{name}.tmp.npy'
+            np.save(str(tmp_path), ts.values(copy=False).astype(np.float32, copy=False))
+            os.replace(tmp_path, self.root / f'{name}.npy')
+            meta[name] = {'start': int(start), 'columns': ts.components.tolist()}
+        tmp_meta = self.root / f'{META_NAME}.tmp'
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta, self.root / META_NAME)
+        self._meta = meta
+        self._arrays = {}
+        return self
+
+    @property
+    def meta(self) -> dict:
+        if self._meta is None:
+            with open(self.root / META_NAME, 'r', encoding='utf-8') as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def __getitem__(self, name: str) -> WindowArray:
+        values = self._arrays.get(name)
+        if values is None:
+            values = np.load(str(self.root / f'{name}.npy'), mmap_mode='r')
+            self._arrays[name] = values
+        return WindowArray(values, self.meta[name]['start'])
+
+
+class MemmapWindowDataset(MixedCovariatesTrainingDataset):
+    """
+    从 WindowStore 中读取训练窗口的数据集，样本格式与 darts 的 ``MixedCovariatesSequentialDataset`` 相同：
+    (past_target, past_covariates, historic_future_covariates, future_covariates, static_covariates,
+    sample_weight, future_target)，不使用静态协变量和样本权重。
+
+    构造时预先计算所有目标和协变量都完整覆盖的窗口起点（窗口索引）。
+    指定 samples_per_epoch 时每个 epoch 只随机抽取这么多个窗口（有放回），
+    随机数来自 torch，DataLoader 的每个子进程、每个 epoch 的种子都不同。
+
+    :param store: 训练数组目录
+    :param target: 目标序列名
+    :param past_covariates: 过去协变量序列名
+    :param future_covariates: 未来协变量序列名
+    :param input_chunk_length: 输入窗口长度
+    :param output_chunk_length: 输出窗口长度
+    :param samples_per_epoch: 每个 epoch 抽取的窗口数，None 或 0 表示使用全部窗口
+    :param last_windows: 只使用最新的这么多个窗口，None 或 0 表示使用全部窗口
+    """
+
+    def __init__(
+            self,
+            store: WindowStore,
+            target: str,
+            past_covariates: str,
+            future_covariates: str,
+            input_chunk_length: int,
+            output_chunk_length: int,
+            samples_per_epoch: Optional[int] = None,
+            last_windows: Optional[int] = None
+    ):
+        super().__init__()
+        self.store = store
+        self.names = (target, past_covariates, future_covariates)
+        self.input_chunk_length = input_chunk_length
+        self.output_chunk_length = output_chunk_length
+        self.index = self._window_index()
+        if last_windows:
+            self.index = self.index[-last_windows:]
+        if len(self.index) == 0:
+            raise ValueError(f"序列 {target} 没有完整的训练窗口")
+        self.samples_per_epoch = samples_per_epoch or None
+
+    def _window_index(self) -> np.ndarray:
+        """
+        所有可用窗口在目标数组中的起点。
+        """
+        target, past, future = (self.store[name] for name in self.names)
+        icl, ocl = self.input_chunk_length, self.output_chunk_length
+        # 以目标数组的行号表示，三个数组各自给出起点的上下界
+        low = max(0, past.start - target.start, future.start - target.start)
+        high = min(
+            len(target.values) - icl - ocl,
+            past.start + len(past.values) - icl - target.start,
+            future.start + len(future.values) - icl - ocl - target.start,
+        )
+        return np.arange(low, high + 1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        if self.samples_per_epoch is None:
+            return len(self.index)
+        return min(self.samples_per_epoch, len(self.index))
+
+    def __getitem__(self, idx: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, None, None, np.ndarray]:
+        if self.samples_per_epoch is not None:
+            idx = int(torch.randint(len(self.index), (1,)))
+        target, past, future = (self.store[name] for name in self.names)
+        icl, ocl = self.input_chunk_length, self.output_chunk_length
+        start = int(self.index[idx])
+        t = target.start + start
+        p = t - past.start
+        f = t - future.start
+        return (
+            np.array(target.values[start:start + icl]),
+            np.array(past.values[p:p + icl]),
+            np.array(future.values[f:f + icl]),
+            np.array(future.values[f + icl:f + icl + ocl]),
+            None,
+            None,
+            np.array(target.values[start + icl:start + icl + ocl]),
+        )
+
+
+def build_window_datasets(
+        train: TimeSeries,
+        val: TimeSeries,
+        past_covariates: TimeSeries,
+        future_covariates: TimeSeries,
+        input_chunk_length: int,
+        output_chunk_length: int,
+        samples_per_epoch: Optional[int] = None,
+        last_windows: Optional[int] = None,
+        root=None
+) -> Tuple[MemmapWindowDataset, MemmapWindowDataset]:
+    """
+    将 get_training_data 的结果写入 WindowStore，返回训练集和验证集。验证集总是使用全部窗口。
+    samples_per_epoch、last_windows 只作用于训练集，见 MemmapWindowDataset。
+
+    :return: (训练集, 验证集)
+    """
+    store = WindowStore(root).write(train=train, val=val, past_cov=past_covariates, future_cov=future_covariates)
+    train_dataset = MemmapWindowDataset(store, 'train', 'past_cov', 'future_cov',
+                                        input_chunk_length, output_chunk_length, samples_per_epoch, last_windows)
+    val_dataset = MemmapWindowDataset(store, 'val', 'past_cov', 'future_cov',
+                                      input_chunk_length, output_chunk_length)
+    logger.info(f"训练窗口：训练集 {len(train_dataset.index)} 个，每个 epoch 使用 {len(train_dataset)} 个；"
+                f"验证集 {len(val_dataset)} 个")
+    return train_dataset, val_dataset
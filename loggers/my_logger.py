@@ -17,7 +17,8 @@ load_dotenv()  # 加载 .env 文件中的环境变量
 class SingletonMeta(type):
     """ A thread-safe implementation of Singleton """
     _instances = {}
-    _lock: threading.Lock = threading.Lock()
+    # 可重入：单例的构造函数中可以再获取其他单例
+    _lock: threading.RLock = threading.RLock()
 
     def __call__(cls, *args, **kwargs):
         with cls._lock:
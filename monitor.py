@@ -7,16 +7,18 @@ import functools
 import portalocker  
 
 from apscheduler.schedulers.background import BackgroundScheduler  
-from apscheduler.executors.pool import ProcessPoolExecutor  
+from apscheduler.executors.pool import ProcessPoolExecutor, ThreadPoolExecutor  
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore  
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR  
 
 # 导入您的函数  
 from utils.utils_data import download_history_data  
+from data.xt_data_download import publish_market_panel  
 from utils.utils_general import is_trading_day  
 from stop_loss.stop_loss_main import stop_loss_main as raw_stop_loss_main  
 from deep_learning.tsmixer import fit_tsmixer_model  
 from deep_learning.monitor_buy import conditionally_execute_trading  
+from deep_learning.model_server import ModelServer  
 from mini_xtclient.mini_xt import start_miniqmt  
 from trader.reporter import generate_trading_report  
 from loggers import logger  
@@ -102,8 +104,10 @@ def download_history_data_job():
         logger.info("今天不是交易日，跳过执行 download_history_data_job。")  
         return  
     logger.info("开始下载历史数据")  
-    download_history_data()  
-    logger.info("历史数据下载完成")  
+    summary = download_history_data(incrementally=True, retry_failed=True)  
+    logger.info(f"历史数据下载完成：{summary}")  
+    # 发布行情面板缓存，供训练、交易作业只读映射  
+    publish_market_panel()  
 
 @retry_on_failure()  
 def fit_tsmixer_model_job():  
@@ -123,6 +127,12 @@ def conditionally_execute_trading_job():
     conditionally_execute_trading()  
     logger.info("交易条件检查完成")  
 
+def warm_up_model_server_job():  
+    """交易前加载模型、标准化对象和特征状态"""  
+    if not is_trading_day():  
+        return  
+    ModelServer().warm_up()  
+
 @retry_on_failure()  
 def generate_trading_report_job():  
     if not is_trading_day():  
@@ -173,6 +183,18 @@ def add_jobs(scheduler):
         hour=14,  
         minute=58,  
         id='trade_condition',  
+        executor='model_server',  
+        replace_existing=True  
+    )  
+    # 预热预测服务，与交易作业在同一线程池中执行，共用常驻的模型  
+    scheduler.add_job(  
+        warm_up_model_server_job,  
+        'cron',  
+        day_of_week='mon-fri',  
+        hour=14,  
+        minute=40,  
+        id='warm_up_model_server',  
+        executor='model_server',  
         replace_existing=True  
     )  
 
@@ -248,7 +270,8 @@ if __name__ == '__main__':
         jobstores = {  
             'default': SQLAlchemyJobStore(url='sqlite:///assets/runtime/jobs.sqlite')  
         }  
-        executors = {'default': ProcessPoolExecutor(10)}  
+        # 交易作业在主进程的线程中执行，预测服务（ModelServer）常驻内存  
+        executors = {'default': ProcessPoolExecutor(10), 'model_server': ThreadPoolExecutor(1)}  
         job_defaults = {  
             'coalesce': False,  
             'max_instances': 1,  
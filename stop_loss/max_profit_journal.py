@@ -0,0 +1,178 @@
+"""
+止损程序最高收益率（max_profit）的追加式日志。
+
+原先每次创出新高都要重新查询持仓并把整个字典重新 pickle 到 max_profit.pkl。
+MaxProfitJournal 在行情回调中只把变更追加到内存缓冲区，后台线程每隔 flush_interval 秒把缓冲区一次写入日志文件并 fsync；
+日志行数超过 compact_lines 时，把当前字典原子写入快照（max_profit.pkl）并清空日志。
+启动时读取快照再重放日志，最后一行写了一半（进程崩溃）时忽略该行。
+"""
+import os
+import pickle
+import threading
+from typing import Dict, List, Optional
+
+from pathlib2 import Path
+# 自定义
+from config import config
+from loggers import logger
+
+SNAPSHOT_PATH = Path(__file__).parent.parent / 'assets/runtime/max_profit.pkl'
+JOURNAL_PATH = Path(__file__).parent.parent / 'assets/runtime/max_profit.journal'
+# 日志中表示删除的值
+REMOVED = '-'
+
+
+class MaxProfitJournal:
+    """
+    股票代码 -> 最高收益率 的字典，变更以 ``股票代码\\t值`` 的行追加到日志。
+
+    :param snapshot_path: 快照文件，默认 assets/runtime/max_profit.pkl
+    :param journal_path: 日志文件，默认 assets/runtime/max_profit.journal
+    :param flush_interval: 后台写盘间隔（秒），默认取 config.ini 的 [stop_loss] journal_flush_interval
+    :param compact_lines: 日志超过该行数时压缩为快照，默认取 config.ini 的 [stop_loss] journal_compact_lines
+    """
+
+    def __init__(self, snapshot_path=None, journal_path=None, flush_interval: Optional[float] = None,
+                 compact_lines: Optional[int] = None):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path is not None else SNAPSHOT_PATH
+        self.journal_path = Path(journal_path) if journal_path is not None else JOURNAL_PATH
+        if flush_interval is None:
+            flush_interval = config.getfloat('stop_loss', 'journal_flush_interval', fallback=1)
+        if compact_lines is None:
+            compact_lines = config.getint('stop_loss', 'journal_compact_lines', fallback=10000)
+        self.flush_interval = flush_interval
+        self.compact_lines = compact_lines
+        self.lock = threading.Lock()
+        # 写文件串行执行，与缓冲区的锁分开，写盘时不阻塞行情回调
+        self.io_lock = threading.Lock()
+        self.values: Dict[str, float] = {}
+        self.buffer: List[str] = []
+        self.journal_lines = 0
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def load(self) -> Dict[str, float]:
+        """
+        读取快照并重放日志
+
+        :return: 当前字典的副本
+        """
+        values = {}
+        try:
+            if self.snapshot_path.exists():
+                with open(self.snapshot_path, 'rb') as f:
+                    values = pickle.load(f)
+        except Exception as e:
+            logger.exception(f"加载 max_profit 快照时发生异常: {e}")
+
+        lines = 0
+        if self.journal_path.exists():
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+            # 崩溃时最后一行可能只写了一半：忽略并截掉，之后追加的行才能从新的一行开始
+            complete = data.rfind(b'\n') + 1
+            if complete < len(data):
+                logger.warning(f"忽略 max_profit 日志中不完整的最后一行：{data[complete:]!r}")
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(complete)
+            for line in data[:complete].decode('utf-8').splitlines():
+                stock_code, value = line.split('\t')
+                if value == REMOVED:
+                    values.pop(stock_code, None)
+                else:
+                    values[stock_code] = float(value)
+                lines += 1
+
+        with self.lock:
+            self.values = values
+            self.buffer = []
+            self.journal_lines = lines
+        logger.debug(f"从 {self.snapshot_path} 和 {lines} 行日志加载 max_profit{values}")
+        return dict(values)
+
+    def set(self, stock_code: str, value: float):
+        """
+        记录最高收益率，只写入内存缓冲区
+        """
+        with self.lock:
+            self.values[stock_code] = value
+            self.buffer.append(f"{stock_code}\t{value!r}\n")
+
+    def remove(self, stock_code: str):
+        """
+        删除股票的最高收益率
+        """
+        with self.lock:
+            if self.values.pop(stock_code, None) is None:
+                return
+            self.buffer.append(f"{stock_code}\t{REMOVED}\n")
+
+    def flush(self):
+        """
+        把缓冲区一次写入日志并 fsync，日志过长时压缩
+        """
+        with self.io_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, []
+            if buffer:
+                self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(buffer))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.journal_lines += len(buffer)
+            if self.journal_lines > self.compact_lines:
+                self._compact()
+
+    def compact(self):
+        """
+        写盘后把当前字典写入快照并清空日志
+        """
+        self.flush()
+        with self.io_lock:
+            self._compact()
+
+    def _compact(self):
+        # 调用方持有 io_lock。快照可能已包含缓冲区中的变更，之后写入日志的同一变更重放时结果不变
+        with self.lock:
+            values = dict(self.values)
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(values, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # 快照落盘后再清空日志；两步之间崩溃时重放日志的结果相同
+        with open(self.journal_path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_lines = 0
+        logger.debug(f"已压缩 max_profit 日志至 {self.snapshot_path}")
+
+    def start(self):
+        """
+        启动后台写盘线程
+        """
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.exception(f"写入 max_profit 日志时发生异常: {e}")
+
+        self._flusher = threading.Thread(target=run, name='max_profit_journal', daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """
+        停止后台线程并写盘
+        """
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
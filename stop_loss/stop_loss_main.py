@@ -4,7 +4,10 @@ import threading
 from multiprocessing import Manager
 from pathlib import Path
 from datetime import datetime
-from trader import xt_trader, acc, setup_xt_trader
+from trader import acc, get_xt_trader
+from trader.order_gateway import OrderGateway, OrderRequest
+from trader.portfolio_state import PortfolioState
+from stop_loss.max_profit_journal import MaxProfitJournal
 from xtquant import xtconstant, xtdata
 from loggers import logger
 from utils.utils_data import get_targets_list_from_csv
@@ -13,7 +16,6 @@ from utils.utils_general import is_trading_day, is_transaction_hour
 
 # 配置文件路径
 CONFIG_PATH = Path(__file__).parent.parent / 'config/thresholds.pkl'
-MAX_PROFIT_PATH = Path(__file__).parent.parent / 'assets/runtime/max_profit.pkl'
 
 # 锁对象，确保线程安全
 max_profit_lock = threading.Lock()
@@ -22,8 +24,13 @@ class StopLossProgram:
     def __init__(self):
         self.max_profit = {}
         self.positions = {}
+        # 持仓和委托由交易推送维护，行情回调中不再查询
+        self.portfolio = PortfolioState()
         self.load_config()
+        # 最高收益率的变更追加到日志，由后台线程批量写盘
+        self.journal = MaxProfitJournal()
         self.load_max_profit()
+        self.journal.start()
         self.positions_lock = threading.Lock()
 
     def load_config(self):
@@ -53,7 +60,7 @@ class StopLossProgram:
 
     def save_max_profit(self):
         """
-        保存 max_profit 字典到文件，并在持仓变动时重置对应股票的最高收益率。
+        重置已卖出股票的最高收益率，并把 max_profit 日志写盘。
         """
         with max_profit_lock:
             try:
@@ -64,43 +71,31 @@ class StopLossProgram:
                 removed_stocks = set(self.max_profit.keys()) - set(self.positions.keys())
                 for stock_code in removed_stocks:
                     self.max_profit.pop(stock_code, None)
+                    self.journal.remove(stock_code)
                     logger.info(f"重置 {stock_code} 的最高收益率")
 
-                # 保存更新后的 max_profit 字典到文件
-                with open(MAX_PROFIT_PATH, 'wb') as f:
-                    pickle.dump(self.max_profit, f)
-                logger.debug(f"已保存 max_profit 至 {MAX_PROFIT_PATH}")
+                self.journal.flush()
+                logger.debug(f"已保存 max_profit 至 {self.journal.journal_path}")
             except Exception as e:
                 logger.exception(f"保存 max_profit 时发生异常: {e}")
 
     def load_max_profit(self):
         """
-        从文件加载 max_profit 字典
+        读取 max_profit 快照并重放日志，进程崩溃前已写盘的变更都会恢复
         """
         with max_profit_lock:
             try:
-                if MAX_PROFIT_PATH.exists():
-                    with open(MAX_PROFIT_PATH, 'rb') as f:
-                        self.max_profit = pickle.load(f)
-                    logger.debug(f"从 {MAX_PROFIT_PATH} 成功加载 max_profit{self.max_profit}")
-                else:
-                    self.max_profit = {}
-                    logger.warning(f"未找到 max_profit 文件 {MAX_PROFIT_PATH}，将使用空字典")
+                self.max_profit = self.journal.load()
             except Exception as e:
                 logger.exception(f"加载 max_profit 时发生异常: {e}")
                 self.max_profit = {}
 
     def update_positions(self):
         """
-        更新持仓信息，只保留可用数量大于0的持仓。
+        从内存持仓簿更新持仓信息，只保留可用数量大于0且没有在途卖出委托的持仓。
         """
         with self.positions_lock:
-            try:
-                positions = xt_trader.query_stock_positions(acc)
-                self.positions = {pos.stock_code: pos for pos in positions if pos.can_use_volume > 0}
-                logger.info(f"已更新持仓信息: {[pos.stock_code for pos in self.positions.values()]}")
-            except Exception as e:
-                logger.exception(f"更新持仓信息时发生异常: {e}")
+            self.positions = self.portfolio.sellable_positions()
 
     def sell_stock(self, stock_code, quantity, price=0, strategy_name='', order_remark=''):
         """
@@ -108,16 +103,28 @@ class StopLossProgram:
         """
         try:
             order_type = self.get_order_type(stock_code)
-            response = xt_trader.order_stock_async(
-                acc, stock_code, xtconstant.STOCK_SELL, quantity,
+            future = OrderGateway().submit(OrderRequest(
+                stock_code, xtconstant.STOCK_SELL, quantity,
                 order_type, price, strategy_name, order_remark
-            )
-            logger.info(f'卖出股票【{stock_code}】，数量【{quantity}】，返回值为【{response}】')
+            ))
+            logger.info(f'卖出股票【{stock_code}】，数量【{quantity}】，seq 为【{future.seq}】')
+            # 发出失败的委托不标记在途，下一笔行情仍会重试止损
+            if not future.done() or future.exception() is None:
+                self.portfolio.mark_selling(stock_code)
+            # 行情回调中不等待回报，回报到达后记录委托编号；被拒绝时恢复可卖
+            future.add_done_callback(self.log_sell_response)
             # 更新持仓信息
             self.update_positions()
         except Exception as e:
             logger.exception(f"卖出股票时发生异常: {e}")
 
+    def log_sell_response(self, future):
+        if future.exception() is not None:
+            logger.error(f"卖出委托失败：{future.exception()}")
+            self.portfolio.unmark_selling(future.request.stock_code)
+        else:
+            logger.info(f"卖出委托 {future.request.stock_code} 已报，委托编号【{future.result().order_id}】")
+
     @staticmethod
     def get_order_type(stock_code):
         """
@@ -158,7 +165,8 @@ class StopLossProgram:
                 # logger.info(f"{current_profit} + {max_profit_value}")
                 if current_profit >= max_profit_value:
                     self.max_profit[stock_code] = current_profit
-                    self.save_max_profit()
+                    # 只写入日志缓冲区，由后台线程写盘
+                    self.journal.set(stock_code, current_profit)
                     logger.info(f"更新 {stock_code} 的最高收益率为 {self.max_profit[stock_code]:.2%}")
                 # 当当前收益率超过止盈阈值后，开始监控回撤
                 if self.max_profit[stock_code] >= self.profit_threshold:
@@ -186,20 +194,18 @@ class StopLossProgram:
             logger.info("当前不在交易时间内。")
             return
 
+        # 有成交推送或超过校正间隔时，用查询结果校正内存中的持仓和委托
+        self.portfolio.reconcile_if_due()
+
         current_time = time.time()
         if current_time - last_update_time.value >= 600:
             logger.info("开始更新持仓信息和订单状态")
             try:
-                self.load_max_profit()
-                self.update_positions()
-                logger.info(f"已更新持仓信息: {[pos.stock_code for pos in self.positions.values()]}")
-
                 # 撤销未完全成交的挂单
-                pending_orders = xt_trader.query_stock_orders(acc)
-                for order in pending_orders:
-                    if order.order_status == xtconstant.ORDER_PART_SUCC:
-                        cancel_response = xt_trader.cancel_order_stock_async(acc, order.order_id)
-                        logger.info(f"撤销订单 {order.order_id}，响应: {cancel_response}")
+                xt_trader = get_xt_trader()
+                for order in self.portfolio.orders_with_status(xtconstant.ORDER_PART_SUCC):
+                    cancel_response = xt_trader.cancel_order_stock_async(acc, order.order_id)
+                    logger.info(f"撤销订单 {order.order_id}，响应: {cancel_response}")
 
                 self.save_max_profit()
             except Exception as e:
@@ -207,6 +213,7 @@ class StopLossProgram:
             finally:
                 last_update_time.value = time.time()
 
+        self.update_positions()
         self.stop_loss_max_profit(data)
 
     def start(self):
@@ -215,7 +222,9 @@ class StopLossProgram:
             return
 
         try:
+            self.portfolio.reconcile()
             self.update_positions()
+            logger.info(f"已更新持仓信息: {list(self.positions)}")
             manager = Manager()
             last_update_time = manager.Value('d', time.time())
 
@@ -229,12 +238,8 @@ class StopLossProgram:
             logger.info("止损程序启动")
             xtdata.run()
 
-            connect_result = xt_trader.connect()
-            logger.info(f'建立交易连接，返回值：{connect_result}')
-            subscribe_result = xt_trader.subscribe(acc)
-            logger.info(f'对交易回调进行订阅，返回值：{subscribe_result}')
-
-            xt_trader.run_forever()
+            # 交易连接由 TraderSession 建立并订阅，断开后下一次使用时自动重连
+            get_xt_trader().run_forever()
         except Exception as e:
             logger.exception(f"止损主程序运行时发生异常: {e}")
 
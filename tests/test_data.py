@@ -26,10 +26,10 @@ def test_fetch_and_clean_data():
 
 
 def test_get_positions():
-    from trader import xt_trader, acc, setup_xt_trader
+    from trader import acc, get_xt_trader
     from utils.utils_data import get_targets_list_from_csv
 
-    positions = xt_trader.query_stock_positions(acc)
+    positions = get_xt_trader().query_stock_positions(acc)
     # print([pos.incomeRate for pos in positions])
     print(dir(positions[0]))
     targets = get_targets_list_from_csv()
@@ -38,3 +38,423 @@ def test_get_positions():
     for pos in positions:
         if pos.stock_code in targets:
             print(pos.stock_code, pos.can_use_volume)
+
+
+def test_bar_store_append_and_read(tmp_path):
+    import pandas as pd
+    from data.bar_store import BarStore
+
+    store = BarStore(tmp_path)
+    index = ['20231228', '20231229', '20240102', '20240103']
+    df = pd.DataFrame(
+        {'open': [1.0, 2.0, 3.0, 4.0], 'close': [1.5, 2.5, 3.5, 4.5], 'stock_code': '000001.SZ'},
+        index=pd.Index(index, name='date'),
+    )
+    assert store.append(df, period='1d') == 2
+    assert store.partitions('1d', '000001.SZ') == ['2023', '2024']
+
+    # 追加新K线并覆盖已有的同日K线，只重写受影响的分区
+    update = pd.DataFrame(
+        {'open': [4.1, 5.0], 'close': [4.6, 5.5], 'stock_code': '000001.SZ'},
+        index=pd.Index(['20240103', '20240104'], name='date'),
+    )
+    assert store.append(update, period='1d') == 1
+    assert store.latest_date('1d', '000001.SZ') == '20240104'
+
+    result = store.read('1d', start_time='20240101', columns=['close'])
+    assert list(result.index) == ['20240102', '20240103', '20240104']
+    assert list(result.columns) == ['close', 'stock_code']
+    assert result.loc['20240103', 'close'] == 4.6
+
+
+def test_download_engine_retries_and_summary():
+    from utils.download_engine import DownloadEngine
+
+    calls = {}
+
+    def task(stock):
+        calls[stock] = calls.get(stock, 0) + 1
+        if stock == 'bad.SZ':
+            raise RuntimeError('服务器无响应')
+        if stock == 'flaky.SZ' and calls[stock] < 2:
+            raise RuntimeError('连接超时')
+
+    engine = DownloadEngine(max_workers=2, timeout=5, max_retries=3, backoff_base=0.01)
+    summary = engine.run(['000001.SZ', 'flaky.SZ', 'bad.SZ'], task)
+    assert sorted(summary.succeeded) == ['000001.SZ', 'flaky.SZ']
+    assert list(summary.failed) == ['bad.SZ']
+    assert calls['bad.SZ'] == 3
+
+    retried = engine.retry(summary)
+    assert list(retried.failed) == ['bad.SZ']
+
+
+def test_download_history_data_saves_watermark_after_retry(tmp_path, monkeypatch):
+    import json
+    from utils import download_watermark, utils_data
+    from utils.download_engine import DownloadEngine
+
+    monkeypatch.setattr(download_watermark, 'WATERMARK_PATH', tmp_path / 'download_watermark.json')
+    monkeypatch.setattr(download_watermark.xtdata, 'get_divid_factors', lambda *args, **kwargs: None, raising=False)
+    calls = {}
+
+    def download(stock, *args, **kwargs):
+        calls[stock] = calls.get(stock, 0) + 1
+        # 第一轮的全部尝试都失败，统一重试时成功
+        if stock == 'flaky.SZ' and calls[stock] <= 2:
+            raise RuntimeError('连接超时')
+
+    monkeypatch.setattr(utils_data.xtdata, 'download_history_data', download, raising=False)
+    engine = DownloadEngine(max_workers=2, timeout=5, max_retries=2, backoff_base=0.01)
+    summary = utils_data.download_history_data(['000001.SZ', 'flaky.SZ'], end_time='20240104150000',
+                                               incrementally=True, engine=engine, retry_failed=True)
+    assert summary.ok and calls['flaky.SZ'] == 3
+    with open(tmp_path / 'download_watermark.json', encoding='utf-8') as f:
+        assert set(json.load(f)['1d']) == {'000001.SZ', 'flaky.SZ'}
+
+
+def test_market_panel_from_local_data():
+    import numpy as np
+    import pandas as pd
+    from data.panel import MarketPanel
+
+    market_data = {
+        '000002.SZ': pd.DataFrame({'time': [1, 2, 3], 'close': [1.0, np.nan, 3.0], 'open': [1.0, 2.0, 3.0]},
+                                  index=['20240102', '20240103', '20240104']),
+        '000001.SZ': pd.DataFrame({'time': [2, 3], 'close': [5.0, 6.0], 'open': [4.0, 5.0]},
+                                  index=['20240103', '20240104']),
+    }
+    panel = MarketPanel.from_local_data(market_data)
+    assert panel.values.dtype == np.float32
+    assert panel.values.shape == (2, 2, 3)
+    assert list(panel.fields) == ['close', 'open']
+    assert list(panel.codes) == ['000001.SZ', '000002.SZ']
+
+    panel.fill()
+    np.testing.assert_array_equal(panel.field('close'), [[5, 5, 6], [1, 1, 3]])
+
+    # 宽表和长表都是面板的视图
+    wide = panel.wide('close')
+    assert np.shares_memory(wide.to_numpy(), panel.values)
+    assert list(wide.columns) == ['000001.SZ', '000002.SZ']
+    long = panel.long()
+    assert np.shares_memory(long.to_numpy(), panel.values)
+    assert long.loc[('000002.SZ', '20240104'), 'open'] == 3.0
+
+    past_cov = panel.wide_fields(['open', 'close'])
+    assert list(past_cov.columns) == ['open_000001.SZ', 'open_000002.SZ', 'close_000001.SZ', 'close_000002.SZ']
+
+
+def test_panel_cache_publish_and_open(tmp_path):
+    import numpy as np
+    from data.panel import MarketPanel
+    from data.panel_cache import PanelCache
+
+    values = np.arange(12, dtype=np.float32).reshape(2, 2, 3)
+    panel = MarketPanel(values, ['open', 'close'], ['000001.SZ', '000002.SZ'], ['20240102', '20240103', '20240104'])
+    cache = PanelCache(tmp_path, keep_versions=1)
+    assert cache.open() is None
+
+    cache.publish(panel)
+    opened = cache.open()
+    assert isinstance(opened.values, np.memmap)
+    assert not opened.values.flags.writeable
+    np.testing.assert_array_equal(opened.field('close'), values[1])
+    assert list(opened.index) == ['20240102', '20240103', '20240104']
+    assert cache.age() < 60
+
+
+def test_vectorized_features_match_groupby_apply():
+    import numpy as np
+    import pandas as pd
+    import data.xt_data_download  # noqa: F401 先导入，避免 data.utils 的循环导入
+    from data.utils import add_features, add_features_vectorized, fill_and_sequence_groups
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for code, length in [('000002.SZ', 120), ('000001.SZ', 70), ('510300.SH', 8)]:
+        close = np.cumsum(rng.normal(0, 1, length)) + 50
+        frames.append(pd.DataFrame({
+            'stock_code': code,
+            'time': np.arange(length),
+            'open': close + rng.normal(0, 0.5, length),
+            'high': close + 1,
+            'low': close - 1,
+            'close': close,
+            'amount': rng.uniform(1, 1e6, length),
+            'overnight_return': rng.integers(0, 2, length),
+        }))
+    data = fill_and_sequence_groups(pd.concat(frames, ignore_index=True))
+
+    expected = data.groupby('stock_code').apply(add_features, include_groups=False)
+    result = add_features_vectorized(data)
+    # 涨幅和 RSI 按 FeatureSpec 声明的 float32 输出
+    assert result['rsi_14'].dtype == np.float32 and result['ma_7'].dtype == np.float64
+    pd.testing.assert_frame_equal(result, expected.astype(result.dtypes), check_exact=False, rtol=1e-10)
+
+
+def test_incremental_features_match_full_recompute(tmp_path):
+    import numpy as np
+    from data.features import compute_features
+    from data.feature_state import IncrementalFeatureCalculator
+
+    rng = np.random.default_rng(0)
+    length, stocks = 150, 4
+    close = np.cumsum(rng.normal(0, 1, (length, stocks)), axis=0) + 50
+    inputs = {
+        'open': close + rng.normal(0, 0.5, (length, stocks)),
+        'high': close + 1,
+        'low': close - 1,
+        'close': close,
+        'amount': rng.uniform(1, 1e6, (length, stocks)),
+        'overnight_return': rng.normal(0, 0.01, (length, stocks)),
+    }
+    dates = np.array([f'{20230000 + i}' for i in range(length)])
+    codes = ['000001.SZ', '000002.SZ', '600000.SH', '510300.SH']
+    path = tmp_path / 'state.npz'
+
+    # 盘中的未完成K线，之后被收盘数据替换
+    intraday = {col: values[:101].copy() for col, values in inputs.items()}
+    intraday['close'][-1] += 1
+    IncrementalFeatureCalculator.for_add_features(path=path, tail_length=30).update(intraday, dates[:101], codes)
+
+    for end in [101, 102, 150]:
+        calculator = IncrementalFeatureCalculator.for_add_features(path=path, tail_length=30)
+        window = {col: values[:end] for col, values in inputs.items()}
+        feature_dates, features = calculator.update(window, dates[:end], codes)
+        expected = compute_features(window)
+        assert list(feature_dates) == list(dates[end - 30:end])
+        for name, values in expected.items():
+            np.testing.assert_allclose(features[name], values[-30:], rtol=1e-10)
+
+
+def test_feature_registry_computes_requested_features_only():
+    import numpy as np
+    from data.features import ADD_FEATURES, FEATURES, compute, dependencies, input_columns, required_window
+
+    assert [spec.name for spec in dependencies(['rsi_14'])] == ['delta', 'gain_10', 'loss_10', 'rsi_14']
+    assert input_columns(['ma_7', 'ema_3']) == ['close', 'overnight_return']
+    assert required_window(['rsi_14']) == 11
+    assert required_window(ADD_FEATURES) == 61
+    assert all(FEATURES[name].public for name in ADD_FEATURES)
+
+    rng = np.random.default_rng(0)
+    close = np.cumsum(rng.normal(0, 1, (80, 3)), axis=0) + 50
+    inputs = {'close': close, 'high': close + 1, 'low': close - 1, 'open': close, 'amount': close,
+              'overnight_return': close}
+    subset = compute({'close': close}, ['rsi_14', 'ma_7'])
+    full = compute(inputs, ADD_FEATURES)
+    assert list(subset) == ['rsi_14', 'ma_7']
+    for name, values in subset.items():
+        np.testing.assert_array_equal(values, full[name])
+
+
+def test_feature_cache_recomputes_changed_stocks_only(tmp_path):
+    import numpy as np
+    import pandas as pd
+    import data.xt_data_download  # noqa: F401 先导入，避免 data.utils 的循环导入
+    from data.feature_cache import FeatureCache
+    from data.utils import add_features_vectorized, fill_and_sequence_groups
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for code, length in [('000001.SZ', 90), ('000002.SZ', 70), ('600000.SH', 30)]:
+        close = np.cumsum(rng.normal(0, 1, length)) + 50
+        frames.append(pd.DataFrame({
+            'stock_code': code, 'time': np.arange(length), 'open': close, 'high': close + 1, 'low': close - 1,
+            'close': close, 'amount': rng.uniform(1, 1e6, length), 'overnight_return': rng.integers(0, 2, length),
+        }))
+    data = fill_and_sequence_groups(pd.concat(frames, ignore_index=True))
+    cache = FeatureCache(tmp_path)
+    add_features_vectorized(data, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    data.loc['000002.SZ', 'close'] = data.loc['000002.SZ', 'close'].to_numpy() + 1
+    cache = FeatureCache(tmp_path)
+    result = add_features_vectorized(data, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 1)
+    pd.testing.assert_frame_equal(result, add_features_vectorized(data))
+
+    cache = FeatureCache(tmp_path, max_size_mb=0)
+    assert cache.evict() == 4
+
+
+def test_feature_cache_recomputes_current_partition_only(tmp_path):
+    import numpy as np
+    import pandas as pd
+    import data.xt_data_download  # noqa: F401 先导入，避免 data.utils 的循环导入
+    from data.feature_cache import FeatureCache
+    from data.utils import add_features_vectorized, fill_and_sequence_groups
+
+    rng = np.random.default_rng(1)
+    dates = pd.bdate_range('2023-09-01', '2024-03-29').strftime('%Y%m%d')
+
+    def bars(length):
+        frames = []
+        for code in ['000001.SZ', '600000.SH']:
+            close = np.cumsum(rng.normal(0, 1, len(dates))) + 50
+            frames.append(pd.DataFrame({
+                'stock_code': code, 'time': np.arange(length), 'date': dates[:length], 'open': close[:length],
+                'high': close[:length] + 1, 'low': close[:length] - 1, 'close': close[:length],
+                'amount': rng.uniform(1, 1e6, len(dates))[:length],
+                'overnight_return': rng.integers(0, 2, len(dates))[:length],
+            }))
+        return fill_and_sequence_groups(pd.concat(frames, ignore_index=True))
+
+    data = bars(len(dates))
+    add_features_vectorized(data.drop(index=len(dates) - 1, level=1), cache=FeatureCache(tmp_path))
+
+    # 追加一根K线：2023 年的分区命中，只重新计算 2024 年的分区
+    cache = FeatureCache(tmp_path)
+    result = add_features_vectorized(data, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 2)
+    expected = add_features_vectorized(data)
+    pd.testing.assert_frame_equal(result, expected, rtol=1e-12)
+
+
+def test_float32_clean_data_matches_float64():
+    import numpy as np
+    import pandas as pd
+    import data.xt_data_download  # noqa: F401 先导入，避免 data.utils 的循环导入
+    from data.utils import clean_data
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for code, length in [('000001.SZ', 120), ('000002.SZ', 80)]:
+        close = np.cumsum(rng.normal(0, 0.5, length)) + 30
+        frames.append(pd.DataFrame({
+            'time': np.arange(length) * 86400000 + 1704067200000, 'open': close + rng.normal(0, 0.2, length),
+            'high': close + 0.5, 'low': close - 0.5, 'close': close, 'volume': rng.integers(1, 10000, length),
+            'amount': rng.uniform(1e5, 1e7, length), 'preClose': np.r_[close[0], close[:-1]], 'stock_code': code,
+        }, index=pd.Index([f'{20240000 + i}' for i in range(length)], name='date')))
+    data = pd.concat(frames)
+
+    expected = clean_data(data.copy(), use_cache=False, dtype=np.float64)
+    result = clean_data(data.copy(), use_cache=False, dtype=np.float32)
+    values = [col for col in expected.columns if expected[col].dtype.kind == 'f']
+    assert len(values) > 40
+    assert all(result[col].dtype == np.float32 for col in values)
+    assert result['time'].dtype == expected['time'].dtype
+    np.testing.assert_allclose(result[values].to_numpy(np.float64), expected[values].to_numpy(), rtol=1e-4, atol=1e-4)
+
+
+def test_fast_group_dataframe_matches_per_group_series():
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from data.mytimeseries import MyTimeSeries
+
+    rng = np.random.default_rng(0)
+    codes = ['000002.SZ', '000001.SZ', '600000.SH']
+    df = pd.DataFrame({
+        'stock_code': np.repeat(codes, 50),
+        'time': np.tile(np.arange(50), 3),
+        'static_cov': np.repeat([0.5, 0.1, 0.9], 50),
+        'open': rng.random(150).astype(np.float32),
+        'close': rng.random(150).astype(np.float32),
+    }).sample(frac=1, random_state=0)
+
+    series = MyTimeSeries.from_group_dataframe(
+        df=df, group_cols=['stock_code'], time_col='time', value_cols=['open', 'close'],
+        static_cols=['static_cov'], freq=1, drop_group_cols=['stock_code'],
+    )
+    assert len(series) == 3
+    for ts, (code, group) in zip(series, df.groupby('stock_code')):
+        expected = TimeSeries.from_dataframe(group.set_index('time').sort_index()[['open', 'close']])
+        assert ts.time_index.equals(expected.time_index)
+        np.testing.assert_array_equal(ts.values(), expected.values())
+        # darts 将数值型静态协变量转为序列的 dtype
+        assert ts.static_covariates['static_cov'].iloc[0] == np.float32(group['static_cov'].iloc[0])
+
+    df.iloc[0, df.columns.get_loc('static_cov')] = 0.3
+    try:
+        MyTimeSeries.from_group_dataframe(df=df, group_cols='stock_code', time_col='time', value_cols='open',
+                                          static_cols='static_cov')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("静态列不唯一时应抛出 ValueError")
+
+
+def test_group_dataframe_n_jobs_matches_serial():
+    import numpy as np
+    import pandas as pd
+    from data.mytimeseries import MyTimeSeries
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'stock_code': np.repeat([f'{i:06d}.SZ' for i in range(20)], 30),
+        'time': np.tile(np.arange(30), 20),
+        'static_cov': np.repeat(rng.random(20), 30),
+        'close': rng.random(600).astype(np.float32),
+    })
+    kwargs = dict(df=df, group_cols=['stock_code'], time_col='time', value_cols=['close'],
+                  static_cols=['static_cov'], freq=1, drop_group_cols=['stock_code'])
+    serial = MyTimeSeries.from_group_dataframe(**kwargs)
+    # 快速实现始终单进程构建，n_jobs 不影响结果
+    other = MyTimeSeries.from_group_dataframe(n_jobs=2, **kwargs)
+    assert len(other) == len(serial) == 20
+    for a, b in zip(other, serial):
+        assert a.time_index.equals(b.time_index)
+        np.testing.assert_array_equal(a.values(), b.values())
+        assert a.static_covariates.equals(b.static_covariates)
+
+
+def test_series_bundle_round_trip_and_dedup(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from data.series_bundle import load_series_bundle, save_series_bundle
+
+    rng = np.random.default_rng(0)
+    targets = [
+        TimeSeries.from_times_and_values(
+            pd.RangeIndex(start, start + 40), rng.random((40, 1)).astype(np.float32), columns=['overnight_return'],
+            static_covariates=pd.DataFrame({'static_cov': [float(i)]}),
+        )
+        for i, start in enumerate([0, 5, 10])
+    ]
+    future = TimeSeries.from_times_and_values(pd.date_range('2024-01-01', periods=60, freq='D'),
+                                              rng.random((60, 2)).astype(np.float32), columns=['a', 'b'])
+    save_series_bundle(tmp_path, {'train': targets, 'future_cov': [future] * 3})
+    assert np.load(tmp_path / 'future_cov.npy').shape == (60, 2)
+
+    bundle = load_series_bundle(tmp_path)
+    assert len(bundle['train']) == 3 and len(bundle['future_cov']) == 3
+    assert bundle['future_cov'][0] is bundle['future_cov'][2]
+    for loaded, original in zip(bundle['train'], targets):
+        assert loaded.time_index.equals(original.time_index)
+        np.testing.assert_array_equal(loaded.values(), original.values())
+        assert loaded.static_covariates['static_cov'].iloc[0] == original.static_covariates['static_cov'].iloc[0]
+    assert bundle['future_cov'][1].time_index.equals(future.time_index)
+
+
+def test_batch_scaler_matches_darts_scaler(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from darts.dataprocessing.transformers import Scaler
+    from data.batch_scaler import BatchScaler
+
+    rng = np.random.default_rng(0)
+    series = []
+    for length in [30, 45, 60]:
+        values = rng.normal(0, 10, (length, 3)).astype(np.float32)
+        values[:, 2] = 5  # 取值范围为 0 的分量
+        series.append(TimeSeries.from_times_and_values(pd.RangeIndex(length), values))
+
+    expected = Scaler().fit(series).transform(series)
+    scaler = BatchScaler().fit(series)
+    result = scaler.transform(series)
+    for a, b in zip(result, expected):
+        np.testing.assert_allclose(a.values(), b.values(), rtol=1e-5, atol=1e-6)
+
+    # 按序列分片拟合与一次拟合相同
+    sharded = BatchScaler().partial_fit(series[:2]).partial_fit(series[2:], offset=2)
+    np.testing.assert_array_equal(sharded.data_min_, scaler.data_min_)
+
+    scaler.save(tmp_path / 'scaler.npz')
+    loaded = BatchScaler.load(tmp_path / 'scaler.npz')
+    restored = loaded.inverse_transform(loaded.transform(series))
+    for a, b in zip(restored, series):
+        np.testing.assert_allclose(a.values(), b.values(), rtol=1e-5, atol=1e-5)
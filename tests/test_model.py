@@ -55,6 +55,197 @@ def test_fit_tsmixer_model():
     fit_tsmixer_model(test=True)
 
 
+def test_memmap_window_dataset_matches_series_slices(tmp_path):
+    import pickle
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from deep_learning.window_dataset import build_window_datasets
+
+    rng = np.random.default_rng(0)
+    target = TimeSeries.from_times_and_values(pd.RangeIndex(1, 101), rng.random((100, 4), dtype=np.float32))
+    past = TimeSeries.from_times_and_values(pd.RangeIndex(1, 101), rng.random((100, 6), dtype=np.float32))
+    future = TimeSeries.from_times_and_values(pd.RangeIndex(1, 121), rng.random((120, 3), dtype=np.float32))
+    icl, ocl = 15, 5
+
+    train_dataset, val_dataset = build_window_datasets(
+        target[:-20], target[-40:], past, future, icl, ocl, samples_per_epoch=10, root=tmp_path)
+    assert len(train_dataset.index) == 80 - icl - ocl + 1
+    assert len(train_dataset) == 10
+    assert len(val_dataset) == 40 - icl - ocl + 1
+
+    start = 10
+    sample = val_dataset[val_dataset.index.tolist().index(start)]
+    series = target[-40:]
+    p = past.get_index_at_point(series.time_index[start])
+    f = future.get_index_at_point(series.time_index[start])
+    np.testing.assert_array_equal(sample[0], series[start:start + icl].values())
+    np.testing.assert_array_equal(sample[1], past[p:p + icl].values())
+    np.testing.assert_array_equal(sample[2], future[f:f + icl].values())
+    np.testing.assert_array_equal(sample[3], future[f + icl:f + icl + ocl].values())
+    assert sample[4] is None and sample[5] is None
+    np.testing.assert_array_equal(sample[6], series[start + icl:start + icl + ocl].values())
+
+    # 传给子进程时只序列化目录，不复制数组
+    restored = pickle.loads(pickle.dumps(val_dataset))
+    assert not restored.store._arrays
+    np.testing.assert_array_equal(restored[0][0], val_dataset[0][0])
+
+
+def test_choose_training_mode(tmp_path, monkeypatch):
+    from datetime import datetime
+    import deep_learning.tsmixer as tsmixer
+
+    monkeypatch.setattr(tsmixer, 'MODEL_PATH', tmp_path / 'tsmixer_model.pth.pkl')
+    today = datetime(2024, 6, 12)
+    state = {'last_full_train': '20240610', 'baseline_val_loss': 0.1}
+    # 没有已保存的模型时全量训练
+    assert tsmixer.choose_training_mode(state, today) == 'full'
+    tsmixer.MODEL_PATH.touch()
+    assert tsmixer.choose_training_mode(state, today) == 'finetune'
+    assert tsmixer.choose_training_mode({}, today) == 'full'
+    assert tsmixer.choose_training_mode(state, datetime(2024, 6, 17)) == 'full'
+
+
+def test_model_server_hot_swap(tmp_path, monkeypatch):
+    import os
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from darts.models import TSMixerModel
+    from loggers.my_logger import SingletonMeta
+    from data.batch_scaler import BatchScaler
+    import deep_learning.model_server as model_server
+
+    series = TimeSeries.from_times_and_values(pd.RangeIndex(40), np.random.default_rng(0).random((40, 2)))
+    for name in ['scaler_train.npz', 'scaler_past.npz']:
+        BatchScaler().fit(series).save(tmp_path / name)
+    monkeypatch.setattr(model_server, 'SCALER_TRAIN_PATH', tmp_path / 'scaler_train.npz')
+    monkeypatch.setattr(model_server, 'SCALER_PAST_PATH', tmp_path / 'scaler_past.npz')
+    model_path = str(tmp_path / 'tsmixer_model.pth.pkl')
+
+    def save_model():
+        model = TSMixerModel(input_chunk_length=5, output_chunk_length=2, n_epochs=1,
+                             pl_trainer_kwargs={'accelerator': 'cpu', 'enable_progress_bar': False})
+        model.fit(series, verbose=False)
+        model.save(model_path)
+
+    SingletonMeta._instances.pop(model_server.ModelServer, None)
+    server = model_server.ModelServer(model_path)
+    assert model_server.ModelServer() is server
+    assert not server.reload_if_changed()  # 还没有模型文件
+
+    save_model()
+    assert server.reload_if_changed()
+    first = server._model
+    assert not server.reload_if_changed()
+
+    save_model()
+    # 两次保存可能落在同一个时间戳内，并且文件大小相同
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert server.reload_if_changed()
+    assert server._model is not first
+    SingletonMeta._instances.pop(model_server.ModelServer, None)
+
+
+def test_fast_predictor_matches_model_predict(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from darts.models import TSMixerModel
+    from deep_learning.fast_inference import FastPredictor
+
+    rng = np.random.default_rng(0)
+    target = TimeSeries.from_times_and_values(pd.RangeIndex(60), rng.random((60, 3), dtype=np.float32))
+    past = TimeSeries.from_times_and_values(pd.RangeIndex(60), rng.random((60, 4), dtype=np.float32))
+    future = TimeSeries.from_times_and_values(pd.RangeIndex(70), rng.random((70, 2), dtype=np.float32))
+    model = TSMixerModel(input_chunk_length=8, output_chunk_length=4, n_epochs=1,
+                         use_reversible_instance_norm=True,
+                         pl_trainer_kwargs={'accelerator': 'cpu', 'enable_progress_bar': False})
+    model.fit(target, past_covariates=past, future_covariates=future, verbose=False)
+
+    series = [target[:40], target]
+    expected = model.predict(n=3, series=series, past_covariates=[past] * 2, future_covariates=[future] * 2,
+                             verbose=False)
+    FastPredictor.from_model(model).save(tmp_path / 'tsmixer_model.ts')
+    for predictor in [FastPredictor.from_model(model, script=False), FastPredictor.load(tmp_path / 'tsmixer_model.ts')]:
+        result = predictor.predict(3, series, [past] * 2, [future] * 2)
+        for a, b in zip(result, expected):
+            assert a.time_index.equals(b.time_index)
+            np.testing.assert_allclose(a.values(), b.values(), rtol=1e-5, atol=1e-6)
+
+
+def test_export_quantized_checks_accuracy(tmp_path):
+    import json
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from darts.models import TSMixerModel
+    from deep_learning.fast_inference import FastPredictor, export_quantized, held_out_test_dataset
+    from deep_learning.window_dataset import build_window_datasets
+
+    rng = np.random.default_rng(0)
+    target = TimeSeries.from_times_and_values(pd.RangeIndex(120), rng.random((120, 8), dtype=np.float32))
+    past = TimeSeries.from_times_and_values(pd.RangeIndex(120), rng.random((120, 16), dtype=np.float32))
+    future = TimeSeries.from_times_and_values(pd.RangeIndex(130), rng.random((130, 2), dtype=np.float32))
+    model = TSMixerModel(input_chunk_length=10, output_chunk_length=5, n_epochs=1,
+                         pl_trainer_kwargs={'accelerator': 'cpu', 'enable_progress_bar': False})
+    model.fit(target, past_covariates=past, future_covariates=future, verbose=False)
+    _, val_dataset = build_window_datasets(target[:-30], target[-40:], past, future, 10, 5, root=tmp_path / 'windows')
+
+    path = tmp_path / 'tsmixer_model.int8.ts'
+    report = export_quantized(model, val_dataset, path, max_rel_error=1.0)
+    assert report['passed'] and path.exists()
+    assert report['max_abs_diff'] > 0
+    result = FastPredictor.load(path).predict(3, target, past, future)
+    expected = model.predict(n=3, series=target, past_covariates=past, future_covariates=future, verbose=False)
+    np.testing.assert_allclose(result.values(), expected.values(), atol=report['max_abs_diff'] * 2)
+
+    # 留出的 test 序列与模型同宽，协变量截取到 test 的时间范围
+    test_dataset = held_out_test_dataset(target[-25:], past, future, 10, 5)
+    assert len(test_dataset) == 11
+    assert export_quantized(model, test_dataset, path, max_rel_error=1.0)['passed']
+
+    # 超过误差阈值时删除旧的量化文件
+    report = export_quantized(model, val_dataset, path, max_rel_error=-1.0)
+    assert not report['passed'] and not path.exists()
+    with open(f'{path}.json', encoding='utf-8') as f:
+        assert json.load(f)['passed'] is False
+
+
+def test_time_budget_callback_stops_training():
+    import numpy as np
+    import pandas as pd
+    from darts import TimeSeries
+    from darts.models import TSMixerModel
+    from deep_learning.model_config import TimeBudgetCallback
+
+    rng = np.random.default_rng(0)
+    target = TimeSeries.from_times_and_values(pd.RangeIndex(80), rng.random((80, 3), dtype=np.float32))
+    budget = TimeBudgetCallback(time_budget=1e-3)
+    model = TSMixerModel(input_chunk_length=8, output_chunk_length=4, n_epochs=50,
+                         pl_trainer_kwargs={'accelerator': 'cpu', 'enable_progress_bar': False,
+                                            'callbacks': [budget]})
+    model.fit(target[:60], val_series=target[40:], verbose=False)
+    # 时间预算远小于一个 epoch，第一个 epoch 结束后即停止
+    assert model.epochs_trained == 1
+    assert budget.epoch_samples > 0
+
+
+def test_time_budget_callback_keeps_deadline_for_scheduled_runs():
+    import pytest
+    from deep_learning.model_config import TimeBudgetCallback
+
+    # 例行训练晚于截止时刻时拒绝训练
+    with pytest.raises(RuntimeError):
+        TimeBudgetCallback(time_budget=900, deadline='00:00').on_train_start(None, None)
+    # 手动训练只受时间预算限制
+    manual = TimeBudgetCallback(time_budget=900, deadline='00:00', manual=True)
+    manual.on_train_start(None, None)
+    assert manual.stop_at is not None
+
+
 if __name__ == '__main__':
     os.getcwd()
-    pytest.main()
\ No newline at end of file
+    pytest.main()
@@ -18,4 +18,40 @@ def test_trade_with_monitor():
     from loggers import logger
     logger.trader("test_trade_with_monitor")
     import time
-    time.sleep(20)
\ No newline at end of file
+    time.sleep(20)
+
+
+
+def test_get_max_ask_prices_batches_quotes(monkeypatch):
+    from utils import instrument_cache, utils_data
+    from utils.instrument_cache import InstrumentCache
+
+    ticks = {
+        '000001.SZ': {'timetag': '', 'lastPrice': 10.0, 'askPrice': [10.02, 10.03, 0, 0, 0], 'bidPrice': [10.0] * 5},
+        '600000.SH': {'timetag': '', 'lastPrice': 11.0, 'askPrice': [0] * 5, 'bidPrice': [11.0] * 5},
+        '600001.SH': {'timetag': '', 'lastPrice': 5.5, 'askPrice': [5.5] * 5, 'bidPrice': [5.5] * 5},
+    }
+    details = {'000001.SZ': (11.0, 9.0), '600000.SH': (11.0, 9.0), '600001.SH': (6.05, 4.95)}
+    tick_calls, detail_calls = [], []
+
+    def get_full_tick(codes):
+        tick_calls.append(codes)
+        return {code: ticks[code] for code in codes if code in ticks}
+
+    def get_instrument_detail(code):
+        detail_calls.append(code)
+        up, down = details[code]
+        return {'UpStopPrice': up, 'DownStopPrice': down}
+
+    monkeypatch.setattr(utils_data.xtdata, 'get_full_tick', get_full_tick, raising=False)
+    monkeypatch.setattr(instrument_cache.xtdata, 'get_instrument_detail', get_instrument_detail, raising=False)
+    monkeypatch.setattr(InstrumentCache(), 'limits', {})
+
+    codes = ['000001.SZ', '600000.SH', '600001.SH', '000002.SZ']
+    prices = utils_data.get_max_ask_prices(codes)
+    assert prices == {'000001.SZ': 10.1, '600000.SH': 999999, '600001.SH': 5.56, '000002.SZ': None}
+    assert len(tick_calls) == 1
+
+    # 涨跌停价当天只查询一次
+    assert utils_data.get_max_ask_price('600001.SH') == 5.56
+    assert sorted(detail_calls) == ['000001.SZ', '600000.SH', '600001.SH']
@@ -12,3 +12,37 @@ def test_load_max_profit():
 
     print(program.max_profit)
 
+
+
+def test_max_profit_journal_replays_after_crash(tmp_path):
+    from stop_loss.max_profit_journal import MaxProfitJournal
+
+    def open_journal():
+        return MaxProfitJournal(tmp_path / 'max_profit.pkl', tmp_path / 'max_profit.journal',
+                                flush_interval=60, compact_lines=4)
+
+    journal = open_journal()
+    assert journal.load() == {}
+    journal.set('000001.SZ', 0.01)
+    journal.set('000001.SZ', 0.02)
+    journal.set('600000.SH', 0.03)
+    journal.flush()
+    # 未写盘的变更在崩溃时丢失
+    journal.set('600000.SH', 0.05)
+    assert open_journal().load() == {'000001.SZ': 0.02, '600000.SH': 0.03}
+
+    # 最后一行只写了一半时忽略，之后追加的行仍可重放
+    with open(tmp_path / 'max_profit.journal', 'a', encoding='utf-8') as f:
+        f.write('600000.SH\t0.0')
+    journal = open_journal()
+    assert journal.load() == {'000001.SZ': 0.02, '600000.SH': 0.03}
+    journal.remove('000001.SZ')
+    journal.flush()
+    assert open_journal().load() == {'600000.SH': 0.03}
+
+    # 超过 compact_lines 后压缩为快照并清空日志
+    journal.set('600000.SH', 0.04)
+    journal.set('000002.SZ', 0.01)
+    journal.flush()
+    assert (tmp_path / 'max_profit.journal').stat().st_size == 0
+    assert open_journal().load() == {'600000.SH': 0.04, '000002.SZ': 0.01}
@@ -0,0 +1,159 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeTrader:
+    """
+    代替 XtQuantTrader：记录调用，下单返回递增的 seq，持仓和委托查询返回预设的列表。
+    """
+
+    def __init__(self):
+        self.alive = True
+        self.stopped = False
+        self.seq = 0
+        self.queries = 0
+        self.positions = []
+        self.orders = []
+        self.on_order = None
+        self.reject_orders = False
+
+    def query_stock_asset(self, account):
+        return object() if self.alive else None
+
+    def stop(self):
+        self.stopped = True
+
+    def order_stock_async(self, account, stock_code, *args):
+        if self.reject_orders:
+            return -1
+        self.seq += 1
+        if self.on_order is not None:
+            self.on_order(self.seq, stock_code)
+        return self.seq
+
+    def query_stock_positions(self, account):
+        self.queries += 1
+        return self.positions
+
+    def query_stock_orders(self, account):
+        return self.orders
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """
+    每个测试独立的 TraderSession（不复用进程内的单例），连接由 FakeTrader 代替；session.created 为已建立的连接。
+    """
+    from loggers.my_logger import SingletonMeta
+    from trader import session_manager
+
+    # 本测试中新建的单例（TraderSession、OrderGateway、PortfolioState）在测试结束后丢弃
+    monkeypatch.setattr(SingletonMeta, '_instances', {})
+    created = []
+
+    def fake_setup(account, callback=None):
+        created.append(FakeTrader())
+        return created[-1]
+
+    monkeypatch.setattr(session_manager, 'setup_xt_trader', fake_setup)
+    session = session_manager.TraderSession(account='test', health_check_interval=60)
+    session.created = created
+    return session
+
+
+def test_trader_session_reuses_and_reconnects(session):
+    session.health_check_interval = 0
+    first = session.get()
+    assert session.get() is first and len(session.created) == 1
+
+    # 健康检查失败时重连
+    first.alive = False
+    second = session.get()
+    assert second is not first and first.stopped and len(session.created) == 2
+
+    # 断开推送经回调转发后，下一次使用时重连
+    session.callback._notify('on_disconnected')
+    assert session.get() is not second and len(session.created) == 3
+
+
+def test_order_gateway_correlates_async_responses(session):
+    from trader.order_gateway import OrderGateway, OrderRejected, OrderRequest
+
+    def on_order(seq, stock_code):
+        # 第一笔的回报早于 seq 返回
+        if stock_code == '000001.SZ':
+            session.callback._notify('on_order_stock_async_response', SimpleNamespace(seq=seq, order_id=100))
+
+    session.get().on_order = on_order
+    gateway = OrderGateway(session)
+
+    requests = [OrderRequest(code, 23, 100, 11, 10.0) for code in ['000001.SZ', '600000.SH', '000002.SZ']]
+    futures = gateway.submit_many(requests)
+    assert [f.seq for f in futures] == [1, 2, 3]
+    assert futures[0].result(timeout=0).order_id == 100
+
+    session.callback._notify('on_order_stock_async_response', SimpleNamespace(seq=2, order_id=101))
+    session.callback._notify('on_order_error', SimpleNamespace(seq=3, order_id=-1, error_msg='资金不足'))
+    assert futures[1].result(timeout=0).order_id == 101
+    assert isinstance(futures[2].exception(timeout=0), OrderRejected)
+    assert gateway.gather(futures[2:], timeout=0)[0].error_msg == '资金不足'
+
+    responses = gateway.gather(gateway.submit_many(requests[1:2]), timeout=0.01)
+    assert isinstance(responses[0], TimeoutError) and not gateway._pending
+
+
+def test_portfolio_state_follows_pushes(session):
+    from xtquant import xtconstant
+    from trader.portfolio_state import PortfolioState
+
+    trader = session.get()
+    trader.positions = [SimpleNamespace(stock_code='000001.SZ', can_use_volume=100)]
+    state = PortfolioState(session, reconcile_interval=600)
+
+    assert state.reconcile_if_due() and trader.queries == 1
+    assert not state.reconcile_if_due()
+
+    # 持仓推送直接更新内存，不查询
+    session.callback._notify('on_stock_position', SimpleNamespace(stock_code='600000.SH', can_use_volume=200))
+    assert set(state.sellable_positions()) == {'000001.SZ', '600000.SH'}
+
+    # 在途卖出委托不可再卖，撤单后恢复
+    state.mark_selling('600000.SH')
+    assert set(state.sellable_positions()) == {'000001.SZ'}
+    order = SimpleNamespace(order_id=1, stock_code='600000.SH', order_type=xtconstant.STOCK_SELL,
+                            order_status=xtconstant.ORDER_CANCELED)
+    session.callback._notify('on_stock_order', order)
+    assert set(state.sellable_positions()) == {'000001.SZ', '600000.SH'}
+    assert state.orders_with_status(xtconstant.ORDER_CANCELED) == [order]
+
+    # 成交推送后下一次校正以查询结果为准
+    session.callback._notify('on_stock_trade', SimpleNamespace())
+    assert state.reconcile_if_due() and trader.queries == 2
+    assert set(state.sellable_positions()) == {'000001.SZ'}
+
+
+def test_rejected_stop_loss_sell_keeps_position_sellable(session, tmp_path, monkeypatch):
+    from stop_loss import max_profit_journal
+    from stop_loss.stop_loss_main import StopLossProgram
+
+    monkeypatch.setattr(max_profit_journal, 'SNAPSHOT_PATH', tmp_path / 'max_profit.pkl')
+    monkeypatch.setattr(max_profit_journal, 'JOURNAL_PATH', tmp_path / 'max_profit.journal')
+    trader = session.get()
+    trader.positions = [SimpleNamespace(stock_code='600000.SH', can_use_volume=100)]
+    # 使用 fixture 的 session 作为进程内的 TraderSession
+    program = StopLossProgram()
+    program.journal.stop()
+    program.portfolio.reconcile()
+
+    # 下单接口直接拒绝：不标记在途
+    trader.reject_orders = True
+    program.sell_stock('600000.SH', 100)
+    assert set(program.portfolio.sellable_positions()) == {'600000.SH'}
+
+    # 已报出后柜台拒绝：恢复可卖
+    trader.reject_orders = False
+    program.sell_stock('600000.SH', 100)
+    assert program.portfolio.sellable_positions() == {}
+    session.callback._notify('on_order_error', SimpleNamespace(seq=trader.seq, order_id=-1, error_msg='价格超限'))
+    assert set(program.portfolio.sellable_positions()) == {'600000.SH'}
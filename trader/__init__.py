@@ -1,2 +1,3 @@
 from .xt_acc import acc
-from .xt_trader import xt_trader, setup_xt_trader
\ No newline at end of file
+from .xt_trader import setup_xt_trader
+from .session_manager import TraderSession, get_xt_trader
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+异步下单网关。
+
+order_stock 每笔委托都要等待柜台返回，一篮子委托的耗时是 N 个往返。
+OrderGateway 用 order_stock_async 一次性发出全部委托，按接口返回的 seq 登记 Future，
+由 on_order_stock_async_response（成功）或 on_order_error（失败）推送完成对应的 Future，
+调用方可在一个超时时间内等待整篮委托的结果。
+"""
+import threading
+from concurrent.futures import Future, wait
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# 自定义
+from config import config
+from loggers.my_logger import SingletonMeta
+from trader.session_manager import TraderSession
+
+MAX_EARLY_RESPONSES = 1000
+
+
+class OrderRequest(NamedTuple):
+    """
+    一笔委托，字段与 XtQuantTrader.order_stock_async 的参数一致
+    """
+    stock_code: str
+    order_type: int
+    order_volume: int
+    price_type: int
+    price: float
+    strategy_name: str = ''
+    order_remark: str = ''
+
+
+class OrderRejected(RuntimeError):
+    """
+    委托被接口或柜台拒绝
+    """
+
+    def __init__(self, request: OrderRequest, error_msg: str):
+        super().__init__(f"委托 {request.stock_code} 失败：{error_msg}")
+        self.request = request
+        self.error_msg = error_msg
+
+
+class OrderGateway(metaclass=SingletonMeta):
+    """
+    异步下单网关（单例），注册为 TraderSession 的交易推送监听者。
+
+    每个 Future 的结果是 XtOrderResponse（含 order_id、seq），失败时为 OrderRejected。
+    异步回报可能早于 order_stock_async 返回 seq，这类回报先暂存，登记 seq 时再取出。
+
+    :param session: 交易连接，默认使用进程内共享的 TraderSession
+    """
+
+    def __init__(self, session: Optional[TraderSession] = None):
+        self.session = session or TraderSession()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Tuple[OrderRequest, Future]] = {}
+        self._early: Dict[int, Tuple[object, bool]] = {}
+        self.session.add_listener(self)
+
+    def submit(self, request: OrderRequest) -> Future:
+        """
+        异步发出一笔委托
+
+        :return: Future，属性 seq 为下单请求序号
+        """
+        future = Future()
+        future.request = request
+        try:
+            seq = self.session.get().order_stock_async(self.session.account, *request)
+        except Exception as e:
+            future.seq = None
+            future.set_exception(e)
+            return future
+        future.seq = seq
+        if seq is None or seq < 0:
+            future.set_exception(OrderRejected(request, f"order_stock_async 返回 {seq}"))
+            return future
+        with self._lock:
+            early = self._early.pop(seq, None)
+            if early is None:
+                self._pending[seq] = (request, future)
+        if early is not None:
+            self._resolve(future, request, *early)
+        return future
+
+    def submit_many(self, requests: Iterable[OrderRequest]) -> List[Future]:
+        """
+        依次发出全部委托，不等待回报
+        """
+        return [self.submit(request) for request in requests]
+
+    def gather(self, futures: List[Future], timeout: Optional[float] = None) -> List[object]:
+        """
+        在一个超时时间内等待全部委托的回报
+
+        :param timeout: 等待秒数，默认取 config.ini 的 [order_gateway] timeout
+        :return: 与 futures 对应的 XtOrderResponse；失败时为对应的异常（如 OrderRejected），超时为 TimeoutError
+        """
+        if timeout is None:
+            timeout = config.getfloat('order_gateway', 'timeout', fallback=5)
+        wait(futures, timeout=timeout)
+        results = []
+        for future in futures:
+            if not future.done():
+                with self._lock:
+                    self._pending.pop(future.seq, None)
+                results.append(TimeoutError(f"超时：{timeout} 秒内没有回报，seq：{future.seq}"))
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+        return results
+
+    @staticmethod
+    def _resolve(future: Future, request: OrderRequest, message, failed: bool):
+        if future.done():
+            return
+        if failed:
+            future.set_exception(OrderRejected(request, getattr(message, 'error_msg', '')))
+        else:
+            future.set_result(message)
+
+    def _complete(self, seq, message, failed: bool):
+        with self._lock:
+            entry = self._pending.pop(seq, None)
+            if entry is None:
+                # 不是经网关发出的委托（或回报早于 seq 登记），只保留最近的一部分
+                self._early[seq] = (message, failed)
+                if len(self._early) > MAX_EARLY_RESPONSES:
+                    self._early.pop(next(iter(self._early)))
+                return
+        self._resolve(entry[1], entry[0], message, failed)
+
+    def on_order_stock_async_response(self, response):
+        # 柜台拒单时回报的 order_id 小于 0
+        self._complete(response.seq, response, failed=response.order_id < 0)
+
+    def on_order_error(self, order_error):
+        seq = getattr(order_error, 'seq', None)
+        if seq is not None:
+            self._complete(seq, order_error, failed=True)
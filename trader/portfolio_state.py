@@ -0,0 +1,135 @@
+"""
+由交易推送维护的内存持仓和委托。
+
+止损程序原先在每次卖出、每次刷新最高收益率和每 600 秒都调用 query_stock_positions，挂单靠 query_stock_orders 轮询。
+PortfolioState 注册为 TraderSession 的监听者，用 on_stock_position、on_stock_order 推送增量更新持仓和委托，
+行情回调直接读取内存；成交推送或超过 reconcile_interval 后，再用查询结果整体校正一次。
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from xtquant import xtconstant
+# 自定义
+from config import config
+from loggers import logger
+from loggers.my_logger import SingletonMeta
+from trader.session_manager import TraderSession
+
+FAILED_ORDER_STATUSES = (xtconstant.ORDER_CANCELED, xtconstant.ORDER_PART_CANCEL, xtconstant.ORDER_JUNK)
+
+
+class PortfolioState(metaclass=SingletonMeta):
+    """
+    内存中的持仓簿和委托簿（单例）。
+
+    持仓以 XtPosition、委托以 XtOrder 保存，与查询接口返回的对象相同。
+    发出卖出委托后调用 mark_selling，在该委托被拒绝、撤单、废单或下一次校正之前不再视为可卖，避免重复卖出。
+
+    :param session: 交易连接，默认使用进程内共享的 TraderSession
+    :param reconcile_interval: 与查询结果校正的间隔（秒），默认取 config.ini 的 [portfolio_state] reconcile_interval
+    """
+
+    def __init__(self, session: Optional[TraderSession] = None, reconcile_interval: Optional[float] = None):
+        self.session = session or TraderSession()
+        if reconcile_interval is None:
+            reconcile_interval = config.getfloat('portfolio_state', 'reconcile_interval', fallback=600)
+        self.reconcile_interval = reconcile_interval
+        self.lock = threading.Lock()
+        self.positions: Dict[str, object] = {}
+        self.orders: Dict[int, object] = {}
+        self.selling: Set[str] = set()
+        self.stale = True
+        self.last_reconcile = 0.0
+        self.session.add_listener(self)
+
+    def on_stock_position(self, position):
+        with self.lock:
+            self.positions[position.stock_code] = position
+
+    def on_stock_order(self, order):
+        with self.lock:
+            self.orders[order.order_id] = order
+            # 卖出委托撤单或废单后恢复可卖
+            if order.order_type == xtconstant.STOCK_SELL and order.order_status in FAILED_ORDER_STATUSES:
+                self.selling.discard(order.stock_code)
+
+    def on_order_error(self, order_error):
+        # 已登记的卖出委托失败后恢复可卖
+        with self.lock:
+            order = self.orders.get(order_error.order_id)
+            if order is not None and order.order_type == xtconstant.STOCK_SELL:
+                self.selling.discard(order.stock_code)
+
+    def on_stock_trade(self, trade):
+        # 成交后持仓以查询结果为准，下一次 reconcile_if_due 时校正
+        self.stale = True
+
+    def on_disconnected(self):
+        # 断线期间可能漏掉推送
+        self.stale = True
+
+    def reconcile(self):
+        """
+        查询持仓和当日委托，整体替换内存中的数据
+        """
+        account = self.session.account
+        trader = self.session.get()
+        positions = trader.query_stock_positions(account)
+        orders = trader.query_stock_orders(account)
+        if positions is None or orders is None:
+            logger.warning("查询持仓或委托失败，保留内存中的数据")
+            return
+        with self.lock:
+            self.positions = {pos.stock_code: pos for pos in positions}
+            self.orders = {order.order_id: order for order in orders}
+            self.selling.clear()
+            self.stale = False
+            self.last_reconcile = time.time()
+        logger.info(f"已校正持仓信息: {list(self.positions)}")
+
+    def reconcile_if_due(self) -> bool:
+        """
+        有成交推送或超过校正间隔时校正
+
+        :return: 是否进行了校正
+        """
+        if not self.stale and time.time() - self.last_reconcile < self.reconcile_interval:
+            return False
+        try:
+            self.reconcile()
+        except Exception as e:
+            logger.exception(f"校正持仓信息时发生异常: {e}")
+            return False
+        return True
+
+    def mark_selling(self, stock_code: str):
+        """
+        标记已发出卖出委托的股票
+        """
+        with self.lock:
+            self.selling.add(stock_code)
+
+    def unmark_selling(self, stock_code: str):
+        """
+        卖出委托被拒绝后恢复可卖
+        """
+        with self.lock:
+            self.selling.discard(stock_code)
+
+    def sellable_positions(self) -> Dict[str, object]:
+        """
+        可用数量大于 0 且没有在途卖出委托的持仓
+
+        :return: 股票代码 -> XtPosition
+        """
+        with self.lock:
+            return {code: pos for code, pos in self.positions.items()
+                    if pos.can_use_volume > 0 and code not in self.selling}
+
+    def orders_with_status(self, *statuses: int) -> List[object]:
+        """
+        指定状态的委托，如 xtconstant.ORDER_PART_SUCC
+        """
+        with self.lock:
+            return [order for order in self.orders.values() if order.order_status in statuses]
@@ -1,16 +1,16 @@
 from datetime import datetime
 # 自定义
 from trader.xt_acc import acc
-from trader.xt_trader import xt_trader
+from trader.session_manager import get_xt_trader
 from loggers import logger
 from config.data_dic import order_type_dic
 
-xt_trader.subscribe(acc)
 
 def generate_trading_report():
     # order_type_dic = {23: "买入", 24: "卖出"}
 
     today = datetime.now().strftime("%Y-%m-%d")
+    xt_trader = get_xt_trader()
 
     # 查询资产
     asset = xt_trader.query_stock_asset(account=acc)
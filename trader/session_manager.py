@@ -0,0 +1,121 @@
+"""
+进程内复用的交易连接。
+
+每次 setup_xt_trader 都会新建 XtQuantTrader、生成新的会话编号并重新启动、连接、订阅，耗时且会在客户端留下多个会话。
+TraderSession 在每个进程内只保留一个已连接的交易对象：第一次使用时才建立连接，
+连接断开（on_disconnected 推送）或定期健康检查失败时，在下一次 get 时自动重连。
+买入、止损和报告等模块通过 get_xt_trader 取用同一个连接，并可通过 add_listener 接收交易推送。
+"""
+import threading
+import time
+from typing import Optional
+
+from xtquant.xttrader import XtQuantTrader
+# 自定义
+from config import config
+from loggers import logger
+from loggers.my_logger import SingletonMeta
+from trader.xt_acc import acc
+from trader.xt_trader import setup_xt_trader
+from trader.xt_trader_callback import MyXtQuantTraderCallback
+
+
+class TraderSession(metaclass=SingletonMeta):
+    """
+    进程内共享的交易连接（单例）。
+
+    连接在超过 health_check_interval 秒未检查时，下一次 get 先查询一次资产确认连接可用，失败则重连。
+    重连时沿用同一个回调对象，已注册的监听者不需要重新注册。
+
+    :param account: 交易账户
+    :param health_check_interval: 健康检查间隔（秒），默认取 config.ini 的 [xt_trader] health_check_interval
+    """
+
+    def __init__(self, account=acc, health_check_interval: Optional[float] = None):
+        self.account = account
+        if health_check_interval is None:
+            health_check_interval = config.getfloat('xt_trader', 'health_check_interval', fallback=30)
+        self.health_check_interval = health_check_interval
+        self.callback = MyXtQuantTraderCallback()
+        self.callback.add_listener(self)
+        self._lock = threading.RLock()
+        self._trader: Optional[XtQuantTrader] = None
+        self._healthy = False
+        self._last_check = 0.0
+
+    def add_listener(self, listener):
+        """
+        注册交易推送的监听者，见 MyXtQuantTraderCallback
+        """
+        self.callback.add_listener(listener)
+
+    def remove_listener(self, listener):
+        self.callback.remove_listener(listener)
+
+    def on_disconnected(self):
+        self._healthy = False
+
+    def invalidate(self):
+        """
+        标记当前连接不可用，下一次 get 时重新连接
+        """
+        self._healthy = False
+
+    def is_healthy(self) -> bool:
+        """
+        查询一次资产，能返回结果说明连接可用
+        """
+        trader = self._trader
+        if trader is None or not self._healthy:
+            return False
+        try:
+            return trader.query_stock_asset(self.account) is not None
+        except Exception as e:
+            logger.warning(f"交易连接健康检查失败：{e}")
+            return False
+
+    def get(self) -> XtQuantTrader:
+        """
+        返回已连接的交易对象，必要时建立或重建连接
+
+        :return: XtQuantTrader
+        """
+        with self._lock:
+            now = time.time()
+            if self._healthy and now - self._last_check < self.health_check_interval:
+                return self._trader
+            if self.is_healthy():
+                self._last_check = now
+                return self._trader
+            self._reconnect()
+            return self._trader
+
+    def _reconnect(self):
+        old = self._trader
+        self._trader, self._healthy = None, False
+        if old is not None:
+            logger.warning("交易连接不可用，重新连接")
+            try:
+                old.stop()
+            except Exception as e:
+                logger.warning(f"停止旧的交易连接时出错：{e}")
+        self._trader = setup_xt_trader(self.account, callback=self.callback)
+        self._healthy = True
+        self._last_check = time.time()
+        logger.info("交易连接已建立")
+
+    def close(self):
+        """
+        停止交易连接
+        """
+        with self._lock:
+            if self._trader is not None:
+                self._trader.stop()
+            self._trader, self._healthy = None, False
+
+
+def get_xt_trader() -> XtQuantTrader:
+    """
+    返回进程内共享的已连接交易对象
+    """
+    return TraderSession().get()
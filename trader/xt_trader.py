@@ -13,8 +13,13 @@ from trader.xt_acc import acc
 load_dotenv()
 
 
-def setup_xt_trader(acc=acc):
-    callback = MyXtQuantTraderCallback()
+def setup_xt_trader(acc=acc, callback=None):
+    """
+    新建交易连接：启动 XtQuantTrader、连接并订阅账户。进程内请通过 session_manager.get_xt_trader 复用连接。
+
+    :param callback: 交易回调，默认新建 MyXtQuantTraderCallback
+    """
+    callback = callback or MyXtQuantTraderCallback()
 
     path = Path(config['xt_client']['program_dir']).parent.parent / 'userdata_mini/'
     session_id = generate_session_id()
@@ -37,12 +42,8 @@ def setup_xt_trader(acc=acc):
     return xt_trader
 
 
-try:
-    xt_trader = setup_xt_trader()
-except Exception as e:
-    logger.critical("Critical error in main: ", exc_info=e)
-    # xt_trader.subscribe(acc)
-
 if __name__ == '__main__':
+    from trader.session_manager import get_xt_trader
+
     logger.info("启动xt_trader.run_forever")
-    xt_trader.run_forever()
+    get_xt_trader().run_forever()
@@ -17,6 +17,35 @@ from config.data_dic import order_type_dic
 
 
 class MyXtQuantTraderCallback(XtQuantTraderCallback):
+    """
+    交易回调。除记录日志外，把每个推送转发给注册的监听者：监听者实现同名方法（如 on_stock_order）即可收到对应推送，
+    监听者抛出的异常只记录日志，不影响其他监听者。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        注册监听者，重复注册的对象只保留一个
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _notify(self, name, *args):
+        for listener in list(self.listeners):
+            handler = getattr(listener, name, None)
+            if handler is None:
+                continue
+            try:
+                handler(*args)
+            except Exception as e:
+                logger.exception(f"交易回调监听者处理 {name} 时出错：{e}")
 
     def on_disconnected(self):
         """
@@ -24,6 +53,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :return:
         """
         logger.warning("连接丢失，检查客户端是否启动。")
+        self._notify('on_disconnected')
         # 交给错误处理程序处理。
         raise Exception("行情服务连接断开")
         # return None
@@ -35,6 +65,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param order: XtOrder对象
         :return:
         """
+        self._notify('on_stock_order', order)
         logger.info(f"on order callback: {order.stock_code}, {order.order_status}, {order.order_sysid}")
 
     def on_stock_asset(self, asset):
@@ -43,6 +74,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param asset: XtAsset对象
         :return:
         """
+        self._notify('on_stock_asset', asset)
         logger.info(f"on asset callback: {asset.account_id}, cash: {asset.cash}, total_asset: {asset.total_asset}")
 
     def on_stock_trade(self, trade):
@@ -51,6 +83,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param trade: XtTrade对象
         :return:
         """
+        self._notify('on_stock_trade', trade)
         order_type = order_type_dic.get(trade.order_type, '未定义')
         traded_time = datetime.fromtimestamp(trade.traded_time)
         logger.trader(f"【{order_type}-{trade.strategy_name}】\n股票代码: {trade.stock_code}， \n成交金额: {trade.traded_amount}， \n成交数量: {trade.traded_volume}， \n成交价格: {trade.traded_price}， \n成交时间: {traded_time}， \n备注：{trade.order_remark}")
@@ -61,6 +94,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param position: XtPosition对象
         :return:
         """
+        self._notify('on_stock_position', position)
         logger.logger(
             f"交易回调信息【持仓变动】: 证券代码:{position.stock_code};持仓数量:{position.volume}; 可用数量:{position.can_use_volume}; 冻结数量:{position.frozen_volume}; 成本价格：:{position.avg_price}"
         )
@@ -71,6 +105,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param order_error:XtOrderError 对象
         :return:
         """
+        self._notify('on_order_error', order_error)
         logger.error(
             f"交易回调信息【order_error】: {order_error.order_id}, error_id: {order_error.error_id}, error_msg: {order_error.error_msg}")
 
@@ -80,6 +115,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param cancel_error: XtCancelError 对象
         :return:
         """
+        self._notify('on_cancel_error', cancel_error)
         logger.error(
             f"交易回调信息【cancel_error】: {cancel_error.order_id}, error_id: {cancel_error.error_id}, error_msg: {cancel_error.error_msg}")
 
@@ -89,6 +125,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param response: XtOrderResponse 对象
         :return:
         """
+        self._notify('on_order_stock_async_response', response)
         logger.info(
             f"on_order_stock_async_response: {response.account_id}, order_id: {response.order_id}, seq: {response.seq}")
 
@@ -97,6 +134,7 @@ class MyXtQuantTraderCallback(XtQuantTraderCallback):
         :param status: XtAccountStatus 对象
         :return:
         """
+        self._notify('on_account_status', status)
         match status.status:
             case xtconstant.ACCOUNT_STATUS_INVALID:
                 logger.info("账户无效。")
@@ -0,0 +1,153 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+# 自定义
+from config import config
+from loggers import logger
+
+
+@dataclass
+class DownloadSummary:
+    """一次批量下载的结果汇总"""
+    total: int = 0
+    succeeded: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)  # 股票代码 -> 最后一次的错误信息
+    elapsed: float = 0.0
+    task: Optional[Callable[[str], None]] = field(default=None, repr=False)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def __str__(self):
+        return (f"共 {self.total} 只，成功 {len(self.succeeded)} 只，失败 {len(self.failed)} 只，"
+                f"耗时 {self.elapsed:.1f} 秒，失败列表：{list(self.failed)}")
+
+
+class DownloadEngine:
+    """
+    有界并发的下载引擎：固定大小的工作线程池、单次请求超时、失败后指数退避重试。
+
+    下载耗时主要花在与行情服务器的往返上，多个请求并发可以把往返时间重叠起来。
+    超时的请求无法强制中止，只会被放弃并按失败重试，因此线程池预留了同样数量的备用线程。
+    """
+
+    def __init__(
+            self,
+            max_workers: Optional[int] = None,
+            timeout: Optional[float] = None,
+            max_retries: Optional[int] = None,
+            backoff_base: Optional[float] = None,
+            backoff_max: Optional[float] = None,
+    ):
+        self.max_workers = max_workers or config.getint('download', 'max_workers', fallback=8)
+        self.timeout = timeout or config.getfloat('download', 'timeout', fallback=60)
+        self.max_retries = max_retries if max_retries is not None else config.getint('download', 'max_retries',
+                                                                                       fallback=3)
+        self.backoff_base = backoff_base or config.getfloat('download', 'backoff_base', fallback=1)
+        self.backoff_max = backoff_max or config.getfloat('download', 'backoff_max', fallback=30)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        第 attempt 次失败后的等待秒数：指数增长并加入随机抖动，避免同时重试。
+        """
+        delay = min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    def run(
+            self,
+            symbols: List[str],
+            task: Callable[[str], None],
+            progress: Optional[Callable[[int, int, str, bool], None]] = None,
+    ) -> DownloadSummary:
+        """
+        并发执行下载任务。
+
+        :param symbols: 股票代码列表
+        :param task: 下载单只股票的函数，失败时抛出异常
+        :param progress: 进度回调，参数为 (已完成数, 总数, 股票代码, 是否成功)
+        :return: DownloadSummary
+        """
+        summary = DownloadSummary(total=len(symbols), task=task)
+        started = time.monotonic()
+        pending = deque((symbol, 1, 0.0) for symbol in symbols)  # (股票代码, 第几次尝试, 最早开始时间)
+        running = {}  # future -> (股票代码, 第几次尝试, 超时时刻)
+        finished = 0
+
+        def complete(symbol, success, error=None):
+            nonlocal finished
+            finished += 1
+            if success:
+                summary.succeeded.append(symbol)
+            else:
+                summary.failed[symbol] = error
+                logger.error(f"下载股票数据失败：{symbol}，错误信息：{error}")
+            if progress:
+                progress(finished, summary.total, symbol, success)
+            if finished % max(summary.total // 10, 1) == 0 or finished == summary.total:
+                logger.info(f"下载进度：{finished}/{summary.total}")
+
+        def fail(symbol, attempt, error):
+            if attempt < self.max_retries:
+                delay = self.backoff(attempt)
+                logger.warning(f"下载 {symbol} 第 {attempt} 次失败（{error}），{delay:.1f} 秒后重试")
+                pending.append((symbol, attempt + 1, time.monotonic() + delay))
+            else:
+                complete(symbol, False, error)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers * 2, thread_name_prefix='download')
+        try:
+            while pending or running:
+                now = time.monotonic()
+                # 在并发上限内提交已到重试时间的任务
+                for _ in range(len(pending)):
+                    if len(running) >= self.max_workers:
+                        break
+                    symbol, attempt, not_before = pending.popleft()
+                    if not_before > now:
+                        pending.append((symbol, attempt, not_before))
+                        continue
+                    running[executor.submit(task, symbol)] = (symbol, attempt, now + self.timeout)
+
+                wake_times = [deadline for _, _, deadline in running.values()]
+                if len(running) < self.max_workers:
+                    wake_times += [not_before for _, _, not_before in pending]
+                wait_seconds = max(min(wake_times, default=now) - now, 0.01)
+                if running:
+                    done, _ = wait(list(running), timeout=wait_seconds, return_when=FIRST_COMPLETED)
+                else:
+                    done = set()
+                    time.sleep(wait_seconds)
+
+                now = time.monotonic()
+                for future in list(running):
+                    symbol, attempt, deadline = running[future]
+                    if future in done:
+                        del running[future]
+                        error = future.exception()
+                        if error is None:
+                            complete(symbol, True)
+                        else:
+                            fail(symbol, attempt, str(error))
+                    elif now >= deadline:
+                        del running[future]
+                        future.cancel()
+                        fail(symbol, attempt, f"超过 {self.timeout} 秒未返回")
+        finally:
+            # 不等待已放弃的超时请求
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        summary.elapsed = time.monotonic() - started
+        logger.info(f"下载完成：{summary}")
+        return summary
+
+    def retry(self, summary: DownloadSummary, **kwargs) -> DownloadSummary:
+        """
+        用同一个下载函数重试上一次失败的全部股票。
+        """
+        if summary.ok:
+            return summary
+        return self.run(list(summary.failed), summary.task, **kwargs)
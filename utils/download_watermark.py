@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from typing import Optional
+
+from xtquant import xtdata
+from pathlib2 import Path
+# 自定义
+from loggers import logger
+from data.bar_store import BarStore
+
+WATERMARK_PATH = Path(__file__).parent.parent / 'assets/runtime/download_watermark.json'
+
+
+class DownloadWatermark:
+    """
+    按 周期/股票 记录历史数据已下载到的日期（高水位线），下次只下载缺失的区间。
+
+    每条记录同时保存当时最新的除权除息日。若之后出现了新的除权除息日，
+    前复权历史会整体变化，此时水位线失效，该股票重新全量下载，并清除K线存储中的旧数据。
+    """
+
+    def __init__(self, path=None, bar_store: Optional[BarStore] = None):
+        self.path = Path(path) if path is not None else WATERMARK_PATH
+        self.bar_store = bar_store or BarStore()
+        self.lock = threading.Lock()
+        self.marks = self.load()
+
+    def load(self) -> dict:
+        """
+        从文件加载水位线，文件不存在或损坏时返回空字典。
+        """
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"加载下载水位线失败，将全量下载：{e}")
+        return {}
+
+    def save(self):
+        """
+        原子地保存水位线到文件。
+        """
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.marks, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+    def get(self, period: str, stock_code: str) -> Optional[dict]:
+        return self.marks.get(period, {}).get(stock_code)
+
+    @staticmethod
+    def latest_dividend_date(stock_code: str, start_time: str = '') -> str:
+        """
+        查询股票最近一次除权除息日，没有记录时返回空字符串。
+        """
+        factors = xtdata.get_divid_factors(stock_code, start_time=start_time)
+        if factors is None or len(factors) == 0:
+            return ''
+        return str(factors.index.max())[:8]
+
+    def start_time(self, period: str, stock_code: str, default_start: str) -> str:
+        """
+        计算某只股票本次需要下载的起始时间。
+
+        已记录水位线时从水位线当日开始补齐（重新下载最后一天，以覆盖盘中的不完整K线）；
+        若水位线之后出现了新的除权除息，则水位线失效并从 ``default_start`` 全量下载。
+
+        :param period: 时间周期
+        :param stock_code: 股票代码
+        :param default_start: 没有有效水位线时的起始时间
+        :return: 起始时间，格式为 'YYYYMMDD'
+        """
+        mark = self.get(period, stock_code)
+        if not mark:
+            return default_start
+        try:
+            dividend_date = self.latest_dividend_date(stock_code, start_time=mark['end'])
+        except Exception as e:
+            logger.warning(f"查询 {stock_code} 除权除息信息失败，按原水位线下载：{e}")
+            return mark['end']
+        if dividend_date and dividend_date > mark.get('dividend', ''):
+            logger.info(f"{stock_code} 在 {dividend_date} 发生除权除息，前复权历史已变化，重新全量下载")
+            self.invalidate(period, stock_code)
+            return default_start
+        return mark['end']
+
+    def advance(self, period: str, stock_code: str, end_time: str):
+        """
+        下载成功后推进水位线。
+
+        :param end_time: 本次下载的结束时间，格式为 'YYYYMMDD' 或 'YYYYMMDDHHMMSS'
+        """
+        mark = self.get(period, stock_code) or {}
+        dividend = mark.get('dividend', '')
+        if not dividend:
+            try:
+                dividend = self.latest_dividend_date(stock_code)
+            except Exception as e:
+                logger.warning(f"查询 {stock_code} 除权除息信息失败：{e}")
+        with self.lock:
+            self.marks.setdefault(period, {})[stock_code] = {'end': end_time[:8], 'dividend': dividend}
+
+    def invalidate(self, period: str, stock_code: str):
+        """
+        使水位线失效，并清除K线存储中该股票已过期的前复权数据。
+        """
+        with self.lock:
+            self.marks.get(period, {}).pop(stock_code, None)
+        try:
+            self.bar_store.delete(period, stock_code)
+        except Exception as e:
+            logger.error(f"清除 {stock_code} 的K线存储失败：{e}")
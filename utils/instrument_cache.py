@@ -0,0 +1,56 @@
+import threading
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from xtquant import xtdata
+# 自定义
+from loggers import logger
+from loggers.my_logger import SingletonMeta
+
+
+class InstrumentCache(metaclass=SingletonMeta):
+    """
+    按交易日缓存合约的涨跌停价。
+
+    涨停价（UpStopPrice）、跌停价（DownStopPrice）当天不变，每只股票每天只调用一次 xtdata.get_instrument_detail，
+    日期变化时整体清空重建。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.day: Optional[date] = None
+        self.limits: Dict[str, Tuple[float, float]] = {}
+
+    def get_limit_prices(self, stock_codes: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+        """
+        获取涨跌停价，缺失的股票即时查询并缓存
+
+        :param stock_codes: 股票代码列表
+        :return: 股票代码 -> (涨停价, 跌停价)，查询失败的股票不在结果中
+        """
+        with self.lock:
+            today = date.today()
+            if self.day != today:
+                self.day, self.limits = today, {}
+            result = {}
+            for stock_code in stock_codes:
+                limits = self.limits.get(stock_code)
+                if limits is None:
+                    limits = self._query(stock_code)
+                    if limits is None:
+                        continue
+                    self.limits[stock_code] = limits
+                result[stock_code] = limits
+            return result
+
+    @staticmethod
+    def _query(stock_code) -> Optional[Tuple[float, float]]:
+        try:
+            instrument = xtdata.get_instrument_detail(stock_code)
+        except Exception as e:
+            logger.error(f"获取股票 {stock_code} 的合约信息时发生错误: {e}")
+            return None
+        if not instrument:
+            logger.error(f"未能获取股票 {stock_code} 的合约信息")
+            return None
+        return float(instrument["UpStopPrice"]), float(instrument["DownStopPrice"])
@@ -3,12 +3,16 @@ from xtquant import xtdata
 from datetime import datetime
 from pathlib import Path
 import time
-import math
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+import numpy as np
 # 自定义
 from config import config
 from loggers import logger
 from utils.utils_general import is_trading_day
+from utils.download_watermark import DownloadWatermark
+from utils.download_engine import DownloadEngine, DownloadSummary
+from utils.instrument_cache import InstrumentCache
 
 
 def get_targets_list_from_csv():
@@ -28,47 +32,60 @@ def get_targets_list_from_csv():
     return stock_list
 
 
-def get_max_ask_price(stock_code):
+def get_max_ask_prices(stock_codes: List[str]) -> Dict[str, Optional[float]]:
     """
-    获取指定股票代码的五档行情最高报价
+    批量获取股票的买入委托价：取五档卖价、五档买价和最新价 +1% 中的最高者，向上取整到分，且不超过涨停价。
 
-    :param stock_code: 股票代码，例如 "000001.SZ"
-    :return: 最新股价，如果获取失败则返回 None
+    整篮股票只调用一次 xtdata.get_full_tick，涨停价来自按交易日缓存的 InstrumentCache，价格一次性向量化计算。
+
+    :param stock_codes: 股票代码列表，例如 ["000001.SZ", "600000.SH"]
+    :return: 股票代码 -> 委托价；已涨停为 999999，获取失败为 None
     """
+    prices: Dict[str, Optional[float]] = {stock_code: None for stock_code in stock_codes}
     try:
-        # 确保 MiniQmt 已经有所需的数据
-        code_list = [stock_code]
-        data = xtdata.get_full_tick(code_list)
-
-        if stock_code in data and bool(data[stock_code]):
-            time = data[stock_code]['timetag']
-            max_ask_price = max(
-                max(data[stock_code]['askPrice']),  # 最高卖价
-                max(data[stock_code]['bidPrice']),  # 最高买价
-                data[stock_code]['lastPrice'] * 1.01  # 最新价+1%
-            )
-            max_ask_price = math.ceil(max_ask_price * 100) / 100
-            instrument = xtdata.get_instrument_detail(stock_code)
-            # 成交价等于涨停价时
-            if data[stock_code]['lastPrice'] == instrument["UpStopPrice"]:
+        data = xtdata.get_full_tick(list(stock_codes))
+        codes = [stock_code for stock_code in stock_codes if data.get(stock_code)]
+        for stock_code in set(stock_codes) - set(codes):
+            logger.error(f"未能获取股票 {stock_code} 的数据")
+        limits = InstrumentCache().get_limit_prices(codes)
+        codes = [stock_code for stock_code in codes if stock_code in limits]
+        if not codes:
+            return prices
+
+        ticks = [data[stock_code] for stock_code in codes]
+        last_price = np.array([tick['lastPrice'] for tick in ticks], dtype=float)
+        max_ask_price = np.maximum.reduce([
+            np.array([max(tick['askPrice'], default=0) for tick in ticks], dtype=float),  # 最高卖价
+            np.array([max(tick['bidPrice'], default=0) for tick in ticks], dtype=float),  # 最高买价
+            last_price * 1.01,  # 最新价+1%
+        ])
+        max_ask_price = np.ceil(max_ask_price * 100) / 100
+        up_stop_price = np.array([limits[stock_code][0] for stock_code in codes], dtype=float)
+        # 不超过涨停价
+        max_ask_price = np.where(up_stop_price > 0, np.minimum(max_ask_price, up_stop_price), max_ask_price)
+        # 成交价等于涨停价时
+        max_ask_price = np.where(last_price == up_stop_price, 999999, max_ask_price)
+
+        for stock_code, tick, up, price in zip(codes, ticks, up_stop_price, max_ask_price):
+            if price == 999999:
                 logger.warning(f"{stock_code}涨停")
-                return 999999
-            # 不超过涨停价
-            if instrument["UpStopPrice"] > 0:
-                max_ask_price = min(max_ask_price, instrument["UpStopPrice"])
-            else:
+            elif up <= 0:
                 logger.warning(f"{stock_code}涨停价异常")
-
-            # max_ask_price = round(max_ask_price, 2)
-            # 信息
-            logger.info(f"股票:{stock_code}; 时间:{time}; 价格:{max_ask_price}")
-            return max_ask_price
-        else:
-            logger.error(f"未能获取股票 {stock_code} 的数据")
-            return None
+            logger.info(f"股票:{stock_code}; 时间:{tick['timetag']}; 价格:{price}")
+            prices[stock_code] = float(price)
     except Exception as e:
-        logger.error(f"获取股票 {stock_code} 的数据时发生错误: {e}")
-        return None
+        logger.error(f"获取股票 {list(stock_codes)} 的数据时发生错误: {e}")
+    return prices
+
+
+def get_max_ask_price(stock_code):
+    """
+    获取指定股票代码的五档行情最高报价，见 get_max_ask_prices
+
+    :param stock_code: 股票代码，例如 "000001.SZ"
+    :return: 最新股价，如果获取失败则返回 None
+    """
+    return get_max_ask_prices([stock_code])[stock_code]
 
 
 def on_subscribe_data(datas):
@@ -126,29 +143,48 @@ def download_history_data(
         start_time: Optional[str] = None,
         end_time: Optional[str] = None,
         callback: Optional[callable] = None,
-        incrementally: bool = False
-) -> None:
+        incrementally: bool = False,
+        engine: Optional[DownloadEngine] = None,
+        retry_failed: bool = False
+) -> DownloadSummary:
     """
-    下载指定股票列表的历史数据。
+    并发下载指定股票列表的历史数据。
 
     :param stock_list: 股票代码列表，默认为从 CSV 文件获取
     :param period: 时间周期，默认 '1d'
     :param start_time: 起始时间，格式为 'YYYYMMDD'，默认 '20160101'
     :param end_time: 结束时间，格式为 'YYYYMMDD%H%M%S'，默认当前日期
-    :param callback: 下载数据时的回调函数，默认 None
-    :param incrementally: 是否增量下载，默认 False
+    :param callback: 下载进度回调函数，参数为 (已完成数, 总数, 股票代码, 是否成功)，默认 None
+    :param incrementally: 是否增量下载，默认 False。增量下载时按每只股票的下载水位线只补齐缺失区间，
+        ``start_time`` 仅作为没有水位线（或水位线因除权除息失效）时的起始时间
+    :param engine: 下载引擎，默认按 config.ini 的 [download] 配置创建
+    :param retry_failed: 是否在保存水位线之前用 ``engine.retry`` 一次性重试失败的股票，此时返回重试的结果
+    :return: DownloadSummary
     """
     if stock_list is None:
         stock_list = get_targets_list_from_csv()
     start_time = start_time or '20160101'
     end_time = end_time or datetime.now().strftime('%Y%m%d%H%M%S')
+    watermark = DownloadWatermark() if incrementally else None
+    engine = engine or DownloadEngine()
 
-    for stock in stock_list:
-        try:
-            xtdata.download_history_data(stock, period, start_time, end_time, incrementally=incrementally)
-            logger.info(f"成功下载股票数据：{stock}")
-        except Exception as e:
-            logger.error(f"下载股票数据失败：{stock}，错误信息：{e}")
+    def download_one(stock):
+        stock_start = watermark.start_time(period, stock, start_time) if watermark else start_time
+        xtdata.download_history_data(stock, period, stock_start, end_time, incrementally=False)
+        if watermark:
+            watermark.advance(period, stock, end_time)
+        logger.debug(f"成功下载股票数据：{stock}，起始时间：{stock_start}")
+
+    try:
+        summary = engine.run(stock_list, download_one, progress=callback)
+        if retry_failed and not summary.ok:
+            logger.warning(f"部分股票下载失败，统一重试：{list(summary.failed)}")
+            summary = engine.retry(summary)
+    finally:
+        # 重试成功的股票同样推进了水位线，最后统一保存
+        if watermark:
+            watermark.save()
+    return summary
 
 
 def identify_security_type(code):